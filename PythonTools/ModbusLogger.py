@@ -1,9 +1,18 @@
 # try pyModbusTCP
 
 from pyModbusTCP.client import ModbusClient
+import os
+import sys
 import time
 import serial
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'hygen', 'logger'))
+from readplan import read_blocks
+from mlist import compile_mdf
+from pollsched import PollScheduler
+from rowformat import RowFormatter
+
 ## meas = ["name","units",addr,len,gain,offset]
 MLname=0
 MLunits=1
@@ -11,6 +20,10 @@ MLaddr=2
 MLlen=3
 MLgain=4
 MLoff=5
+# merge registers into block reads when at most MaxGap unused registers
+# separate them, keeping each block within MaxBlock registers
+MaxGap=4
+MaxBlock=125
 # MeasList=[["Oil P","psi",1024,1,1.0,0.0],
 #           ["Eng T","degC",1025,1,1.0,0.0],
 #           ["E-Bat","V",1029,1,0.1,0.0],
@@ -35,21 +48,20 @@ MDF=input("Measurement description file (%s): "%(MdfDef))
 if MDF=="":
     MDF=MdfDef
 
-mdf=open(MDF)
-MList=mdf.readlines()
-MeasList=[]
-labels=""
-for (n,line) in enumerate(MList):
-    #print(n,line)
-    rline=line.split(',')
-    #print(rline)
-    if n>=2:
-        MeasList.append([rline[0],rline[1],int(rline[2]),int(rline[3]),float(rline[4]),float(rline[5])])
-        #print(MeasList)
-        labels = labels+format("%s,"%rline[0])
+# parse, validate and plan once; unchanged files come from the cache
+MDFList=compile_mdf(MDF,MaxGap,MaxBlock)
+MeasList=MDFList.meas_list
+labels="".join("%s,"%name for name in MDFList.names)
 
 print(labels)
 print(MeasList)
+# values with a period column in the MDF are read that often, the rest
+# once a second; the loop runs at the fastest period
+Tick=min([p for p in MDFList.periods if p]+[1.0])
+Schedule=PollScheduler(MeasList,MDFList.periods,Tick,max_gap=MaxGap,max_block=MaxBlock)
+print("%d values in %.1f block reads per %.2f s"%(len(MeasList),Schedule.mean_requests(),Tick))
+ShowEvery=max(1,int(round(1.0/Tick)))  # print to the console once a second
+LogFormat=RowFormatter(len(MeasList),4,width=8,trailing=True)
 
 c=ModbusClient
 
@@ -85,25 +97,28 @@ lf.write(labels+"\n")
 
 try:
     # get and display some Modbus data
+    t0=time.time()
+    n=0
     while True:
         if c.is_open():
             #ser.write(b'~*P*~') # send poll command to scale
-            logDisp=""
-            for meas in MeasList:
-                reg1 = c.read_holding_registers(meas[MLaddr],meas[MLlen])
-                #print(reg1)
-                if meas[MLlen]==2:
-                    reg1[0]=reg1[1] + 65536.0*reg1[0]
-                #print(reg1[0])
-                x=float(reg1[0])*meas[MLgain]+meas[MLoff]
-                measDisp = "%20s %10.2f %10s"%(meas[MLname],x,meas[MLunits])
-                print(measDisp)
-                logDisp=logDisp+format("%8.4f,"%x)
+            scan = Schedule.scan(n)
+            if scan is not None:
+                values = Schedule.update(
+                    scan, read_blocks(c.read_holding_registers,scan.plan))
+            else:
+                values = Schedule.values
+            if n%ShowEvery==0:
+                for (meas,x) in zip(MeasList,values):
+                    measDisp = "%20s %10.2f %10s"%(meas[MLname],x,meas[MLunits])
+                    print(measDisp)
+            logDisp=LogFormat.format(values)
         else:
             print("Reopen")
             c.open()
 
-        time.sleep(1)
+        n+=1
+        time.sleep(max(0.0,t0+n*Tick-time.time()))
         scale = 0 #ser.readlines()
         print(scale)
         scale=str(scale)
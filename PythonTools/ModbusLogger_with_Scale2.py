@@ -1,13 +1,20 @@
 # try pyModbusTCP
 
 from pyModbusTCP.client import ModbusClient
+import os
+import sys
 import time
 import serial
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'hygen', 'logger'))
+from readplan import read_blocks
+from mlist import compile_mdf
+from scandecode import ScanDecoder
+from rowformat import RowFormatter
+
 USESCALES = False  # assume the scales will not be used
 weight=[0,0,0,0,0,0,0]  #keep track of previous fule scale weights
-max31=2**31
-max32=2**32
 ## meas = ["name","units",addr,len,gain,offset]
 MLname=0
 MLunits=1
@@ -15,6 +22,10 @@ MLaddr=2
 MLlen=3
 MLgain=4
 MLoff=5
+# merge registers into block reads when at most MaxGap unused registers
+# separate them, keeping each block within MaxBlock registers
+MaxGap=4
+MaxBlock=125
 # MeasList=[["Oil P","psi",1024,1,1.0,0.0],
 #           ["Eng T","degC",1025,1,1.0,0.0],
 #           ["E-Bat","V",1029,1,0.1,0.0],
@@ -32,21 +43,18 @@ MDF=input("Measurement description file (%s): "%(MdfDef))
 if MDF=="":
     MDF=MdfDef
 
-mdf=open(MDF)
-MList=mdf.readlines()
-MeasList=[]
-labels=""
-for (n,line) in enumerate(MList):
-    #print(n,line)
-    rline=line.split(',')
-    #print(rline)
-    if n>=2:
-        MeasList.append([rline[0],rline[1],int(rline[2]),int(rline[3]),float(rline[4]),float(rline[5])])
-        #print(MeasList)
-        labels = labels+format("%s,"%rline[0])
+# parse, validate and plan once; unchanged files come from the cache
+MDFList=compile_mdf(MDF,MaxGap,MaxBlock)
+MeasList=MDFList.meas_list
+labels="".join("%s,"%name for name in MDFList.names)
 
 print(labels)
 #print(MeasList)
+ReadPlan=MDFList.plan
+print("%d values in %d block reads"%(len(MeasList),len(ReadPlan)))
+# 32-bit values are signed, missed MODBUS blocks come back as -9999.9
+Decoder=ScanDecoder(MeasList,ReadPlan,signed=[m[MLlen]==2 for m in MeasList])
+LogFormat=RowFormatter(len(MeasList),6,width=8,trailing=True)  #need 6 digits for time to dislay seconds
 
 c=ModbusClient
 
@@ -96,30 +104,12 @@ try:
         if c.is_open():
             if USESCALES:
                 ser.write(b'~*P*~') # send poll command to scale
-            logDisp=""
-            for meas in MeasList:
-                try:
-                    reg1 = c.read_holding_registers(meas[MLaddr],meas[MLlen])
-                    if type(reg1)=='NoneType':
-                        x = -9999.9     # special place holder / flag for missed MODBUS data
-                    else:
-                        #print(reg1)
-                        if meas[MLlen]==2:
-                            reg1[0]=reg1[1] + 65536.0*reg1[0]
-                            if reg1[0]>max31:
-                                reg1[0]=reg1[0]-max32-1
-                        #print(reg1[0])
-                        x=float(reg1[0])*meas[MLgain]+meas[MLoff]
-                except TypeError as e:  # flag error for debug purposes
-                    print("reg1=",reg1)
-                    print("meas=",meas)
-                    print(e)
-                    lf.write("-- TypeError Occured --\r\n\n")
-                    x=-9999.8
-
+            values = Decoder.decode_blocks(
+                read_blocks(c.read_holding_registers,ReadPlan))
+            for (meas,x) in zip(MeasList,values):
                 measDisp = "%20s %10.2f %10s"%(meas[MLname],x,meas[MLunits])
                 print(measDisp)
-                logDisp=logDisp+format("%8.6f,"%x) #need 6 digits for time to dislay seconds
+            logDisp=LogFormat.format(values)
         else:
             print("Reopen")
             c.open()
@@ -4,6 +4,7 @@ Run a test and record the output
 from util import get_input
 from deepseaclient import DeepSeaClient
 from analogclient import AnalogClient
+from rowformat import RowFormatter
 import Adafruit_BBIO.PWM as PWM
 from step_pwm import PWMInput
 import time
@@ -54,6 +55,9 @@ while os.path.exists(log_dir + today + "_run%d.csv"%i):
 
 logfile_name = log_dir + today + "_run%d.csv" % i
 
+# Time stamp column; the deepsea and analog columns come from the clients
+stamp = RowFormatter(0, time_precision=6, trailing=True)
+
 with open(logfile_name, mode="w") as f:
     print("Opened file")
     input_thread.start()
@@ -90,7 +94,9 @@ with open(logfile_name, mode="w") as f:
             PWM.set_duty_cycle(rpm_sig, rpm_val)
 
             # Log the data for this timestamp
-            s = str(time.time()) + "," + deepsea.csv_line() + analog.csv_line()[:-1] + '\n'
+            # analog.csv_line() has no trailing comma to strip
+            s = stamp.format((), time.time()) + deepsea.csv_line() \
+                + analog.csv_line() + '\n'
             f.write(s)
 
             if i == 10:
@@ -0,0 +1,137 @@
+"""
+Hardware backends for AnalogClient.
+
+A backend provides read_raw(pin), returning the ADC reading in millivolts,
+along with the monotonic() clock and sleep() function the sampling loop
+should use. AdafruitADC drives the BeagleBone ADC. SimulatedADC replays
+recorded or synthetic signals so the analog pipeline can be run and load
+tested on any machine.
+"""
+
+import math
+import time
+import monotonic
+
+
+class AdafruitADC(object):
+    """
+    The BeagleBone ADC, through Adafruit_BBIO.
+    """
+
+    def __init__(self):
+        import Adafruit_BBIO.ADC as ADC
+        self._adc = ADC
+        self._adc.setup()
+
+    def read_raw(self, pin):
+        return self._adc.read_raw(pin)
+
+    def monotonic(self):
+        return monotonic.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedADC(object):
+    """
+    A simulated ADC playing back a signal on each pin.
+
+    Each signal is either a callable giving the raw value (millivolts) at a
+    time in seconds since the simulation started, or a sequence of raw
+    values recorded every 'period' seconds, which is replayed in a loop.
+
+    speed: how many times faster than real time to run. None runs as fast
+        as possible: time is virtual and sleep() returns immediately after
+        moving the clock forward.
+    """
+
+    def __init__(self, signals, period=0.1, speed=1.0):
+        self._signals = {}
+        for pin, signal in signals.items():
+            if callable(signal):
+                self._signals[pin] = signal
+            else:
+                self._signals[pin] = self._replay(list(signal), period)
+        self.speed = speed
+        self._start = monotonic.monotonic()
+        self._now = 0.0
+        self.reads = 0
+
+    @staticmethod
+    def _replay(values, period):
+        if not values:
+            raise ValueError("Cannot replay an empty signal")
+
+        def signal(t):
+            return values[int(t / period) % len(values)]
+        return signal
+
+    def read_raw(self, pin):
+        try:
+            signal = self._signals[pin]
+        except KeyError:
+            raise ValueError("No simulated signal on %s" % pin)
+        self.reads += 1
+        return float(signal(self.elapsed()))
+
+    def elapsed(self):
+        """
+        Return the simulated time in seconds since the simulation started.
+        """
+        if self.speed is None:
+            return self._now
+        return (monotonic.monotonic() - self._start) * self.speed
+
+    def monotonic(self):
+        return self.elapsed()
+
+    def sleep(self, seconds):
+        if self.speed is None:
+            self._now += max(seconds, 0.0)
+        else:
+            time.sleep(seconds / self.speed)
+
+    @classmethod
+    def from_log(cls, path, columns, period=None, speed=1.0,
+                 time_column='linuxtime'):
+        """
+        Build a simulator replaying scaled values from a CSV test log.
+
+        columns: {pin: (column name, gain, offset)}. The logged values are
+            converted back to raw millivolts by undoing gain and offset.
+        period: seconds between log rows. By default it is the median
+            spacing of time_column.
+        Missing values are filled from the reading before them (or after,
+        at the start of the log), so every pin replays the same rows.
+        """
+        import pandas as pd
+        log = pd.read_csv(path)
+        if period is None:
+            period = float(log[time_column].diff().median())
+        signals = {}
+        for pin, (name, gain, offset) in columns.items():
+            values = log[name].ffill().bfill()
+            if values.isnull().any():
+                raise ValueError("No values of %s in %s" % (name, path))
+            signals[pin] = list((values - offset) / gain * 1000.)
+        return cls(signals, period, speed)
+
+
+def sine(amplitude, frequency, mean=0.0, phase=0.0):
+    """
+    Return a synthetic signal: a sine wave in millivolts.
+    """
+    def signal(t):
+        return mean + amplitude * math.sin(2 * math.pi * frequency * t
+                                           + phase)
+    return signal
+
+
+def constant(value):
+    """
+    Return a synthetic signal holding a fixed value in millivolts.
+    """
+    def signal(t):
+        return value
+    return signal
@@ -1,14 +1,27 @@
 """
 A module to asynchronously read in values from the ADC inputs.
 All values are read in at the same frequency.
+
+Every input is read once per tick, on a schedule of absolute deadlines
+(tick n is due at t0 + n * frequency / averages), into a preallocated
+window of samples. At the end of each window the mean, min, max and
+standard deviation of every input are computed in one vectorized step.
+
+reconfigure() hands the thread a new configuration, which it switches to
+between two windows, so a reload does not leave a gap in the data.
 """
 
-import monotonic
-import time
+from collections import namedtuple
 import sys
-import Adafruit_BBIO.ADC as ADC
+import numpy as np
 
 from asynciothread import AsyncIOThread
+from adcbackend import AdafruitADC
+from datastore import DataStore
+import livereload
+import metrics
+from rowformat import RowFormatter
+from mlist import check_analog
 
 NAME = 0
 UNITS = 1
@@ -16,10 +29,15 @@ PIN = 2
 GAIN = 3
 OFFSET = 4
 
+# Statistics of one input over one averaging window, in scaled units.
+# samples is the number of good readings the statistics are based on.
+WindowStats = namedtuple('WindowStats',
+                         ['mean', 'min', 'max', 'std', 'samples'])
+
 
 class AnalogClient(AsyncIOThread):
 
-    def __init__(self, aconfig, handlers, data_store):
+    def __init__(self, aconfig, handlers, data_store, backend=None):
         """
         Set up a thread to read in analog values
         aconfig: the configuration values to read in
@@ -27,26 +45,40 @@ class AnalogClient(AsyncIOThread):
              'frequency': 0.1, # seconds
              'averages': 8, # Number of values to average
             }
+        data_store: where averaged values are published, keyed by pin. A
+            datastore.DataStore gives readers consistent snapshots; a
+            plain dict also works.
+        backend: where readings and time come from (see adcbackend.py),
+            by default the BeagleBone ADC
         """
         super(AnalogClient, self).__init__(handlers)
 
         # Read configuration values
         AnalogClient.check_config(aconfig)
-        self._input_list = aconfig['measurements']
-        self.frequency = aconfig['frequency']
-        self.averages = aconfig['averages']
-        if self.averages == 0:
-            raise ValueError("Cannot average 0 values")
-        self.mfrequency = self.frequency / self.averages
-
-        # Initialize our array of values
         self.data_store = data_store
-        self.data_store.update({m[PIN]: None for m in self._input_list})
-        self.partial_values = {m[PIN]: (0.0, 0) for m in self._input_list}
-        self.last_updated = monotonic.monotonic()
+        self._layout = ([], None)
+        self.stats = {}
+        self._configure(aconfig)
+        self._pending = None  # configuration waiting for a window boundary
+        livereload.register('analog', self)
+
+        # Sampling health: ticks in the last window that produced a sample,
+        # and ticks skipped in total because their deadline had passed
+        self.achieved_samples = 0
+        self.missed_deadlines = 0
+        self._m_samples = metrics.histogram(
+            'analog_window_samples', "Samples read per averaging window",
+            buckets=metrics.SIZE_BUCKETS)
+        self._m_missed = metrics.counter(
+            'analog_missed_deadlines_total',
+            "Sample ticks skipped because their deadline had passed")
+        self._m_errors = metrics.counter(
+            'analog_read_errors_total', "Failed ADC readings")
 
         # Open the ADC
-        ADC.setup()
+        if backend is None:
+            backend = AdafruitADC()
+        self._adc = backend
 
         # Log to debug that we've started
         self._logger.debug("Started analogclient")
@@ -61,68 +93,178 @@ class AnalogClient(AsyncIOThread):
         for val in required_config:
             if val not in aconfig:
                 raise ValueError("Missing " + val + ", required for modbus")
+        if aconfig['averages'] == 0:
+            raise ValueError("Cannot average 0 values")
         # Make sure the measurements are in the right format
-        for m in aconfig['measurements']:
-            try:
-                assert len(m) == 5
-                assert isinstance(m[NAME], str)
-                assert isinstance(m[UNITS], str)
-                assert isinstance(m[PIN], str)
-                assert isinstance(m[GAIN], float)
-                assert isinstance(m[OFFSET], float)
-            except AssertionError:
-                raise ValueError("Measurement list formatted incorrectly")
+        check_analog(aconfig['measurements'])
         # If we get to this point, the required values are present
         return True
 
+    def _configure(self, aconfig):
+        """
+        Set up the inputs, timing and sample window from a checked config.
+        """
+        self._input_list = aconfig['measurements']
+        self.frequency = aconfig['frequency']
+        self.averages = aconfig['averages']
+        self.mfrequency = self.frequency / self.averages
+
+        # Start new inputs as missing; inputs kept from the previous
+        # configuration keep their values until the next window ends
+        pins = [m[PIN] for m in self._input_list]
+        old = set(self._layout[0])
+        self.data_store.update({pin: None for pin in pins
+                                if pin not in old})
+        self.stats = {pin: self.stats.get(pin) for pin in pins}
+
+        # One row of raw samples per tick in the current window
+        self._gains = np.array([m[GAIN] for m in self._input_list])
+        self._offsets = np.array([m[OFFSET] for m in self._input_list])
+        self._samples = np.zeros((self.averages, len(self._input_list)))
+        self._rows = 0
+        # Swapped in one assignment so the main thread never reads new pins
+        # with the old row format
+        self._layout = (pins, RowFormatter(len(pins), 3))
+
+    def reconfigure(self, aconfig):
+        """
+        Switch to a new configuration at the end of the current averaging
+        window, so sampling carries on without a gap. Raises ValueError,
+        keeping the current configuration, if the new one is invalid.
+        Can be called from any thread.
+        """
+        AnalogClient.check_config(aconfig)
+        if isinstance(self.data_store, DataStore):
+            for m in aconfig['measurements']:
+                if m[PIN] not in self.data_store:
+                    raise ValueError("Pin %s is not in the data store"
+                                     % m[PIN])
+        self._pending = aconfig
+
     def run(self):
         """
         Overloads Thread.run, runs and reads analog inputs
         """
+        t0 = self._adc.monotonic()
+        tick = 0
+        window_end = self.averages
         while not self._cancelled:
-            t = monotonic.monotonic()
-            # If we've passed the ideal time, get the value
-            if t >= self.last_updated + self.mfrequency:
-                for m in self._input_list:
-                    key = m[PIN]
-                    sum_, n = self.partial_values[key]
-
-                    if n >= self.averages:
-                        average = sum_ / (n * 1000.)
-                        self.data_store[key] = average * m[GAIN] + m[OFFSET]
-                        sum_, n = 0., 0.
-
-                    try:
-                        sum_, n = sum_ + ADC.read_raw(m[PIN]), n + 1
-                    except RuntimeError:  # Shouldn't ever happen
-                        exc_type, exc_value = sys.exc_info()[:2]
-                        self._logger.error("ADC reading error: %s %s"
-                                           % (exc_type, exc_value))
-                    except ValueError:  # Invalid AIN or pin name
-                        exc_type, exc_value = sys.exc_info()[:2]
-                        self._logger.error("Invalid AIN or pin name: %s %s"
-                                           % (exc_type, exc_value))
-                    except IOError:  # File reading error
-                        exc_type, exc_value = sys.exc_info()[:2]
-                        self._logger.error("%s %s", exc_type, exc_value)
-
-                    self.partial_values[key] = sum_, n
-                self.last_updated = t
-
-            time.sleep(0.01)
+            # Skip any tick whose deadline passed more than a tick ago
+            now = self._adc.monotonic()
+            behind = int((now - t0) / self.mfrequency) - tick
+            if behind > 0:
+                self.missed_deadlines += behind
+                self._m_missed.inc(behind)
+                tick += behind
+
+            while tick >= window_end:
+                self._end_window()
+                window_end += self.averages
+
+            if self._pending is not None and self._rows == 0:
+                # Between windows: start the new schedule from this tick
+                t0 += tick * self.mfrequency
+                tick = 0
+                aconfig, self._pending = self._pending, None
+                self._configure(aconfig)
+                window_end = self.averages
+                self._logger.info("Analog configuration reloaded")
+
+            delay = t0 + tick * self.mfrequency - now
+            if delay > 0:
+                self._adc.sleep(delay)
+            self._read_tick()
+            tick += 1
+
+    def _read_tick(self):
+        """
+        Read every input once into the next row of the sample window.
+        Failed readings are stored as NaN.
+        """
+        if self._rows >= self.averages:
+            return
+        row = self._samples[self._rows]
+        for j, pin in enumerate(self._layout[0]):
+            try:
+                row[j] = self._adc.read_raw(pin)
+            except RuntimeError:  # Shouldn't ever happen
+                row[j] = np.nan
+                exc_type, exc_value = sys.exc_info()[:2]
+                self._logger.error("ADC reading error: %s %s"
+                                   % (exc_type, exc_value))
+                self._m_errors.inc()
+            except ValueError:  # Invalid AIN or pin name
+                row[j] = np.nan
+                exc_type, exc_value = sys.exc_info()[:2]
+                self._logger.error("Invalid AIN or pin name: %s %s"
+                                   % (exc_type, exc_value))
+                self._m_errors.inc()
+            except IOError:  # File reading error
+                row[j] = np.nan
+                exc_type, exc_value = sys.exc_info()[:2]
+                self._logger.error("%s %s", exc_type, exc_value)
+                self._m_errors.inc()
+        self._rows += 1
+
+    def _end_window(self):
+        """
+        Compute the statistics of the samples in the window that just
+        ended, publish them, and start a new window.
+        """
+        n = self._rows
+        # Raw readings are in millivolts
+        scaled = (self._samples[:n] / 1000.) * self._gains + self._offsets
+        good = ~np.isnan(scaled)
+        count = good.sum(axis=0)
+        zeroed = np.where(good, scaled, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = zeroed.sum(axis=0) / count
+            std = np.sqrt((np.where(good, scaled - mean, 0.0) ** 2)
+                          .sum(axis=0) / count)
+        low = np.where(good, scaled, np.inf).min(axis=0, initial=np.inf)
+        high = np.where(good, scaled, -np.inf).max(axis=0, initial=-np.inf)
+
+        # Publish the whole window in one update so readers never see
+        # values from two different windows
+        window = {}
+        for j, pin in enumerate(self._layout[0]):
+            if count[j] == 0:
+                window[pin] = None
+                self.stats[pin] = None
+            else:
+                window[pin] = float(mean[j])
+                self.stats[pin] = WindowStats(
+                    float(mean[j]), float(low[j]), float(high[j]),
+                    float(std[j]), int(count[j]))
+        self.data_store.update(window)
+
+        self.achieved_samples = n
+        self._m_samples.observe(n)
+        self._rows = 0
 
     ###################################
     # Methods called from Main Thread
     ###################################
 
+    def _read_values(self):
+        """
+        Return the current value of every input, None for missing, in
+        measurement list order. From a DataStore the values all come from
+        the same averaging window.
+        """
+        return self._read_pins(self._layout[0])
+
+    def _read_pins(self, pins):
+        if isinstance(self.data_store, DataStore):
+            return self.data_store.read(pins)
+        return [self.data_store[pin] for pin in pins]
+
     def print_data(self):
         """
         Print all the data as we currently have it, in human-
         readable format.
         """
-        for m in self._input_list:
-            key = m[PIN]
-            val = self.data_store[key]
+        for m, val in zip(self._input_list, self._read_values()):
             if val is None:
                 display = "%20s %10s %10s" % (m[NAME], "ERR", m[UNITS])
             else:
@@ -138,17 +280,26 @@ class AnalogClient(AsyncIOThread):
             names.append(m[NAME])
         return ','.join(str(x) for x in names)
 
+    def column_list(self):
+        """
+        Return the column descriptions for a binary log file:
+        [(name, units, gain, offset), ...]
+        """
+        return [(m[NAME], m[UNITS], m[GAIN], m[OFFSET])
+                for m in self._input_list]
+
+    def value_list(self):
+        """
+        Return a list of the data we currently have, with None for
+        missing values, in the same order as column_list.
+        """
+        return self._read_values()
+
     def csv_line(self):
         """
         Return a CSV line of the data we currently have.
 
         The line is returned with no new line or trailing comma.
         """
-        values = []
-        for m in self._input_list:
-            val = self.data_store[m[PIN]]
-            if val is not None:
-                values.append("{:.3f}".format(val))
-            else:
-                values.append('')
-        return ','.join(values)
+        pins, row_format = self._layout
+        return row_format.format(self._read_pins(pins))
@@ -0,0 +1,168 @@
+"""
+A compact binary log format to use alongside CSV.
+
+A binary log file is laid out as:
+- the 8 byte magic string MAGIC
+- a little-endian uint32 giving the length of the JSON header
+- the JSON header, padded with spaces to a multiple of 8 bytes:
+    {"version": 1,
+     "dtype": "<f4",
+     "columns": [{"name": ..., "units": ..., "gain": ..., "offset": ...}]}
+- fixed-width little-endian records: a float64 UNIX timestamp followed by
+  one value of the header's dtype per column. Missing values are NaN.
+
+Because every record has the same width, a file (even one cut short by a
+power loss) can be memory-mapped straight into a NumPy structured array.
+Compressed files (e.g. .bin.gz) hold the same layout once decompressed.
+"""
+
+import io
+import json
+import os
+import struct
+
+import compress
+
+MAGIC = b'HGBLOG01'
+VERSION = 1
+
+# dtype names accepted in the configuration and their struct codes
+DTYPES = {
+    'float32': ('<f4', 'f'),
+    'float64': ('<f8', 'd'),
+}
+
+NAN = float('nan')
+
+
+def make_header(columns, dtype='float32', extra=None):
+    """
+    Return the header bytes for a file holding the given columns.
+
+    columns: [(name, units, gain, offset), ...]
+    dtype: 'float32' or 'float64'
+    extra: further items to store in the header, e.g. what triggered a
+        snapshot. They cannot replace the standard ones.
+    """
+    if dtype not in DTYPES:
+        raise ValueError("Invalid binary log dtype: %s" % dtype)
+    header = {
+        'version': VERSION,
+        'dtype': DTYPES[dtype][0],
+        'columns': [{'name': name, 'units': units,
+                     'gain': gain, 'offset': offset}
+                    for (name, units, gain, offset) in columns],
+    }
+    if extra:
+        for key, value in extra.items():
+            if key in header:
+                raise ValueError("Reserved header item: %s" % key)
+            header[key] = value
+    text = json.dumps(header).encode('utf-8')
+    # Pad so that the records start on an 8 byte boundary
+    length = len(text) + (-(len(MAGIC) + 4 + len(text)) % 8)
+    text = text.ljust(length, b' ')
+    return MAGIC + struct.pack('<I', length) + text
+
+
+def record_struct(ncolumns, dtype='float32'):
+    """
+    Return a struct.Struct packing one record of ncolumns values.
+    """
+    return struct.Struct('<d' + DTYPES[dtype][1] * ncolumns)
+
+
+def pack_records(rec_struct, records):
+    """
+    Pack a batch of records into one bytes object.
+
+    records: sequences of (timestamp, value, value, ...). None values are
+        stored as NaN.
+    """
+    return b''.join(
+        rec_struct.pack(*[NAN if v is None else v for v in r])
+        for r in records)
+
+
+def write_binlog(path, columns, times, values, dtype='float32', extra=None,
+                 compression=None):
+    """
+    Write a whole binary log file from arrays in one go.
+
+    times: one timestamp per record
+    values: a 2D array with one row per record and one column per entry
+        of columns, [(name, units, gain, offset), ...]
+    compression: None, or a method from compress.METHODS
+    """
+    import numpy as np
+    header = make_header(columns, dtype, extra)
+    records = np.empty(len(times), dtype=np.dtype(
+        [('time', '<f8')]
+        + [(c[0], DTYPES[dtype][0]) for c in columns]))
+    records['time'] = times
+    for j, c in enumerate(columns):
+        records[c[0]] = values[:, j]
+    with compress.open_log(path, 'wb', compression) as f:
+        f.write(header)
+        f.write(records.tobytes())
+
+
+def read_header(f):
+    """
+    Read the header from the start of an open binary log file.
+    Returns (header dict, offset of the first record).
+    """
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a binary log file")
+    length, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(length).decode('utf-8'))
+    return header, len(MAGIC) + 4 + length
+
+
+def record_dtype(header):
+    """
+    Return the NumPy structured dtype of one record described by header.
+    """
+    import numpy as np
+    fields = [('time', '<f8')]
+    fields += [(c['name'], header['dtype']) for c in header['columns']]
+    return np.dtype(fields)
+
+
+def read_binlog(path):
+    """
+    Memory-map a binary log file.
+
+    Returns (header, records) where records is a read-only NumPy structured
+    array with a 'time' field and one field per column. A trailing partial
+    record is ignored. Compressed files (see compress.py) are read into
+    memory instead.
+    """
+    import numpy as np
+    if compress.method_of(path) is not None:
+        data = compress.read_all(path)
+        header, offset = read_header(io.BytesIO(data))
+        dtype = record_dtype(header)
+        count = (len(data) - offset) // dtype.itemsize
+        return header, np.frombuffer(data, dtype=dtype, count=count,
+                                     offset=offset)
+    with open(path, 'rb') as f:
+        header, offset = read_header(f)
+    dtype = record_dtype(header)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r',
+                             offset=offset, shape=(count,))
+
+
+def read_dataframe(path):
+    """
+    Read a binary log file into a pandas DataFrame indexed by timestamp.
+    """
+    import pandas as pd
+    header, records = read_binlog(path)
+    df = pd.DataFrame.from_records(records)
+    df.index = pd.to_datetime(df.pop('time'), unit='s')
+    return df
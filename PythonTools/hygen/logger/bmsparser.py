@@ -0,0 +1,222 @@
+"""
+Parse the Beckett BMS serial stream.
+
+The BMS sends one ASCII line per message (see Beckett/ES-0092):
+    001,S,122,002,00,C,043,022,288349,-0248,80000000,002,...,CA74\\r\\n
+The last field is a 4 digit hex Fletcher-16 checksum (sum1 then sum2) of
+everything before it, including the comma. BMSParser takes bytes as they
+arrive, frames complete lines, verifies the checksum and decodes periodic
+string ('S') and module ('M') status reports into typed records.
+
+Currents are reported by the BMS in tenths of an amp, negative when
+charging; voltages in millivolts. Records hold amps and volts. The
+factory reserved field at the end of each report is not kept.
+"""
+
+from collections import namedtuple
+
+import metrics
+
+try:
+    from itertools import accumulate
+except ImportError:  # Python 2
+    def accumulate(iterable):
+        total = 0
+        for x in iterable:
+            total += x
+            yield total
+
+# Indices of the comma separated fields common to all messages
+PROTOCOL = 0
+TYPE = 1
+LENGTH = 2
+MESSAGE_ID = 3
+STRING_ID = 4
+
+# wh_to_empty, wh_to_full: watt-hours left to full discharge and charge
+# connector_temp: temperature of the front power connector
+StringStatus = namedtuple('StringStatus', [
+    'message_id', 'string_id', 'state', 'soc', 'temperature', 'voltage',
+    'current', 'alarms', 'revision', 'serial', 'master_version',
+    'slave_version', 'wh_to_empty', 'wh_to_full', 'min_cell', 'max_cell',
+    'connector_temp'])
+
+ModuleStatus = namedtuple('ModuleStatus', [
+    'message_id', 'string_id', 'module_id', 'state', 'soc', 'min_temp',
+    'avg_temp', 'max_temp', 'voltage', 'min_cell', 'avg_cell', 'max_cell',
+    'current', 'alarms', 'revision', 'serial', 'master_version',
+    'slave_version', 'connector_temp'])
+
+# Lines seen by all parsers, by what became of them
+LINES = {r: metrics.counter('bms_lines_total', "BMS lines by result",
+                            {'result': r})
+         for r in ('record', 'checksum_error', 'malformed', 'unknown')}
+
+# Longest line we expect; anything longer without a new-line is garbage
+MAX_LINE = 256
+
+
+def fletcher16(data):
+    """
+    Return (sum1, sum2) of the BMS Fletcher-16 checksum of data.
+    """
+    data = bytearray(data)
+    return sum(data) % 255, sum(accumulate(data)) % 255
+
+
+def _decode_string(fields):
+    return StringStatus(
+        message_id=int(fields[MESSAGE_ID]),
+        string_id=int(fields[STRING_ID]),
+        state=fields[5].strip(),
+        soc=int(fields[6]),
+        temperature=int(fields[7]),
+        voltage=int(fields[8]) / 1000.,
+        current=int(fields[9]) / 10.,
+        alarms=int(fields[10], 16),
+        revision=int(fields[11]),
+        serial=fields[12].strip(),
+        master_version=int(fields[13]),
+        slave_version=int(fields[14]),
+        wh_to_empty=int(fields[15]),
+        wh_to_full=int(fields[16]),
+        min_cell=int(fields[17]) / 1000.,
+        max_cell=int(fields[18]) / 1000.,
+        connector_temp=int(fields[19]))
+
+
+def _decode_module(fields):
+    return ModuleStatus(
+        message_id=int(fields[MESSAGE_ID]),
+        string_id=int(fields[STRING_ID]),
+        module_id=int(fields[5]),
+        state=fields[6].strip(),
+        soc=int(fields[7]),
+        min_temp=int(fields[8]),
+        avg_temp=int(fields[9]),
+        max_temp=int(fields[10]),
+        voltage=int(fields[11]) / 1000.,
+        min_cell=int(fields[12]) / 1000.,
+        avg_cell=int(fields[13]) / 1000.,
+        max_cell=int(fields[14]) / 1000.,
+        current=int(fields[15]) / 10.,
+        alarms=int(fields[16], 16),
+        revision=int(fields[17]),
+        serial=fields[18].strip(),
+        master_version=int(fields[19]),
+        slave_version=int(fields[20]),
+        connector_temp=int(fields[21]))
+
+
+DECODERS = {
+    'S': _decode_string,
+    'M': _decode_module,
+}
+
+
+class BMSParser(object):
+
+    def __init__(self, skip=0, max_line=MAX_LINE):
+        """
+        Set up an incremental parser.
+
+        skip: number of bytes to ignore at the start of every line, e.g. 9
+            for logs with an "HH:MM:SS," time stamp in front of each message
+        """
+        self.skip = skip
+        self.max_line = max_line
+        self._buf = bytearray()
+
+        # Counters of lines that could not be used
+        self.checksum_errors = 0
+        self.malformed = 0
+        self.unknown = 0
+        self.records = 0
+
+    def feed(self, data):
+        """
+        Consume bytes from the stream. Returns a list of the records
+        completed by this data, in order.
+        """
+        buf = self._buf
+        buf += data
+        records = []
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                break
+            record = self.parse_line(bytes(buf[start + self.skip:end]))
+            if record is not None:
+                records.append(record)
+            start = end + 1
+        del buf[:start]
+        if len(buf) > self.max_line:
+            # No line ending in sight; drop the garbage and resynchronise
+            self.malformed += 1
+            LINES['malformed'].inc()
+            del buf[:]
+        return records
+
+    def parse_line(self, line):
+        """
+        Check and decode one message line (without its new-line). Returns
+        a StringStatus or ModuleStatus, or None if the line is unusable.
+        """
+        line = line.rstrip(b'\r')
+        if len(line) < 5:
+            if line:
+                self.malformed += 1
+                LINES['malformed'].inc()
+            return None
+        body, check = line[:-4], line[-4:]
+        try:
+            expected = int(check, 16)
+        except ValueError:
+            self.malformed += 1
+            LINES['malformed'].inc()
+            return None
+        # The BMS reduces its sums to 1..255 where we get 0..254, so a sent
+        # 0xFF byte stands for 0
+        sum1, sum2 = fletcher16(body)
+        if (sum1 != (expected >> 8) % 255
+                or sum2 != (expected & 0xFF) % 255):
+            self.checksum_errors += 1
+            LINES['checksum_error'].inc()
+            return None
+
+        try:
+            fields = body.decode('ascii').split(',')
+        except UnicodeDecodeError:
+            self.malformed += 1
+            LINES['malformed'].inc()
+            return None
+        decode = DECODERS.get(fields[TYPE]) if len(fields) > TYPE else None
+        if decode is None:
+            self.unknown += 1
+            LINES['unknown'].inc()
+            return None
+        try:
+            record = decode(fields)
+        except (ValueError, IndexError):
+            self.malformed += 1
+            LINES['malformed'].inc()
+            return None
+        self.records += 1
+        LINES['record'].inc()
+        return record
+
+
+def parse_file(path, skip=0, chunk_size=1 << 20):
+    """
+    Generate the records in an archived BMS stream file, reading it in
+    chunks of chunk_size bytes.
+    """
+    parser = BMSParser(skip)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            for record in parser.feed(chunk):
+                yield record
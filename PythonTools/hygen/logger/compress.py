@@ -0,0 +1,195 @@
+"""
+Compressed log files that stay readable after a power loss.
+
+A compressed log is written as a series of complete, independent frames:
+everything written since the last flush is compressed into one frame
+and appended to the file, then flushed. gzip, zstd and lz4 readers all
+accept concatenated frames as one stream, so a file cut off by a power
+loss loses at most the data since its last flush.
+
+gzip is always available. zstd needs the 'zstandard' package and lz4 the
+'lz4' package; they are only imported when used.
+"""
+
+import io
+import sys
+import zlib
+
+# Compression methods and the extension they add to a file name
+METHODS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+}
+
+# Most uncompressed bytes held before a frame is written without a flush
+MAX_FRAME = 1 << 20
+
+
+def _gzip_frame(data):
+    # wbits 31 makes a complete gzip member rather than a raw zlib stream
+    c = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def compressor(method):
+    """
+    Return a function compressing bytes into one complete frame of the
+    method. Raises ValueError for an unknown or unavailable method.
+    """
+    if method == 'gzip':
+        return _gzip_frame
+    try:
+        if method == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(write_checksum=True).compress
+        if method == 'lz4':
+            import lz4.frame
+            return lz4.frame.compress
+    except ImportError:
+        raise ValueError("Compression %s needs a package which is not "
+                         "installed" % method)
+    raise ValueError("Invalid compression: %s" % method)
+
+
+def method_of(path):
+    """
+    Return the compression method of a file from its extension, or None.
+    """
+    for method, ext in METHODS.items():
+        if path.endswith(ext):
+            return method
+    return None
+
+
+class FrameWriter(io.RawIOBase):
+    """
+    A binary file which compresses what is written to it one frame per
+    flush.
+    """
+
+    def __init__(self, raw, compress, max_frame=MAX_FRAME):
+        self._raw = raw
+        self._compress = compress
+        self._max_frame = max_frame
+        self._pending = bytearray()
+        self.name = raw.name
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pending += data
+        if len(self._pending) >= self._max_frame:
+            self._write_frame()
+        return len(data)
+
+    def _write_frame(self):
+        if self._pending:
+            self._raw.write(self._compress(bytes(self._pending)))
+            del self._pending[:]
+
+    def flush(self):
+        if not self.closed:
+            self._write_frame()
+            self._raw.flush()
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    def tell(self):
+        """
+        Return the number of compressed bytes in the file so far.
+        """
+        return self._raw.tell()
+
+    def close(self):
+        if not self.closed:
+            try:
+                super(FrameWriter, self).close()  # flushes the last frame
+            finally:
+                self._raw.close()
+
+
+def open_log(path, mode, method=None, buffer_size=-1):
+    """
+    Open a log file for writing in mode 'w' (text) or 'wb', compressed by
+    method if it is not None.
+    """
+    if method is None:
+        return open(path, mode, buffer_size)
+    f = FrameWriter(open(path, 'wb', buffer_size), compressor(method))
+    if 'b' not in mode and sys.version_info[0] == 3:
+        # Flushing the wrapper flushes the frame writer, ending a frame
+        return io.TextIOWrapper(f, encoding='utf-8', newline='')
+    return f
+
+
+def open_reader(path):
+    """
+    Open a log file for reading as bytes, decompressing it if its
+    extension says it is compressed. Reading a truncated last frame raises
+    an error; use read_all to keep the data before it.
+    """
+    method = method_of(path)
+    if method is None:
+        return open(path, 'rb')
+    if method == 'gzip':
+        import gzip
+        return gzip.open(path, 'rb')
+    if method == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+    import lz4.frame
+    return lz4.frame.open(path, 'rb')
+
+
+def _decompressor(method):
+    """
+    Return (decompressor, errors): a new object decompressing one frame of
+    the method, and the exceptions it raises on damaged data.
+    """
+    if method == 'gzip':
+        return zlib.decompressobj(31), (zlib.error,)
+    if method == 'zstd':
+        import zstandard
+        return (zstandard.ZstdDecompressor().decompressobj(),
+                (zstandard.ZstdError,))
+    import lz4.frame
+    return lz4.frame.LZ4FrameDecompressor(), (RuntimeError,)
+
+
+def read_all(path):
+    """
+    Return the decompressed contents of a log file. The file is decoded
+    frame by frame, so everything before a damaged or truncated frame (the
+    last one, after a power loss) is kept.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    method = method_of(path)
+    if method is None:
+        return data
+    frames = []
+    while data:
+        d, errors = _decompressor(method)
+        try:
+            frame = d.decompress(data)
+        except errors:
+            break
+        if not d.eof:
+            break  # truncated
+        frames.append(frame)
+        data = d.unused_data
+    return b''.join(frames)
+
+
+def uncompressed_name(path):
+    """
+    Return path without any compression extension.
+    """
+    method = method_of(path)
+    if method is None:
+        return path
+    return path[:-len(METHODS[method])]
@@ -0,0 +1,264 @@
+"""
+A fixed-layout store for the latest value of every channel.
+
+The store is one flat buffer: an int64 sequence number followed by one
+float64 slot per channel, with NaN standing for a missing value. A single
+writer updates it seqlock-style: the sequence number is odd while a write
+is in progress and is bumped to the next even number when the write is
+complete. Readers copy the slots and retry if the sequence number moved,
+so every snapshot holds the values of one complete write, never a mix of
+two scans. A reader gives up after SNAPSHOT_TIMEOUT seconds of a write in
+progress, e.g. if the writer process died mid-write, and falls back to
+the last consistent copy it read; it does not wait again for the same
+stuck write. A store opened on an existing buffer whose write stays stuck
+that long is taken over: the sequence number is bumped back to even.
+
+The buffer can live in ordinary memory, for threads, or in
+multiprocessing shared memory so that acquisition, file writing and
+display can run in separate processes.
+"""
+
+import logging
+import time
+
+import monotonic
+import numpy as np
+
+SEQ_SIZE = 8  # bytes for the sequence number
+SNAPSHOT_TIMEOUT = 1.0  # seconds a reader waits for a write to finish
+
+
+class DataStore(object):
+
+    def __init__(self, keys, buf=None):
+        """
+        Lay out a store with one slot per key, in order.
+
+        buf: a writable buffer of at least DataStore.size(keys) bytes to
+            hold the store, by default newly allocated memory
+        """
+        self.keys = list(keys)
+        self._index = {k: i for i, k in enumerate(self.keys)}
+        if len(self._index) != len(self.keys):
+            raise ValueError("Duplicate keys in data store layout")
+        if buf is None:
+            buf = bytearray(DataStore.size(self.keys))
+            fresh = True
+        else:
+            fresh = False
+        self._buf = buf
+        self._seq = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self._values = np.ndarray((len(self.keys),), dtype=np.float64,
+                                  buffer=buf, offset=SEQ_SIZE)
+        if fresh:
+            self._values[:] = np.nan
+        self._shm = None
+        # The last snapshot read, kept in case the writer dies mid-write
+        self._last_seq = None
+        self._last = np.empty(len(self.keys), dtype=np.float64)
+        self._stuck = None  # sequence of a write given up on
+        if not fresh:
+            self._recover()
+
+    def _wait_even(self):
+        """
+        Wait up to SNAPSHOT_TIMEOUT seconds for a write in progress to
+        finish. Returns the sequence number, odd if the write is stuck.
+        """
+        deadline = None
+        while True:
+            seq = int(self._seq[0])
+            if not seq & 1:
+                return seq
+            now = monotonic.monotonic()
+            if deadline is None:
+                deadline = now + SNAPSHOT_TIMEOUT
+            elif now >= deadline:
+                return seq
+            time.sleep(0)
+
+    def _recover(self):
+        """
+        Finish the write of a writer that died mid-write, so that the
+        store can be read and written again.
+        """
+        seq = self._wait_even()
+        if seq & 1:
+            logging.getLogger(__name__).warning(
+                "Data store write stuck at sequence %d, taking it over"
+                % seq)
+            self._seq[0] = seq + 1
+
+    @staticmethod
+    def size(keys):
+        """
+        Return the number of bytes a store for keys takes.
+        """
+        return SEQ_SIZE + 8 * len(keys)
+
+    @classmethod
+    def create_shared(cls, keys, name=None):
+        """
+        Create a store in a new shared memory block. Other processes can
+        open it with attach(keys, store.name). Requires Python 3.8.
+        """
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=cls.size(keys))
+        store = cls(keys, shm.buf)
+        store._values[:] = np.nan
+        store._seq[0] = 0
+        store._shm = shm
+        return store
+
+    @classmethod
+    def attach(cls, keys, name):
+        """
+        Open a store created by create_shared in another process. keys must
+        be the same list, in the same order.
+        """
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        store = cls(keys, shm.buf)
+        store._shm = shm
+        return store
+
+    @property
+    def name(self):
+        """
+        The shared memory block name, or None for a private store.
+        """
+        return self._shm.name if self._shm is not None else None
+
+    def close(self, unlink=False):
+        """
+        Release the shared memory block, destroying it if unlink is set.
+        """
+        if self._shm is not None:
+            # Views into the block must go before it can be closed
+            self._seq = self._values = None
+            self._shm.close()
+            if unlink:
+                self._shm.unlink()
+            self._shm = None
+
+    @property
+    def sequence(self):
+        """
+        The number of complete writes times two; changes whenever the
+        values do.
+        """
+        return int(self._seq[0])
+
+    ###################################
+    # Writer
+    ###################################
+
+    def update(self, values):
+        """
+        Write a mapping of key: value as one consistent update. None is
+        stored as missing. Raises KeyError or ValueError, without writing
+        anything, if a key is not in the layout or a value is not a
+        number.
+        """
+        # Check everything before the write starts, so a bad update cannot
+        # leave the sequence number odd
+        index = [self._index[key] for key in values]
+        slots = np.array([np.nan if v is None else v
+                          for v in values.values()], dtype=np.float64)
+        self._seq[0] += 1
+        try:
+            self._values[index] = slots
+        finally:
+            self._seq[0] += 1
+
+    def write_all(self, values):
+        """
+        Write a value for every key, in layout order, as one consistent
+        update.
+        """
+        slots = np.asarray(values, dtype=np.float64)
+        if slots.shape != self._values.shape:
+            raise ValueError("Expected %d values, got %s"
+                             % (len(self.keys), slots.shape))
+        self._seq[0] += 1
+        try:
+            self._values[:] = slots
+        finally:
+            self._seq[0] += 1
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    ###################################
+    # Readers
+    ###################################
+
+    def snapshot(self, out=None):
+        """
+        Return (sequence, values): a consistent copy of every slot in
+        layout order, with NaN for missing values. If out is given the
+        values are copied into it rather than a new array.
+
+        If no consistent copy can be had within SNAPSHOT_TIMEOUT seconds an
+        error is logged and the last consistent copy is returned, or every
+        value missing if there was none. Later calls return that copy at
+        once for as long as the same write stays stuck.
+        """
+        if out is None:
+            out = np.empty(len(self.keys), dtype=np.float64)
+        while True:
+            seq = self._seq[0]
+            if seq == self._stuck:
+                break
+            # Let a write in progress finish, but not forever
+            seq = self._wait_even()
+            if seq & 1:
+                self._stuck = seq
+                logging.getLogger(__name__).error(
+                    "Data store write stuck at sequence %d, using the last "
+                    "consistent values" % seq)
+                break
+            out[:] = self._values
+            if self._seq[0] == seq:
+                self._last_seq = seq
+                self._last[:] = out
+                return seq, out
+
+        if self._last_seq is None:
+            out[:] = np.nan
+            return int(seq) - 1, out
+        out[:] = self._last
+        return self._last_seq, out
+
+    def read(self, keys):
+        """
+        Return a consistent list of the values of keys, None for missing.
+        """
+        seq, values = self.snapshot()
+        result = []
+        for k in keys:
+            v = values[self._index[k]]
+            result.append(None if np.isnan(v) else float(v))
+        return result
+
+    def view(self):
+        """
+        Return a read-only view of the value slots. The view costs nothing
+        but is live: it is not protected against concurrent writes.
+        """
+        v = self._values.view()
+        v.flags.writeable = False
+        return v
+
+    def __getitem__(self, key):
+        return self.read([key])[0]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,206 @@
+"""
+Log by exception: write a value only when it has moved.
+
+Many logged values, like engine or battery temperature, sit still for
+minutes while every row repeats them. In the sparse format a row only
+holds the values which changed by more than their deadband since they
+were last written, and rows where nothing changed are not written at all.
+Every value is also written at least every 'heartbeat' seconds, so a
+reader can tell a steady value from a dead logger, and the first row of
+every file holds all of them, so each file can be read on its own.
+
+A value is written when it differs from the last value written for it by
+more than max(abs, pct / 100 * |last value|), or when it becomes or stops
+being missing. Deadbands are set per column name, with a 'default' for
+the rest:
+    {'default': {'abs': 0.0, 'pct': 0.5},
+     'an_300v_cur': {'abs': 0.2}}
+
+A sparse file is text:
+    #sparse
+    time,name0,name1,...
+    <time>,<i>:<value>,<i>:<value>,...
+where i counts the columns after time from 0 and an empty value means
+missing. read_sparse turns it back into a dense series, carrying each
+value forward until the row that changes it.
+"""
+
+import math
+
+import numpy as np
+
+SPARSE_MARK = '#sparse'
+HEARTBEAT = 60.0  # seconds, longest a value goes unwritten
+
+NAN = float('nan')
+
+
+class Deadband(object):
+
+    def __init__(self, ncolumns, abs_tol=0.0, pct_tol=0.0,
+                 heartbeat=HEARTBEAT):
+        """
+        abs_tol, pct_tol: the deadband of every column, or a sequence
+            holding the deadband of each column
+        heartbeat: seconds after which a value is written even if it has
+            not changed
+        """
+        self.abs_tol = np.zeros(ncolumns) + abs_tol
+        self.pct_tol = np.zeros(ncolumns) + pct_tol
+        self.heartbeat = heartbeat
+        self._last = np.full(ncolumns, NAN)
+        self._written = np.full(ncolumns, -np.inf)  # time last written
+        self.reset()
+
+    def reset(self):
+        """
+        Write every value on the next call to changed, e.g. at the start
+        of a new file.
+        """
+        self._all = True
+
+    def changed(self, t, values):
+        """
+        Return the indices of the values, at time t, to write. None or
+        NaN values are missing.
+        """
+        v = np.array([NAN if x is None else x for x in values],
+                     dtype=np.float64)
+        missing = np.isnan(v)
+        if self._all:
+            write = np.ones(len(v), dtype=bool)
+            self._all = False
+        else:
+            last = self._last
+            was_missing = np.isnan(last)
+            with np.errstate(invalid='ignore'):
+                moved = np.abs(v - last) > np.maximum(
+                    self.abs_tol, self.pct_tol / 100. * np.abs(last))
+            write = (missing != was_missing) | moved | \
+                (t - self._written >= self.heartbeat)
+        self._last[write] = v[write]
+        self._written[write] = t
+        return np.flatnonzero(write)
+
+
+def column_deadbands(names, dconfig):
+    """
+    Return the (abs, pct) deadband arrays for the named columns from a
+    deadband config (see the module docstring).
+    """
+    default = dconfig.get('default', {})
+    abs_tol = [dconfig.get(n, default).get('abs', default.get('abs', 0.0))
+               for n in names]
+    pct_tol = [dconfig.get(n, default).get('pct', default.get('pct', 0.0))
+               for n in names]
+    return np.array(abs_tol, dtype=np.float64), \
+        np.array(pct_tol, dtype=np.float64)
+
+
+def check_deadbands(dconfig):
+    """
+    Raise ValueError if a deadband config is malformed.
+    """
+    if not isinstance(dconfig, dict):
+        raise ValueError("deadband must be a dictionary")
+    for name, band in dconfig.items():
+        if not isinstance(band, dict) or set(band) - set(['abs', 'pct']):
+            raise ValueError("Deadband of %s must be {'abs': ..., "
+                             "'pct': ...}" % name)
+        for key, value in band.items():
+            if not value >= 0:
+                raise ValueError("Deadband %s of %s cannot be negative"
+                                 % (key, name))
+    return True
+
+
+class SparseRows(object):
+    """
+    Turn dense CSV rows, '<time>,<value>,<value>,...', into sparse ones.
+    """
+
+    def __init__(self, csv_header, dconfig=None, heartbeat=HEARTBEAT):
+        """
+        csv_header: the dense header, time column first
+        dconfig: deadbands by column name
+        """
+        self.csv_header = csv_header
+        names = csv_header.split(',')[1:]
+        if names and names[-1] == '':  # trailing comma
+            names.pop()
+        self.names = names
+        abs_tol, pct_tol = column_deadbands(names, dconfig or {})
+        self.deadband = Deadband(len(names), abs_tol, pct_tol, heartbeat)
+
+    def header(self):
+        """
+        Return the header of a sparse file, without a final new-line.
+        """
+        return SPARSE_MARK + '\n' + self.csv_header
+
+    def reset(self):
+        self.deadband.reset()
+
+    def convert(self, lines):
+        """
+        Return the sparse rows for a batch of dense rows, leaving out
+        those in which nothing changed.
+        """
+        n = len(self.names)
+        out = []
+        for line in lines:
+            fields = line.rstrip('\n').split(',')
+            texts = fields[1:n + 1]
+            texts += [''] * (n - len(texts))
+            values = []
+            for text in texts:
+                try:
+                    values.append(float(text))
+                except ValueError:
+                    values.append(NAN)
+            try:
+                t = float(fields[0])
+            except ValueError:
+                continue
+            write = self.deadband.changed(t, values)
+            if len(write):
+                out.append(fields[0] + ',' + ','.join(
+                    '%d:%s' % (i, texts[i] if not math.isnan(values[i])
+                               else '') for i in write))
+        return out
+
+
+def read_sparse(lines):
+    """
+    Read the lines of a sparse file. Returns (names, times, values): the
+    column names (time first), an array of row times and a 2D array with
+    one row per time and one column per value, each value carried
+    forward from the row that last wrote it.
+    """
+    lines = iter(lines)
+    if next(lines).strip() != SPARSE_MARK:
+        raise ValueError("Not a sparse log file")
+    names = next(lines).strip().split(',')
+    if names and names[-1] == '':
+        names.pop()
+    rows = [l for l in lines if l.strip()]
+    n = len(names) - 1
+    times = np.empty(len(rows))
+    data = np.full((len(rows), n), NAN)
+    seen = np.zeros((len(rows), n), dtype=bool)
+    for k, line in enumerate(rows):
+        fields = line.rstrip('\n').split(',')
+        times[k] = float(fields[0])
+        for field in fields[1:]:
+            i, _, text = field.partition(':')
+            i = int(i)
+            seen[k, i] = True
+            if text:
+                data[k, i] = float(text)
+
+    # Forward fill: index of the last row that wrote each value
+    last = np.where(seen, np.arange(len(rows))[:, None], -1)
+    np.maximum.accumulate(last, axis=0, out=last)
+    filled = data[np.maximum(last, 0), np.arange(n)]
+    filled[last < 0] = NAN
+    return names, times, filled
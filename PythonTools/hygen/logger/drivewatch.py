@@ -0,0 +1,133 @@
+"""
+Track the USB drive the logs are written to, without touching the file
+system on every pass of the writer loop.
+
+DriveWatcher resolves the log directory on the first drive found under
+/media and caches it. The cache is only checked again every 'interval'
+seconds (one listdir of /media and one stat), or straight away after
+invalidate(), e.g. when a write to the drive fails. There is no
+inotify binding in the standard library of the Pythons we support, so a
+low-frequency poll is used instead.
+"""
+
+import os
+import re
+import sys
+
+import monotonic
+
+MEDIA = '/media'
+DRIVES = ['sda', 'sda1', 'sda2']  # Possible mount points
+POLL_INTERVAL = 2.0  # seconds between checks of /media
+
+
+class DriveWatcher(object):
+
+    def __init__(self, directory, media=MEDIA, drives=DRIVES,
+                 interval=POLL_INTERVAL):
+        """
+        directory: the log directory, relative to the root of the drive
+        """
+        self.directory = directory
+        self.media = media
+        self.drives = drives
+        self.interval = interval
+
+        self.drive = None
+        self.log_directory = None
+        self._next_check = None
+
+    def invalidate(self):
+        """
+        Check the drive again on the next call to get_directory.
+        """
+        self._next_check = None
+
+    def get_directory(self):
+        """
+        Return the log directory on the drive, or None if there is no drive.
+        """
+        now = monotonic.monotonic()
+        if self._next_check is not None and now < self._next_check:
+            return self.log_directory
+        self._next_check = now + self.interval
+
+        # Still there? One stat rather than a listdir
+        if self.log_directory is not None \
+                and os.path.isdir(self.log_directory):
+            return self.log_directory
+
+        self.drive = self.log_directory = None
+        try:
+            media = os.listdir(self.media)
+        except OSError:
+            return None
+        for d in self.drives:
+            if d in media:
+                self.drive = os.path.join(self.media, d)
+                break
+        else:
+            return None
+
+        log_directory = os.path.join(self.drive, self.directory)
+        try:
+            if sys.version_info[0] == 3:
+                os.makedirs(log_directory, exist_ok=True)
+            else:
+                os.makedirs(log_directory)
+        except OSError:
+            # Directory already exists, or the drive is read-only
+            pass
+        if os.path.isdir(log_directory):
+            self.log_directory = log_directory
+        return self.log_directory
+
+
+def next_run(directory, prefix):
+    """
+    Return the run number for a new file named '<prefix>_run<N>.<ext>' in
+    directory: one more than the highest run already there for this
+    prefix, whatever the extension, or 0 for the first. Scans the
+    directory once.
+    """
+    pattern = re.compile(re.escape(prefix) + r'_run(\d+)\.')
+    runs = [-1]
+    for name in os.listdir(directory):
+        m = pattern.match(name)
+        if m:
+            runs.append(int(m.group(1)))
+    return max(runs) + 1
+
+
+RUN_FILE = re.compile(r'.+_run\d+\.')
+
+
+def enforce_quota(directory, quota, keep=None):
+    """
+    Delete the oldest run logs in directory, by modification time, until
+    their total size is at most quota bytes. The file keep (the one being
+    written) is never deleted. Returns the paths deleted.
+    """
+    files = []
+    for name in os.listdir(directory):
+        if RUN_FILE.match(name):
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, path, st.st_size))
+    total = sum(f[2] for f in files)
+    deleted = []
+    for mtime, path, size in sorted(files):
+        if total <= quota:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        deleted.append(path)
+    return deleted
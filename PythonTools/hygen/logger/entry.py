@@ -23,9 +23,13 @@ if __name__ == '__main__':
         sys.path.append(path.dirname(path.abspath(__file__)))
         from config import get_configuration
         from main import main
+        from metrics import MetricsDumper
+        import livereload
     else:
         from .config import get_configuration
         from .main import main
+        from .metrics import MetricsDumper
+        from . import livereload
 
 # create logger
 logger = logging.getLogger(__name__)
@@ -64,9 +68,25 @@ context = daemon.DaemonContext(
     umask=0o002,
 )
 
+
+def reload_config(signum, frame):
+    """
+    Read the config map again and reconfigure the threads whose sections
+    changed, leaving the others running.
+    """
+    global config
+    try:
+        new_config = get_configuration()
+    except Exception as e:
+        logger.error("Could not read the config map, not reloaded: %s" % e)
+        return
+    livereload.reload_threads(config, new_config, logger)
+    config = new_config
+
+
 # Handle signals
 context.signal_map = {signal.SIGTERM: 'terminate',  # program cleanup
-                      signal.SIGHUP: 'terminate',  # hangup
+                      signal.SIGHUP: reload_config,  # reload the config map
                       signal.SIGTSTP: 'terminate',  # suspend - configurable
                       }
 
@@ -75,6 +95,9 @@ parser = argparse.ArgumentParser(description="Start the Hygen logging daemon")
 parser.add_argument(
     '--config', action='store_const', dest='config', const=True,
     default=False, help='set configuration variables from the console')
+parser.add_argument(
+    '--supervise', action='store_true', dest='supervise', default=False,
+    help='run each enabled subsystem in its own process')
 
 args = parser.parse_args()
 if args.config:
@@ -83,4 +106,18 @@ else:
     config = get_configuration()
 
 with context:
-    main(config, handlers)
+    if args.supervise:
+        # Supervisor mode needs Python 3, so only import it when asked for
+        if __package__ is None:
+            from supervisor import Supervisor
+        else:
+            from .supervisor import Supervisor
+        # Every worker process dumps its own metrics
+        supervisor = Supervisor(config, handlers, get_configuration)
+        signal.signal(signal.SIGHUP,
+                      lambda signum, frame: supervisor.request_reload())
+        supervisor.run()
+    else:
+        if 'metrics' in config:
+            MetricsDumper(config['metrics'], handlers).start()
+        main(config, handlers)
@@ -0,0 +1,271 @@
+"""
+Burst capture of a few analog inputs around a trigger.
+
+AnalogClient reports averages, which hide fast events such as resonance
+on the 300 V bus. FastCapture reads a few selected inputs as fast as the
+ADC allows (or every 'period' seconds) into a preallocated ring buffer of
+raw readings, and watches one of them for a trigger:
+- 'level': the scaled value crosses the level on a 'rising' or 'falling'
+  edge, or 'both'
+- 'rate': the scaled value changes by at least 'rate' units per second,
+  measured over 'rate_span' samples to ride over ADC noise
+A trigger freezes the buffer once 'post_samples' more readings are in,
+and the 'pre_samples' readings before the trigger, the triggering reading
+and the 'post_samples' after it are written as one binary snapshot (see binlog.py) to 'sdir',
+with what triggered it in the header. Capture then waits 'holdoff'
+seconds and for the buffer to fill again before it re-arms.
+
+FastCapture runs alongside the AnalogClient doing the averaged logging.
+Both share the ADC and, in the threaded mode, the GIL; to keep the
+averaged sampling on schedule run it as its own worker with
+entry.py --supervise.
+
+    'fastcapture': {
+        'measurements': [['an_300v_cur', 'A', 'P9_40', 40.0, -0.2], ...],
+        'period': 0.0,  # seconds between samples, 0 for as fast as possible
+        'pre_samples': 2000,
+        'post_samples': 2000,
+        'trigger': {'name': 'an_300v_cur', 'level': 30.0, 'edge': 'rising'},
+        'holdoff': 10.0,
+        'sdir': '/home/hygen/log/snapshots',
+        'dtype': 'float32',
+        'compression': None,
+    }
+"""
+
+from datetime import datetime
+import os
+import sys
+import time
+
+import numpy as np
+
+from asynciothread import AsyncIOThread
+from adcbackend import AdafruitADC
+import binlog
+import compress
+import metrics
+from mlist import check_analog, A_NAME, A_UNITS, A_PIN, A_GAIN, A_OFFSET
+
+PERIOD = 0.0  # as fast as the ADC allows
+HOLDOFF = 10.0  # seconds between snapshots
+RATE_SPAN = 8  # samples a rate of change is measured over
+EDGES = ('rising', 'falling', 'both')
+
+
+class FastCapture(AsyncIOThread):
+
+    def __init__(self, fconfig, handlers, backend=None):
+        """
+        Set up a thread capturing snapshots of the inputs in fconfig (see
+        the module docstring). backend: where readings and time come from
+        (see adcbackend.py), by default the BeagleBone ADC.
+        """
+        super(FastCapture, self).__init__(handlers)
+
+        FastCapture.check_config(fconfig)
+        self._input_list = fconfig['measurements']
+        self._pins = [m[A_PIN] for m in self._input_list]
+        self._gains = np.array([m[A_GAIN] for m in self._input_list])
+        self._offsets = np.array([m[A_OFFSET] for m in self._input_list])
+        self.period = fconfig.get('period', PERIOD)
+        self.pre_samples = fconfig['pre_samples']
+        self.post_samples = fconfig.get('post_samples', self.pre_samples)
+        self.holdoff = fconfig.get('holdoff', HOLDOFF)
+        self.directory = fconfig['sdir']
+        self.dtype = fconfig.get('dtype', 'float32')
+        self.compression = fconfig.get('compression')
+
+        trigger = fconfig['trigger']
+        names = [m[A_NAME] for m in self._input_list]
+        self.trigger_name = trigger['name']
+        self._trigger = names.index(trigger['name'])
+        self.level = trigger.get('level')
+        self.edge = trigger.get('edge', 'rising')
+        self.rate = trigger.get('rate')
+        self.rate_span = trigger.get('rate_span', RATE_SPAN)
+
+        # Ring buffer of raw readings and the time of each row: the
+        # readings before the trigger, the trigger and those after it
+        self._size = self.pre_samples + 1 + self.post_samples
+        self._times = np.zeros(self._size)
+        self._raw = np.zeros((self._size, len(self._pins)))
+        self._manual = False
+
+        self.last_snapshot = None  # path of the last snapshot written
+        self._m_snapshots = metrics.counter(
+            'fastcapture_snapshots_total', "Snapshots written")
+        self._m_rate = metrics.gauge(
+            'fastcapture_sample_rate', "Samples per second in the last "
+            "snapshot")
+        self._m_errors = metrics.counter(
+            'fastcapture_errors_total', "Failed readings and writes")
+
+        if backend is None:
+            backend = AdafruitADC()
+        self._adc = backend
+
+        self._logger.debug("Started fastcapture")
+
+    @staticmethod
+    def check_config(fconfig):
+        """
+        Check that the config is complete and consistent. Throw a
+        ValueError if it is not.
+        """
+        for val in ['measurements', 'pre_samples', 'trigger', 'sdir']:
+            if val not in fconfig:
+                raise ValueError("Missing " + val + ", required for "
+                                 "fastcapture")
+        check_analog(fconfig['measurements'])
+        trigger = fconfig['trigger']
+        if trigger.get('name') not in [m[A_NAME]
+                                       for m in fconfig['measurements']]:
+            raise ValueError("Trigger input %s is not captured"
+                             % trigger.get('name'))
+        if trigger.get('level') is None and trigger.get('rate') is None:
+            raise ValueError("Trigger needs a level or a rate")
+        if trigger.get('edge', 'rising') not in EDGES:
+            raise ValueError("Invalid trigger edge: %s" % trigger['edge'])
+        span = trigger.get('rate_span', RATE_SPAN)
+        if span < 1 or fconfig['pre_samples'] <= span:
+            raise ValueError("pre_samples must be more than rate_span")
+        if fconfig.get('post_samples', fconfig['pre_samples']) < 0:
+            raise ValueError("post_samples cannot be negative")
+        if fconfig.get('dtype', 'float32') not in binlog.DTYPES:
+            raise ValueError("Invalid snapshot dtype: %s" % fconfig['dtype'])
+        if fconfig.get('compression') is not None:
+            compress.compressor(fconfig['compression'])  # raises ValueError
+        return True
+
+    def trigger(self):
+        """
+        Take a snapshot as soon as the buffer is armed, whatever the
+        inputs are doing. Can be called from any thread.
+        """
+        self._manual = True
+
+    def _scaled(self, i):
+        j = self._trigger
+        return self._raw[i, j] / 1000. * self._gains[j] + self._offsets[j]
+
+    def _fired(self, i):
+        """
+        Return what triggered on the sample in slot i, or None.
+        """
+        if self._manual:
+            self._manual = False
+            return 'manual'
+        v = self._scaled(i)
+        if self.level is not None:
+            prev = self._scaled(i - 1)
+            if self.edge != 'falling' and prev < self.level <= v:
+                return 'level'
+            if self.edge != 'rising' and prev > self.level >= v:
+                return 'level'
+        if self.rate is not None:
+            k = i - self.rate_span  # negative indices wrap round the ring
+            dt = self._times[i] - self._times[k]
+            if dt > 0 and abs(v - self._scaled(k)) / dt >= self.rate:
+                return 'rate'
+        return None
+
+    def _read(self, i):
+        """
+        Read every input once into slot i of the ring.
+        """
+        row = self._raw[i]
+        self._times[i] = self._adc.monotonic()
+        for j, pin in enumerate(self._pins):
+            try:
+                row[j] = self._adc.read_raw(pin)
+            except (RuntimeError, ValueError, IOError):
+                row[j] = np.nan
+                exc_type, exc_value = sys.exc_info()[:2]
+                self._logger.error("ADC reading error: %s %s"
+                                   % (exc_type, exc_value))
+                self._m_errors.inc()
+
+    def run(self):
+        """
+        Overloads Thread.run, samples until cancelled.
+        """
+        i = 0  # next slot of the ring
+        filled = 0  # samples taken since the last snapshot
+        post = None  # samples still to take after a trigger
+        armed_at = self._adc.monotonic()
+        next_sample = armed_at
+        while not self._cancelled:
+            if self.period:
+                delay = next_sample - self._adc.monotonic()
+                if delay > 0:
+                    self._adc.sleep(delay)
+                next_sample = max(next_sample + self.period,
+                                  self._adc.monotonic())
+            self._read(i)
+            if post is None:
+                if filled >= self.pre_samples \
+                        and self._times[i] >= armed_at:
+                    reason = self._fired(i)
+                    if reason is not None:
+                        post = self.post_samples
+                        trigger_time = self._times[i]
+            else:
+                post -= 1
+            i = (i + 1) % self._size
+            filled += 1
+            if post == 0:
+                # Frozen: slot i holds the oldest sample
+                self._write_snapshot(i, trigger_time, reason)
+                post = None
+                filled = 0
+                armed_at = self._adc.monotonic() + self.holdoff
+
+    def _write_snapshot(self, start, trigger_time, reason):
+        """
+        Write the ring, oldest sample first, as a binary snapshot.
+        """
+        times = np.concatenate((self._times[start:], self._times[:start]))
+        raw = np.concatenate((self._raw[start:], self._raw[:start]))
+        values = raw / 1000. * self._gains + self._offsets
+        # Sample times are on the backend's clock; store UNIX time
+        to_unix = time.time() - self._adc.monotonic()
+        times += to_unix
+        if len(times) > 1 and times[-1] > times[0]:
+            self._m_rate.set((len(times) - 1) / (times[-1] - times[0]))
+
+        stamp = datetime.fromtimestamp(trigger_time + to_unix)
+        ext = '.bin'
+        if self.compression is not None:
+            ext += compress.METHODS[self.compression]
+        path = os.path.join(self.directory, "%s_%s%s" % (
+            stamp.strftime("%Y-%m-%d_%H-%M-%S.%f")[:-3], self.trigger_name,
+            ext))
+        columns = [(m[A_NAME], m[A_UNITS], m[A_GAIN], m[A_OFFSET])
+                   for m in self._input_list]
+        extra = {'trigger': {'name': self.trigger_name, 'reason': reason,
+                             'time': trigger_time + to_unix,
+                             'level': self.level, 'edge': self.edge,
+                             'rate': self.rate,
+                             'pre_samples': self.pre_samples,
+                             'post_samples': self.post_samples}}
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            binlog.write_binlog(path, columns, times, values, self.dtype,
+                                extra, self.compression)
+        except (IOError, OSError):
+            self._logger.error("Could not write snapshot %s" % path)
+            self._m_errors.inc()
+            return
+        self.last_snapshot = path
+        self._m_snapshots.inc()
+        self._logger.info("Snapshot of %s (%s trigger) written to %s"
+                          % (self.trigger_name, reason, path))
+
+    def cancel(self):
+        """
+        Cancels the thread, allowing it to be joined.
+        """
+        self._logger.info("Stopping " + str(self))
+        self._cancelled = True
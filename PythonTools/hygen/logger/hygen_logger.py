@@ -1,4 +1,6 @@
 # Configuration map
+# Send the daemon SIGHUP to apply changes to this map without stopping
+# it (see livereload.py)
 {
     # Enabled threads
     # Each string in this list corresponds to a sub-configuration map
@@ -59,9 +61,98 @@
         'frequency': 1.0,
     },
 
+    # Burst capture of fast events (see fastcapture.py): sample these
+    # inputs as fast as possible and, when the trigger fires, write the
+    # 'pre_samples' readings before it and 'post_samples' after it to a
+    # binary snapshot in 'sdir'. Add 'fastcapture' to 'enabled' to use it.
+    'fastcapture': {
+        'measurements': [
+            ['an_300v_cur', 'A', 'P9_40', 40.0, -0.2],
+            ['an_300v_volt', 'V', 'P9_39', 1.0, 0.0]
+        ],
+        'period': 0.0,  # seconds between samples, 0 for as fast as possible
+        'pre_samples': 2000,
+        'post_samples': 2000,
+        # Fire when 'name' crosses 'level' ('rising', 'falling' or 'both'),
+        # and/or changes faster than 'rate' units per second
+        'trigger': {'name': 'an_300v_cur', 'level': 30.0, 'edge': 'rising'},
+        # Seconds after a snapshot before the trigger is re-armed
+        'holdoff': 10.0,
+        'sdir': '/home/hygen/log/snapshots',
+        'dtype': 'float32',
+        'compression': None,
+    },
+
     # filewriter thread configuration (write data to disk)
     'filewriter': {
         'ldir': 'logs',
+        # 'csv' for text lines, 'binary' for fixed-width records with a
+        # self-describing header (see binlog.py) stored as 'dtype'
+        # ('float32' or 'float64'), or 'sparse' for text lines holding
+        # only the values that changed (see deadband.py)
+        'format': 'csv',
+        'dtype': 'float32',
+        # Sparse format: write a value when it moves by more than 'abs'
+        # units or 'pct' percent, per column name or by 'default', and at
+        # least every 'heartbeat' seconds
+        'deadband': {'default': {'abs': 0.0, 'pct': 0.5}},
+        'heartbeat': 60.0,
+        # Batching: write up to 'batch_lines' lines at once, waiting up
+        # to 'batch_time' seconds to gather them
+        'batch_lines': 1000,
+        'batch_time': 0.1,
+        # Flushing: every 'flush_lines' lines or 'flush_interval' seconds
+        # (0 disables either), fsync on each flush if 'fsync' is set.
+        # Files are always synced when they are rotated.
+        'flush_lines': 0,
+        'flush_interval': 10.0,
+        'fsync': False,
+        # Compress files as they are written: None, 'gzip', or 'zstd' or
+        # 'lz4' if their packages are installed (see compress.py)
+        'compression': None,  # e.g. 'gzip'
+        # Also rotate after this many bytes of data (0 for hourly only),
+        # and delete the oldest logs to keep the log directory under
+        # 'quota' bytes (0 to keep everything)
+        'max_file_size': 0,  # e.g. 67108864 for 64 MB
+        'quota': 0,  # e.g. 8589934592 for 8 GB
+        # Seconds between checks that the USB drive is still there
+        'drive_poll': 2.0,
+        # Bounded queue (see ringqueue.py): hold at most 'queue_size' lines
+        # in memory; when full, 'block' the producers, 'drop_oldest' or
+        # 'drop_newest' lines, or 'spill' them to 'spill_path' on the
+        # on-board storage (up to 'spill_limit' bytes) to be written to
+        # the drive once it is back
+        'queue_size': 10000,
+        'queue_policy': 'block',  # e.g. 'spill'
+        'spill_path': '/home/hygen/log/spill.dat',
+        'spill_limit': 104857600,
+    },
+
+    # Settings for running each subsystem in its own process
+    # (entry.py --supervise, see supervisor.py)
+    'supervisor': {
+        # Seconds between rows passed to the filewriter
+        'period': 1.0,
+        # Restart crashed workers after 'restart_delay' seconds, doubling
+        # with every crash in a row up to 'max_restart_delay'. A worker
+        # that stayed up for 'stable_time' seconds starts again from
+        # 'restart_delay'.
+        'restart_delay': 1.0,
+        'max_restart_delay': 60.0,
+        'stable_time': 60.0,
+        # Pin each worker process to one CPU core
+        'pin_cores': True,
+        # Seconds between CPU and latency reports in the program log
+        'stats_period': 60.0,
+    },
+
+    # Counters and histograms of the logger threads (see metrics.py),
+    # written every 'interval' seconds to 'path', or served to anyone
+    # connecting to the Unix socket 'socket', as 'prometheus' text or 'json'
+    'metrics': {
+        'path': '/home/hygen/log/metrics.prom',
+        'format': 'prometheus',
+        'interval': 10.0,
     },
 
     # Program log
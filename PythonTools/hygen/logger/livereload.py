@@ -0,0 +1,92 @@
+"""
+Apply a changed config map to the running logger without stopping it.
+
+On SIGHUP the daemon reads the config map again and compares it with the
+running one section by section. Only the sections that changed are
+applied:
+- threads that support it (AnalogClient, FileWriter) are handed their new
+  section with reconfigure() and switch to it at their next safe point,
+  e.g. the end of an averaging window or the next pass of the writer
+  loop, while every other thread keeps running untouched
+- anything else that changed is reported as needing a restart
+
+Threads register themselves for their section when they are built. In
+supervisor mode (see supervisor.py) the supervisor does the comparison
+instead, and restarts the worker processes that cannot be reconfigured.
+"""
+
+import logging
+import threading
+
+_MISSING = object()
+
+# Section name: running thread
+_threads = {}
+_lock = threading.Lock()
+
+
+def register(section, thread):
+    """
+    Make thread the one to reconfigure when section changes.
+    """
+    with _lock:
+        _threads[section] = thread
+
+
+def unregister(section):
+    with _lock:
+        _threads.pop(section, None)
+
+
+def diff_config(old, new):
+    """
+    Return the names of the top level sections that differ between two
+    config maps, including those only in one of them, sorted.
+    """
+    return sorted(k for k in set(old) | set(new)
+                  if old.get(k, _MISSING) != new.get(k, _MISSING))
+
+
+def _changes_columns(thread, section):
+    """
+    True if the new section would change the CSV header of a producer.
+    """
+    if not hasattr(thread, 'csv_header') or 'measurements' not in section:
+        return False
+    return ','.join(str(m[0]) for m in section['measurements']) \
+        != thread.csv_header()
+
+
+def reload_threads(old, new, logger=None):
+    """
+    Hand each section that differs between the config maps old and new to
+    the thread registered for it. Returns the changed sections which could
+    not be applied and need a restart.
+
+    Changing the columns a producer logs also needs a new header in the
+    log files, which only the code building the rows knows, so in the
+    threaded mode it is left for a restart.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    with _lock:
+        threads = dict(_threads)
+    restart = []
+    for section in diff_config(old, new):
+        thread = threads.get(section)
+        if section not in new or thread is None \
+                or not hasattr(thread, 'reconfigure') \
+                or _changes_columns(thread, new[section]):
+            restart.append(section)
+            continue
+        try:
+            thread.reconfigure(new[section])
+        except ValueError as e:
+            logger.error("Invalid %s config, not reloaded: %s"
+                         % (section, e))
+            continue
+        logger.info("Reloading %s config" % section)
+    if restart:
+        logger.warning("Changes to %s need a restart"
+                       % ', '.join(restart))
+    return restart
@@ -6,12 +6,20 @@ Created on Wed Jul 06 08:18:52 2016
 """
 from datetime import datetime
 import os
-import time
+import struct
 import sys
+import time
+import monotonic
 from subprocess import call, CalledProcessError
-import Adafruit_BBIO.GPIO as GPIO
 
 from asynciothread import AsyncIOThread
+import binlog
+import compress
+from deadband import SparseRows, check_deadbands, HEARTBEAT
+from drivewatch import DriveWatcher, enforce_quota, next_run, POLL_INTERVAL
+import livereload
+import metrics
+from ringqueue import RingQueue
 
 if sys.version_info[0] == 3:
     import queue
@@ -19,13 +27,59 @@ elif sys.version_info[0] == 2:
     import Queue as queue
 
 
+# Defaults for the optional batching and flushing configuration
+BATCH_LINES = 1000  # most lines written per batch
+BATCH_TIME = 0.1  # seconds to wait while gathering a batch
+FLUSH_LINES = 0  # flush after this many lines, 0 to disable
+FLUSH_INTERVAL = 10.0  # flush after this many seconds, 0 to disable
+FSYNC = False  # fsync on every flush as well as on rotation
+BUFFER_SIZE = 65536  # bytes buffered in memory between flushes
+MAX_FILE_SIZE = 0  # bytes of data per file before rotating, 0 to disable
+QUOTA = 0  # most bytes of logs kept in the log directory, 0 to disable
+
+# Log file formats and their file extensions
+FORMATS = {'csv': '.csv', 'binary': '.bin', 'sparse': '.csv'}
+
+
 class FileWriter(AsyncIOThread):
 
-    def __init__(self, lconfig, handlers, log_queue, csv_header):
+    def __init__(self, lconfig, handlers, log_queue, csv_header,
+                 columns=None):
         """
         Initialize a filewriter which writes to file whatever is put
         on its queue.
 
+        In the default 'csv' format the queue carries text lines. In the
+        'binary' format (see binlog.py) it carries sequences of
+        (timestamp, value, value, ...), columns must describe the values as
+        [(name, units, gain, offset), ...], and 'dtype' selects 'float32'
+        or 'float64' storage.
+
+        The 'sparse' format takes the same text lines as 'csv' but only
+        writes the values which moved by more than their 'deadband', or
+        were last written 'heartbeat' seconds ago, and skips rows in which
+        nothing did (see deadband.py).
+
+        If log_queue is a ringqueue.RingQueue, lines are left on it while
+        there is no drive to write to, so that its policy (block, drop or
+        spill) decides what happens to them. Any other queue is drained
+        into the null file.
+
+        With 'compression' set to 'gzip', 'zstd' or 'lz4' (see compress.py)
+        files are compressed as they are written, one frame per flush, so
+        a file cut short by a power loss can still be read. Files are
+        rotated every hour, and also after 'max_file_size' bytes of data
+        if that is set. After each rotation the oldest logs are deleted
+        until the log directory holds at most 'quota' bytes.
+
+        Lines are taken off the queue in batches of up to 'batch_lines'
+        lines, waiting at most 'batch_time' seconds, and each batch is
+        written with a single call. The file is flushed every 'flush_lines'
+        lines or 'flush_interval' seconds, whichever comes first, and is
+        always flushed and synced to disk when it is rotated.
+
+        reconfigure() changes these settings while the thread is running.
+
         Can raise:
         - ValueError for invalid config
         - IOError (Python < 3.3) or OSError (Python >= 3.3) for inaccessible file
@@ -36,16 +90,50 @@ class FileWriter(AsyncIOThread):
         # Specific config for the logger
         FileWriter.check_config(lconfig)
 
-        self.directory = lconfig['ldir']  # Relative directory on USB
+        self._configure(lconfig)
+        self._watcher = DriveWatcher(self.directory, interval=self.drive_poll)
+        self.drive = None
         self.log_directory = self.get_directory()
 
         self._queue = log_queue
-        self._f = open(os.devnull, 'w')
         self._csv_header = csv_header
+        self._pending_config = None  # (lconfig, csv_header) for the run loop
+        livereload.register('filewriter', self)
 
-        # self.eject_button = ""  # TODO fix this - this is bogus
+        if self.format == 'binary':
+            if columns is None:
+                raise ValueError("Binary logging needs a column list")
+            self._bin_header = binlog.make_header(columns, self.dtype)
+            self._record_struct = binlog.record_struct(len(columns),
+                                                       self.dtype)
+            self._mode = 'wb'
+        else:
+            self._mode = 'w'
+        if self.format == 'sparse':
+            self._sparse = SparseRows(csv_header, self.deadband,
+                                      self.heartbeat)
+        self._f = open(os.devnull, self._mode)
 
-        self.drive = None
+        self._path = None
+        self._file_bytes = 0
+        self._unflushed = 0
+        self._last_flush = monotonic.monotonic()
+
+        self._m_depth = metrics.gauge(
+            'filewriter_queue_depth', "Lines waiting on the queue")
+        self._m_batch = metrics.histogram(
+            'filewriter_batch_lines', "Lines written per batch",
+            buckets=metrics.SIZE_BUCKETS)
+        self._m_write = metrics.histogram(
+            'filewriter_write_seconds', "Time taken to write one batch")
+        self._m_flush = metrics.histogram(
+            'filewriter_flush_seconds', "Time taken to flush the file")
+        self._m_lines = metrics.counter(
+            'filewriter_lines_total', "Lines written")
+        self._m_errors = metrics.counter(
+            'filewriter_errors_total', "Failed writes and flushes")
+
+        # self.eject_button = ""  # TODO fix this - this is bogus
 
     def __del__(self):
         """
@@ -67,39 +155,86 @@ class FileWriter(AsyncIOThread):
         for val in required_config:
             if val not in lconfig:
                 raise ValueError("Missing required config value: " + val)
+        if lconfig.get('batch_lines', BATCH_LINES) < 1:
+            raise ValueError("batch_lines must be at least 1")
+        if lconfig.get('format', 'csv') not in FORMATS:
+            raise ValueError("Invalid log format: %s" % lconfig['format'])
+        if lconfig.get('dtype', 'float32') not in binlog.DTYPES:
+            raise ValueError("Invalid binary log dtype: %s" % lconfig['dtype'])
+        if lconfig.get('compression') is not None:
+            compress.compressor(lconfig['compression'])  # raises ValueError
+        check_deadbands(lconfig.get('deadband', {}))
+        if not lconfig.get('heartbeat', HEARTBEAT) > 0:
+            raise ValueError("heartbeat must be positive")
         # If we get to this point, the required values are present
         return True
 
-    def get_directory(self):
+    def _configure(self, lconfig):
         """
-        Get the directory in whatever USB drive we have plugged in.
+        Read the settings from a checked config.
         """
-        # Check for USB directory
-        media = os.listdir('/media')
+        self.directory = lconfig['ldir']  # Relative directory on USB
+        self.drive_poll = lconfig.get('drive_poll', POLL_INTERVAL)
+        self.format = lconfig.get('format', 'csv')
+        self.dtype = lconfig.get('dtype', 'float32')
+        self.batch_lines = lconfig.get('batch_lines', BATCH_LINES)
+        self.batch_time = lconfig.get('batch_time', BATCH_TIME)
+        self.flush_lines = lconfig.get('flush_lines', FLUSH_LINES)
+        self.flush_interval = lconfig.get('flush_interval', FLUSH_INTERVAL)
+        self.fsync = lconfig.get('fsync', FSYNC)
+        self.buffer_size = lconfig.get('buffer_size', BUFFER_SIZE)
+        self.compression = lconfig.get('compression')
+        self.max_file_size = lconfig.get('max_file_size', MAX_FILE_SIZE)
+        self.quota = lconfig.get('quota', QUOTA)
+        self.deadband = lconfig.get('deadband', {})
+        self.heartbeat = lconfig.get('heartbeat', HEARTBEAT)
 
-        drive = None
-        drives = ['sda', 'sda1', 'sda2']  # Possible mount points
-        for d in drives:
-            if d in media:
-                drive = os.path.join('/media', d)
-                break
+    def reconfigure(self, lconfig, csv_header=None):
+        """
+        Switch to a new configuration, and to a new CSV header if one is
+        given, on the next pass of the run loop. A new log directory,
+        compression or header starts a new file; other settings apply to
+        the current one. The format and dtype cannot change while running.
+        Raises ValueError, keeping the current configuration, if the new
+        one is invalid. Can be called from any thread.
+        """
+        FileWriter.check_config(lconfig)
+        if lconfig.get('format', 'csv') != self.format or \
+                lconfig.get('dtype', 'float32') != self.dtype:
+            raise ValueError("Changing the log format needs a restart")
+        self._pending_config = (lconfig, csv_header)
 
-        if drive is not None:
-            log_directory = os.path.join(drive, self.directory)
-            self.drive = drive
-        else:
-            return None
+    def _apply_pending(self):
+        """
+        Apply the configuration passed to reconfigure.
+        """
+        (lconfig, csv_header), self._pending_config = \
+            self._pending_config, None
+        old = (self.directory, self.compression, self._csv_header)
+        self._configure(lconfig)
+        if csv_header is not None:
+            self._csv_header = csv_header
+        self._watcher.interval = self.drive_poll
+        if self.format == 'sparse':
+            # Starts over with every value written on the next row
+            self._sparse = SparseRows(self._csv_header, self.deadband,
+                                      self.heartbeat)
+        if self.directory != old[0]:
+            self._watcher = DriveWatcher(self.directory,
+                                         interval=self.drive_poll)
+        self._logger.info("Filewriter configuration reloaded")
+        if (self.directory, self.compression, self._csv_header) != old:
+            self._rotate()
 
-        # Make any necessary paths
-        try:
-            if sys.version_info[0] == 3:
-                os.makedirs(log_directory, exist_ok=True)
-            else:
-                os.makedirs(log_directory)
-        except OSError:
-            # Directory already exists
-            pass
-        return log_directory
+    def get_directory(self):
+        """
+        Get the directory in whatever USB drive we have plugged in, or None.
+        The answer is cached and only checked against the file system
+        every 'drive_poll' seconds.
+        """
+        directory = self._watcher.get_directory()
+        self.drive = self._watcher.drive
+        return directory
 
     def _get_new_logfile(self):
         """
@@ -107,27 +242,32 @@ class FileWriter(AsyncIOThread):
         returns the null file.
         """
         directory = self.get_directory()
+        self.log_directory = directory
         if directory is None:
-            return open(os.devnull, 'w')
+            return open(os.devnull, self._mode)
 
         # Find unique file name for this hour
         now = datetime.now()
         hour = now.strftime("%Y-%m-%d_%H")
-        i = 0
-        while os.path.exists(
-            os.path.join(directory, hour + "_run%d.csv" % i)):
-            i += 1
+        ext = FORMATS[self.format]
+        if self.compression is not None:
+            ext += compress.METHODS[self.compression]
+        try:
+            i = next_run(directory, hour)
+        except OSError:
+            i = 0
 
-        fpath = os.path.join(
-            self.log_directory,
-            hour + "_run%d.csv" % i)
+        fpath = os.path.join(directory, hour + "_run%d" % i + ext)
 
         # Try opening the file, else open the null file
         try:
-            f = open(fpath, 'w')
+            f = compress.open_log(fpath, self._mode, self.compression,
+                                  self.buffer_size)
         except IOError:
             self._logger.critical("Failed to open log file: %s" % fpath)
-            return open(os.devnull, 'w')  # return a null file
+            self._watcher.invalidate()
+            return open(os.devnull, self._mode)  # return a null file
+        self._path = fpath
         return f
 
     def _write_line(self, line):
@@ -141,6 +281,138 @@ class FileWriter(AsyncIOThread):
                 self._f.write(line + '\n')
         except (IOError, OSError):
             self._logger.error("Could not write to log file")
+            self._m_errors.inc()
+            self._watcher.invalidate()
+
+    def _write_lines(self, lines):
+        """
+        Write a batch of lines to the currently open file with a single
+        write call, each line ending in a single new-line.
+        """
+        lines = [l[:-1] if l[-1:] == '\n' else l for l in lines]
+        lines.append('')
+        data = '\n'.join(lines)
+        self._file_bytes += len(data)
+        try:
+            self._f.write(data)
+        except (IOError, OSError):
+            self._logger.error("Could not write to log file")
+            self._m_errors.inc()
+            self._watcher.invalidate()
+        self._unflushed += len(lines) - 1
+
+    def _write_records(self, records):
+        """
+        Pack a batch of records and write them to the currently open binary
+        file with a single write call.
+        """
+        try:
+            data = binlog.pack_records(self._record_struct, records)
+        except struct.error:
+            # Pack them one by one so only the bad records are lost
+            packed = []
+            for record in records:
+                try:
+                    packed.append(binlog.pack_records(self._record_struct,
+                                                      [record]))
+                except struct.error:
+                    self._logger.error("Invalid record for binary log "
+                                       "file: %r" % (record,))
+                    self._m_errors.inc()
+            data = b''.join(packed)
+        try:
+            self._file_bytes += len(data)
+            self._f.write(data)
+        except (IOError, OSError):
+            self._logger.error("Could not write to log file")
+            self._m_errors.inc()
+            self._watcher.invalidate()
+        self._unflushed += len(records)
+
+    def _write_header(self):
+        """
+        Write the CSV header line or binary header to a new file.
+        """
+        if self.format == 'binary':
+            try:
+                self._f.write(self._bin_header)
+            except (IOError, OSError):
+                self._logger.error("Could not write to log file")
+        elif self.format == 'sparse':
+            # The first row of every file holds every value
+            self._sparse.reset()
+            self._write_line(self._sparse.header())
+        else:
+            self._write_line(self._csv_header)
+
+    def _get_batch(self):
+        """
+        Take up to batch_lines lines off the queue, waiting no more than
+        batch_time seconds for them to arrive.
+        """
+        lines = []
+        deadline = monotonic.monotonic() + self.batch_time
+        while len(lines) < self.batch_lines:
+            timeout = deadline - monotonic.monotonic()
+            try:
+                if timeout > 0:
+                    lines.append(self._queue.get(True, timeout))
+                else:
+                    lines.append(self._queue.get(False))
+            except queue.Empty:
+                break
+        return lines
+
+    def _flush(self, sync=False):
+        """
+        Flush buffered lines to the operating system, and on to the disk
+        if sync is set.
+        """
+        start = monotonic.monotonic()
+        try:
+            self._f.flush()
+            if sync and self._f.name != os.devnull:
+                os.fsync(self._f.fileno())
+        except (IOError, OSError):
+            self._logger.error("Could not flush log file")
+            self._m_errors.inc()
+            self._watcher.invalidate()
+        self._unflushed = 0
+        self._last_flush = monotonic.monotonic()
+        self._m_flush.observe(self._last_flush - start)
+
+    def _check_flush(self):
+        """
+        Flush if the flush policy says it is time to.
+        """
+        if self._unflushed == 0:
+            return
+        if ((self.flush_lines and self._unflushed >= self.flush_lines)
+                or (self.flush_interval and monotonic.monotonic()
+                    >= self._last_flush + self.flush_interval)):
+            self._flush(self.fsync)
+
+    def _rotate(self):
+        """
+        Sync and close the current file, then open a new one.
+        """
+        self._flush(sync=True)
+        try:
+            self._f.close()
+        except (IOError, OSError):
+            self._logger.error("Could not close log file")
+        self._path = None
+        self._f = self._get_new_logfile()
+        self._file_bytes = 0
+        self._write_header()
+        if self.quota and self._path is not None:
+            try:
+                for path in enforce_quota(self.log_directory, self.quota,
+                                          self._path):
+                    self._logger.info("Deleted %s to stay within quota"
+                                      % path)
+            except OSError:
+                self._logger.error("Could not apply log quota")
 
     def run(self):
         """
@@ -151,22 +423,39 @@ class FileWriter(AsyncIOThread):
         # GPIO.add_event_detect(self.eject_button, GPIO.RISING)
 
         while not self._cancelled:
+            if self._pending_config is not None:
+                self._apply_pending()
+
             hour = datetime.now().hour
             if prev_hour != hour:
-                self._f.close()
-                self._f = self._get_new_logfile()
+                self._rotate()
                 prev_hour = hour
-                self._write_line(self._csv_header)
 
-            # Get lines to print
-            more_items = True
-            while more_items:
-                try:
-                    line = self._queue.get(False)
-                except queue.Empty:
-                    more_items = False
+            # Get lines to print, waiting up to batch_time for them
+            if self.log_directory is None and \
+                    isinstance(self._queue, RingQueue):
+                time.sleep(self.batch_time)
+                lines = []
+            else:
+                lines = self._get_batch()
+            if lines:
+                start = monotonic.monotonic()
+                if self.format == 'binary':
+                    self._write_records(lines)
+                elif self.format == 'sparse':
+                    rows = self._sparse.convert(lines)
+                    if rows:
+                        self._write_lines(rows)
                 else:
-                    self._write_line(line)
+                    self._write_lines(lines)
+                self._m_write.observe(monotonic.monotonic() - start)
+                self._m_batch.observe(len(lines))
+                self._m_lines.inc(len(lines))
+            try:
+                self._m_depth.set(self._queue.qsize())
+            except NotImplementedError:  # multiprocessing on macOS
+                pass
+            self._check_flush()
 
             # Reading the GPIO event detected flag resets it automatically
             # See Adafruit_BBIO/sources/event_gpio.c:585
@@ -179,12 +468,14 @@ class FileWriter(AsyncIOThread):
             #                               + ". Failed with error code "
             #                               + str(e.returncode))
 
-            if self.log_directory is None or not os.path.exists(self.log_directory):
-                self._f.close()
-                self._f = self._get_new_logfile()
-                self._write_line(self._csv_header)
+            # Start a new file when the drive comes or goes, or when this
+            # one is big enough
+            if self.get_directory() != self.log_directory or \
+                    (self.max_file_size
+                     and self._file_bytes >= self.max_file_size):
+                self._rotate()
 
-            time.sleep(0.1)
+        self._flush(sync=True)
 
     def cancel(self):
         """
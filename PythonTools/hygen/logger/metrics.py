@@ -0,0 +1,299 @@
+"""
+Counters, gauges and histograms for the logger threads.
+
+Metrics are cheap enough to leave on: updating one is an attribute
+increment, or a bisect into a short list of bucket bounds for a
+histogram, with no locking. Each metric should therefore be updated from
+one thread only; readers may see a value that is one update stale. The
+module needs only the standard library, so tools outside the daemon can
+use it too.
+
+Metrics are created once, usually at module level or in a constructor,
+from a Registry (by default the module's REGISTRY):
+    SCANS = metrics.counter('modbus_scans_total', "Scans completed")
+    SCANS.inc()
+
+MetricsDumper periodically writes the registry to a file, or serves it
+to anyone who connects to a Unix socket, in the Prometheus text format
+or as JSON.
+"""
+
+from bisect import bisect_left
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# Histogram bucket upper bounds for latencies, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histogram bucket upper bounds for counts of things, e.g. batch sizes
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+DUMP_INTERVAL = 10.0  # seconds between dumps
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, v)
+                             for k, v in sorted(labels.items()))
+
+
+class Counter(object):
+    """
+    A count that only goes up.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help='', labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, e.g. a queue depth.
+    """
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, n=1):
+        self.value -= n
+
+
+class Histogram(object):
+    """
+    Counts of observations in fixed buckets, with their count and sum.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help='', labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus one for values above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self):
+        """
+        Return the cumulative bucket counts, sum and count as
+        Prometheus samples.
+        """
+        result = []
+        total = 0
+        for bound, n in zip(self.buckets + ('+Inf',), self.counts):
+            total += n
+            labels = dict(self.labels)
+            labels['le'] = bound
+            result.append((self.name + '_bucket', labels, total))
+        result.append((self.name + '_sum', self.labels, self.sum))
+        result.append((self.name + '_count', self.labels, self.count))
+        return result
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = cls(name, help, labels, **kwargs)
+            self._metrics[key] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError("Metric %s already registered as a %s"
+                             % (name, metric.kind))
+        return metric
+
+    def counter(self, name, help='', labels=None):
+        """
+        Return the counter with this name and labels, creating it if need be.
+        """
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=None):
+        """
+        Return the gauge with this name and labels, creating it if need be.
+        """
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', labels=None, buckets=LATENCY_BUCKETS):
+        """
+        Return the histogram with this name and labels, creating it if
+        need be.
+        """
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def metrics(self):
+        return [self._metrics[k] for k in sorted(self._metrics)]
+
+    def prometheus_text(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        seen = set()
+        for m in self.metrics():
+            if m.name not in seen:
+                seen.add(m.name)
+                if m.help:
+                    lines.append('# HELP %s %s' % (m.name, m.help))
+                lines.append('# TYPE %s %s' % (m.name, m.kind))
+            for name, labels, value in m.samples():
+                lines.append('%s%s %s' % (name, _label_text(labels), value))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def json_text(self):
+        """
+        Return every metric as a JSON list of objects.
+        """
+        result = []
+        for m in self.metrics():
+            entry = {'name': m.name, 'type': m.kind, 'labels': m.labels}
+            if m.kind == 'histogram':
+                entry.update(buckets=list(m.buckets), counts=m.counts,
+                             count=m.count, sum=m.sum)
+            else:
+                entry['value'] = m.value
+            result.append(entry)
+        return json.dumps({'time': time.time(), 'metrics': result})
+
+    def render(self, fmt):
+        if fmt == 'json':
+            return self.json_text()
+        return self.prometheus_text()
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class MetricsDumper(threading.Thread):
+
+    def __init__(self, mconfig, handlers, registry=REGISTRY):
+        """
+        Set up a thread to publish a registry's metrics.
+        mconfig: the configuration values
+            {'path': '/home/hygen/log/metrics.prom', # file to write
+             'socket': '/run/hygen/metrics.sock', # or socket to serve on
+             'format': 'prometheus', # or 'json'
+             'interval': 10.0, # seconds between file dumps
+            }
+        The file is replaced atomically on each dump, so readers never see
+        a partial one. A socket answers each connection with the current
+        metrics and closes it.
+        """
+        super(MetricsDumper, self).__init__()
+        MetricsDumper.check_config(mconfig)
+        self.path = mconfig.get('path')
+        self.socket_path = mconfig.get('socket')
+        self.format = mconfig.get('format', 'prometheus')
+        self.interval = mconfig.get('interval', DUMP_INTERVAL)
+        self.registry = registry
+        self.daemon = True
+        self._cancelled = False
+
+        self._logger = logging.getLogger(__name__)
+        for h in handlers:
+            self._logger.addHandler(h)
+
+    @staticmethod
+    def check_config(mconfig):
+        """
+        Check that the config is complete. Throw a ValueError if it is not.
+        """
+        if 'path' not in mconfig and 'socket' not in mconfig:
+            raise ValueError("Metrics need a 'path' or a 'socket'")
+        if mconfig.get('format', 'prometheus') not in ('prometheus', 'json'):
+            raise ValueError("Invalid metrics format: %s"
+                             % mconfig['format'])
+        return True
+
+    def dump(self):
+        """
+        Write the metrics to the file once.
+        """
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(self.registry.render(self.format))
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            self._logger.error("Could not write metrics to %s" % self.path)
+
+    def run(self):
+        """
+        Overrides Thread.run. Dump or serve the metrics until cancelled.
+        """
+        if self.socket_path is not None:
+            self._serve()
+        else:
+            while not self._cancelled:
+                self.dump()
+                time.sleep(self.interval)
+
+    def _serve(self):
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.socket_path)
+            sock.listen(4)
+        except socket.error as e:
+            self._logger.error("Could not serve metrics on %s: %s"
+                               % (self.socket_path, e))
+            sock.close()
+            return
+        sock.settimeout(1.0)
+        try:
+            while not self._cancelled:
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    continue
+                try:
+                    conn.sendall(self.registry.render(self.format)
+                                 .encode('utf-8'))
+                except socket.error:
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+            os.unlink(self.socket_path)
+
+    def cancel(self):
+        """
+        Cancels the thread, allowing it to be joined.
+        """
+        self._logger.info("Stopping " + str(self))
+        self._cancelled = True
@@ -0,0 +1,237 @@
+"""
+Compile measurement lists once, for every client that uses them.
+
+A Modbus measurement description file (MDF) has two header lines and then
+one measurement per line:
+    name,units,address,registers,gain,offset[,period]
+The optional period is how often, in seconds, the value needs reading
+(see pollsched.py); left out or empty, the value is read every scan.
+Blank lines and lines starting with '#' are skipped, as are any fields
+after the seventh.
+
+compile_mdf parses and validates a file, rejects duplicate or overlapping
+register ranges, and returns a MeasurementList holding the measurements
+both as the classic list of lists and as one array per field, together
+with the block read plan. Compiled lists are cached in memory and on disk
+by the SHA-1 of the file contents, so compiling an unchanged file again,
+at start up or on a reload, only costs reading and hashing it. The disk
+cache lives in the user's cache directory, ~/.cache/hygen/mlist (or under
+$XDG_CACHE_HOME), out of the source and config trees.
+
+check_analog validates analog input lists, [name, units, pin, gain, offset].
+"""
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from readplan import (plan_reads, NAME, UNITS, ADDR, LEN, GAIN, OFFSET,
+                      DEFAULT_GAP, MAX_BLOCK)
+
+HEADER_LINES = 2
+MAX_ADDRESS = 0xFFFF
+REGISTER_COUNTS = (1, 2)  # 16 and 32 bit values
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'), 'hygen', 'mlist')
+CACHE_VERSION = 2  # bump when MeasurementList changes
+PERIOD = 6  # optional MDF field
+
+# Analog measurement fields: [name, units, pin, gain, offset]
+A_NAME = 0
+A_UNITS = 1
+A_PIN = 2
+A_GAIN = 3
+A_OFFSET = 4
+
+# In-memory cache of compiled lists by (digest, max_gap, max_block)
+_compiled = {}
+
+
+class MeasurementList(object):
+    """
+    A compiled measurement list: the measurements as a list of lists
+    (meas_list) and as one array per field (names, units, addr, length,
+    gain, offset), the poll period of each measurement (None for every
+    scan), the read plan, and the digest of the source file.
+    """
+
+    def __init__(self, meas_list, plan, digest=None, periods=None):
+        self.meas_list = meas_list
+        self.plan = plan
+        self.digest = digest
+        if periods is None:
+            periods = [None] * len(meas_list)
+        self.periods = periods
+        self.names = [m[NAME] for m in meas_list]
+        self.units = [m[UNITS] for m in meas_list]
+        self.addr = np.array([m[ADDR] for m in meas_list], dtype=np.int32)
+        self.length = np.array([m[LEN] for m in meas_list], dtype=np.int32)
+        self.gain = np.array([m[GAIN] for m in meas_list], dtype=np.float64)
+        self.offset = np.array([m[OFFSET] for m in meas_list],
+                               dtype=np.float64)
+
+    def __len__(self):
+        return len(self.meas_list)
+
+    def __iter__(self):
+        return iter(self.meas_list)
+
+    def __getitem__(self, i):
+        return self.meas_list[i]
+
+
+def parse_mdf(lines, source='<mdf>'):
+    """
+    Parse the lines of an MDF into a list of
+    [name, units, address, registers, gain, offset], and the list of their
+    poll periods. Raises ValueError listing every bad line.
+    """
+    meas_list = []
+    periods = []
+    errors = []
+    for n, line in enumerate(lines):
+        if n < HEADER_LINES:
+            continue
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        where = "%s:%d" % (source, n + 1)
+        fields = [f.strip() for f in line.split(',')]
+        if len(fields) < 6:
+            errors.append("%s: expected 6 fields, got %d"
+                          % (where, len(fields)))
+            continue
+        try:
+            addr = int(fields[ADDR])
+            length = int(fields[LEN])
+            gain = float(fields[GAIN])
+            offset = float(fields[OFFSET])
+            period = None
+            if len(fields) > PERIOD and fields[PERIOD]:
+                period = float(fields[PERIOD])
+        except ValueError as e:
+            errors.append("%s: %s" % (where, e))
+            continue
+        if not fields[NAME]:
+            errors.append("%s: empty name" % where)
+        elif not 0 <= addr <= MAX_ADDRESS:
+            errors.append("%s: address %d out of range" % (where, addr))
+        elif length not in REGISTER_COUNTS:
+            errors.append("%s: register count must be 1 or 2, not %d"
+                          % (where, length))
+        elif addr + length - 1 > MAX_ADDRESS:
+            errors.append("%s: registers run past %d" % (where, MAX_ADDRESS))
+        elif period is not None and not period > 0:
+            errors.append("%s: period must be positive" % where)
+        else:
+            meas_list.append([fields[NAME], fields[UNITS], addr, length,
+                              gain, offset])
+            periods.append(period)
+    if errors:
+        raise ValueError("Invalid measurement list:\n" + "\n".join(errors))
+    return meas_list, periods
+
+
+def check_registers(meas_list):
+    """
+    Raise ValueError if two measurements read the same register, naming
+    duplicates (same address and size) and overlaps.
+    """
+    order = sorted(range(len(meas_list)), key=lambda i: meas_list[i][ADDR])
+    errors = []
+    last = None  # measurement reaching furthest so far
+    for i in order:
+        m = meas_list[i]
+        if last is not None and m[ADDR] < last[ADDR] + last[LEN]:
+            if m[ADDR] == last[ADDR] and m[LEN] == last[LEN]:
+                errors.append("%s duplicates %s (register %d)"
+                              % (m[NAME], last[NAME], m[ADDR]))
+            else:
+                errors.append("%s (registers %d-%d) overlaps %s (%d-%d)"
+                              % (m[NAME], m[ADDR], m[ADDR] + m[LEN] - 1,
+                                 last[NAME], last[ADDR],
+                                 last[ADDR] + last[LEN] - 1))
+        if last is None or m[ADDR] + m[LEN] > last[ADDR] + last[LEN]:
+            last = m
+    if errors:
+        raise ValueError("Invalid measurement list:\n" + "\n".join(errors))
+
+
+def compile_list(meas_list, max_gap=DEFAULT_GAP, max_block=MAX_BLOCK,
+                 digest=None, periods=None):
+    """
+    Validate a list of [name, units, address, registers, gain, offset] and
+    compile it into a MeasurementList.
+    """
+    check_registers(meas_list)
+    return MeasurementList(meas_list, plan_reads(meas_list, max_gap,
+                                                 max_block), digest, periods)
+
+
+def compile_mdf(path, max_gap=DEFAULT_GAP, max_block=MAX_BLOCK,
+                cache_dir=None):
+    """
+    Compile the MDF at path, using a cached result if the file has not
+    changed. The disk cache lives in cache_dir, by default CACHE_DIR; if
+    it cannot be written only the memory cache is used.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    key = (digest, max_gap, max_block)
+    if key in _compiled:
+        return _compiled[key]
+
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    cache_file = os.path.join(cache_dir, '%s_%d_%d_v%d.pickle'
+                              % (key + (CACHE_VERSION,)))
+    try:
+        with open(cache_file, 'rb') as f:
+            compiled = pickle.load(f)
+    except Exception:
+        # Missing, unreadable or from an incompatible version: rebuild
+        lines = data.decode('utf-8', 'replace').splitlines()
+        meas_list, periods = parse_mdf(lines, path)
+        compiled = compile_list(meas_list, max_gap, max_block, digest,
+                                periods)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = cache_file + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(compiled, f, 2)
+            os.rename(tmp, cache_file)
+        except (IOError, OSError):
+            pass
+    _compiled[key] = compiled
+    return compiled
+
+
+def check_analog(measurements):
+    """
+    Check a list of analog inputs, [name, units, pin, gain, offset]. Raise
+    ValueError if one is malformed or two share a name or a pin.
+    """
+    names = set()
+    pins = set()
+    for m in measurements:
+        try:
+            assert len(m) == 5
+            assert isinstance(m[A_NAME], str) and m[A_NAME]
+            assert isinstance(m[A_UNITS], str)
+            assert isinstance(m[A_PIN], str)
+            assert isinstance(m[A_GAIN], float)
+            assert isinstance(m[A_OFFSET], float)
+        except (AssertionError, TypeError):
+            raise ValueError("Measurement list formatted incorrectly")
+        if m[A_NAME] in names:
+            raise ValueError("Duplicate measurement name: %s" % m[A_NAME])
+        if m[A_PIN] in pins:
+            raise ValueError("Pin %s used twice" % m[A_PIN])
+        names.add(m[A_NAME])
+        pins.add(m[A_PIN])
+    return True
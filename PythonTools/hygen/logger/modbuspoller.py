@@ -0,0 +1,299 @@
+"""
+Poll several Modbus TCP devices concurrently with asyncio.
+
+Each endpoint is scanned on its own drift-free schedule: scan n starts at
+t0 + n * period regardless of how long earlier scans took, and scans that
+would start late are skipped rather than bunched up. Every request has a
+timeout, lost connections are re-established in the background, and each
+scan is reported as a ScanRecord stamped with its start and end time.
+
+An endpoint given a pollsched.PollScheduler only reads the measurements
+due on each scan, and reports the last reading of the others; the
+poller's period is then the scheduler's tick.
+
+Requires Python 3.
+"""
+
+import asyncio
+import logging
+import struct
+import time
+from collections import namedtuple
+
+import metrics
+from readplan import plan_reads, scale_blocks, DEFAULT_GAP, MAX_BLOCK, MISSING
+
+# Modbus function code for reading holding registers
+READ_HOLDING_REGISTERS = 0x03
+
+# name: endpoint name
+# start, end: wall clock (time.time()) at the start and end of the scan
+# values: scaled values in measurement list order
+ScanRecord = namedtuple('ScanRecord', ['name', 'start', 'end', 'values'])
+
+
+class ModbusError(Exception):
+    """
+    The device answered a request with a Modbus exception response.
+    """
+    pass
+
+
+class ModbusEndpoint(object):
+
+    def __init__(self, name, host, port, meas_list, unit=1,
+                 max_gap=DEFAULT_GAP, max_block=MAX_BLOCK, signed32=False,
+                 schedule=None):
+        """
+        Describe one Modbus TCP device (or gateway port) to poll.
+
+        meas_list: [["name", "units", addr, len, gain, offset], ...]
+        schedule: a pollsched.PollScheduler for meas_list, to give each
+            measurement its own poll period. It decodes the values, so its
+            signed setting must match signed32.
+        """
+        if schedule is not None and schedule.signed != signed32:
+            raise ValueError("%s: signed32 is %s but the schedule's signed "
+                             "is %s" % (name, signed32, schedule.signed))
+        self.name = name
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.meas_list = meas_list
+        self.plan = plan_reads(meas_list, max_gap, max_block)
+        self.signed32 = signed32
+        self.schedule = schedule
+
+        self._reader = None
+        self._writer = None
+        self._transaction = 0
+        self.connected = asyncio.Event()
+
+    def __str__(self):
+        return "%s (%s:%d)" % (self.name, self.host, self.port)
+
+    async def connect(self):
+        """
+        Open the TCP connection to the device.
+        """
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port)
+        self.connected.set()
+
+    def close(self):
+        """
+        Drop the TCP connection, if any.
+        """
+        self.connected.clear()
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def read_holding_registers(self, start, count):
+        """
+        Read count holding registers starting at start. Returns a list of
+        register values.
+
+        Can raise:
+        - ModbusError for an exception response or a malformed answer.
+          The connection is dropped if the answer's framing is broken.
+        - ConnectionError / asyncio.IncompleteReadError for a lost link
+        """
+        self._transaction = (self._transaction + 1) & 0xFFFF
+        tid = self._transaction
+        # MBAP header (transaction, protocol 0, length, unit) followed by the
+        # PDU (function, start, count)
+        self._writer.write(struct.pack('>HHHBBHH', tid, 0, 6, self.unit,
+                                       READ_HOLDING_REGISTERS, start, count))
+        await self._writer.drain()
+
+        while True:
+            header = await self._reader.readexactly(7)
+            rtid, _, length, _ = struct.unpack('>HHHB', header)
+            # The shortest answer is an exception: unit, function, code
+            if length < 3:
+                self.close()
+                raise ModbusError("%s: malformed answer of length %d "
+                                  "reading %d" % (self, length, start))
+            pdu = await self._reader.readexactly(length - 1)
+            if rtid == tid:
+                break
+            # Stale answer to a request that already timed out
+
+        if pdu[0] & 0x7F != READ_HOLDING_REGISTERS:
+            raise ModbusError("%s: answer to function %d reading %d"
+                              % (self, pdu[0] & 0x7F, start))
+        if pdu[0] & 0x80:
+            raise ModbusError("%s: exception code %d reading %d"
+                              % (self, pdu[1], start))
+        if pdu[1] != 2 * count or len(pdu) != 2 * count + 2:
+            raise ModbusError("%s: expected %d bytes, got %d reading %d"
+                              % (self, 2 * count, len(pdu) - 2, start))
+        return list(struct.unpack('>%dH' % count, pdu[2:]))
+
+
+class ModbusPoller(object):
+
+    def __init__(self, endpoints, handlers, period=1.0, timeout=0.5,
+                 reconnect_delay=1.0, max_reconnect_delay=30.0,
+                 sink=None, missing=MISSING):
+        """
+        Set up a poller for a list of ModbusEndpoints.
+
+        period: seconds between scan starts
+        timeout: seconds to wait for each request
+        reconnect_delay, max_reconnect_delay: the delay between connection
+            attempts starts at reconnect_delay and doubles on each failure
+        sink: callable given each ScanRecord. By default records are put on
+            the asyncio.Queue self.records.
+        """
+        for e in endpoints:
+            if e.schedule is not None and e.schedule.tick != period:
+                raise ValueError("%s: poll period and schedule tick differ"
+                                 % e)
+        self.endpoints = endpoints
+        self.period = period
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.missing = missing
+
+        self.records = asyncio.Queue()
+        self._sink = sink if sink is not None else self.records.put_nowait
+        self._cancelled = False
+
+        # Number of scans skipped because the previous one overran
+        self.overruns = {e.name: 0 for e in endpoints}
+
+        self._m = {}
+        for e in endpoints:
+            labels = {'endpoint': e.name}
+            self._m[e.name] = {
+                'read': metrics.histogram(
+                    'modbus_read_seconds', "Time taken by one block read",
+                    labels),
+                'scan': metrics.histogram(
+                    'modbus_scan_seconds', "Time taken by one scan", labels),
+                'exceptions': metrics.counter(
+                    'modbus_exceptions_total',
+                    "Modbus exception responses", labels),
+                'link_errors': metrics.counter(
+                    'modbus_link_errors_total',
+                    "Timeouts and lost connections", labels),
+                'overruns': metrics.counter(
+                    'modbus_overruns_total',
+                    "Scans skipped because the previous one overran", labels),
+            }
+
+        self._logger = logging.getLogger(__name__)
+        for h in handlers:
+            self._logger.addHandler(h)
+
+    async def run(self):
+        """
+        Poll every endpoint until cancel() is called.
+        """
+        tasks = []
+        for e in self.endpoints:
+            tasks.append(asyncio.ensure_future(self._keep_connected(e)))
+            tasks.append(asyncio.ensure_future(self._poll(e)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            for e in self.endpoints:
+                e.close()
+
+    def cancel(self):
+        """
+        Stop polling after the current scans complete.
+        """
+        self._logger.info("Stopping " + str(self))
+        self._cancelled = True
+
+    async def _keep_connected(self, endpoint):
+        """
+        Re-open the endpoint's connection whenever it is lost.
+        """
+        delay = self.reconnect_delay
+        while not self._cancelled:
+            if endpoint.connected.is_set():
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            try:
+                await asyncio.wait_for(endpoint.connect(), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self._logger.error("Could not connect to %s: %s"
+                                   % (endpoint, e))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            else:
+                self._logger.info("Connected to %s" % endpoint)
+                delay = self.reconnect_delay
+
+    async def _poll(self, endpoint):
+        """
+        Scan the endpoint on a fixed schedule.
+        """
+        loop = asyncio.get_event_loop()
+        t0 = loop.time()
+        n = 0
+        while not self._cancelled:
+            await asyncio.sleep(max(0.0, t0 + n * self.period - loop.time()))
+            if self._cancelled:
+                break
+            self._sink(await self.scan(endpoint, n))
+
+            # Skip any scan whose start time has already passed
+            next_n = int((loop.time() - t0) // self.period) + 1
+            if next_n > n + 1:
+                self.overruns[endpoint.name] += next_n - n - 1
+                self._m[endpoint.name]['overruns'].inc(next_n - n - 1)
+            n = next_n
+
+    async def scan(self, endpoint, n=0):
+        """
+        Read every block of the endpoint's plan once, or if it has a
+        schedule the blocks due on scan n. Returns a ScanRecord; values
+        from blocks that could not be read are reported as missing.
+        """
+        m = self._m[endpoint.name]
+        start = time.time()
+        plan = endpoint.plan
+        scheduled = None
+        if endpoint.schedule is not None:
+            scheduled = endpoint.schedule.scan(n)
+            plan = scheduled.plan if scheduled is not None else []
+        results = []
+        for block in plan:
+            regs = None
+            if endpoint.connected.is_set():
+                t = time.monotonic()
+                try:
+                    regs = await asyncio.wait_for(
+                        endpoint.read_holding_registers(block.start,
+                                                        block.count),
+                        self.timeout)
+                except ModbusError as e:
+                    self._logger.error(str(e))
+                    m['exceptions'].inc()
+                except (OSError, EOFError, asyncio.TimeoutError) as e:
+                    # The link is in an unknown state; start over
+                    self._logger.error("Lost connection to %s: %s"
+                                       % (endpoint, e.__class__.__name__))
+                    m['link_errors'].inc()
+                    endpoint.close()
+                else:
+                    m['read'].observe(time.monotonic() - t)
+            results.append(regs)
+        if endpoint.schedule is None:
+            values = scale_blocks(endpoint.meas_list, plan, results,
+                                  endpoint.signed32, self.missing)
+        elif scheduled is None:
+            values = endpoint.schedule.values.tolist()
+        else:
+            values = endpoint.schedule.update(scheduled, results).tolist()
+        end = time.time()
+        m['scan'].observe(end - start)
+        return ScanRecord(endpoint.name, start, end, values)
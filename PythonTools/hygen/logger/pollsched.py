@@ -0,0 +1,200 @@
+"""
+Poll each Modbus measurement only as often as it needs.
+
+Reading every measurement on every scan spends most of the bus on slow
+values (start counts, run hours, temperatures) and keeps fast ones, like
+bus current or engine speed, from being read any faster. A PollScheduler
+instead runs on a fast tick and gives each measurement its own period, a
+whole number of ticks:
+- declared in the measurement description file (see mlist.py), or
+- if learning is on, adapted from how much the value changes between
+  reads: a value which stays within its tolerance for 'quiet_reads'
+  reads in a row is read half as often, down to 'max_period', and one
+  which moves is read twice as often again, up to every tick
+
+Each tick's scan reads only the measurements that are due, coalesced into
+block reads by readplan.plan_reads. Periods are aligned to the start of
+the schedule, so slow measurements fall due together and share blocks.
+The plan and decoder of each set of due measurements are built once and
+reused, since the sets repeat. Values not read on a tick keep their last
+reading.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from readplan import plan_reads, Block, DEFAULT_GAP, MAX_BLOCK, MISSING
+from scandecode import ScanDecoder
+
+DEFAULT_PERIOD = 1.0  # seconds, for measurements without a period
+MAX_PERIOD = 60.0  # longest period learning may reach, seconds
+TOLERANCE = 0.01  # relative change counted as no change when learning
+QUIET_READS = 4  # unchanged reads in a row before reading less often
+MAX_PLANS = 256  # cached plans before the cache is cleared
+
+# tick: the tick number the scan belongs to
+# plan: the block reads to make, as readplan.Blocks into the full list
+# due: indices of the measurements read
+ScheduledScan = namedtuple('ScheduledScan', ['tick', 'plan', 'due'])
+
+
+class PollScheduler(object):
+
+    def __init__(self, meas_list, periods=None, tick=0.1,
+                 default_period=DEFAULT_PERIOD, learn=False,
+                 tolerance=TOLERANCE, abs_tolerance=0.0,
+                 max_period=MAX_PERIOD, quiet_reads=QUIET_READS,
+                 max_gap=DEFAULT_GAP, max_block=MAX_BLOCK, signed=False,
+                 missing=MISSING):
+        """
+        meas_list: [["name", "units", addr, len, gain, offset], ...]
+        periods: seconds between reads of each measurement, None for
+            default_period, e.g. MeasurementList.periods
+        tick: seconds between scans. Periods are rounded to whole ticks.
+        learn: adapt the periods of measurements without a declared one
+        tolerance, abs_tolerance: when learning, a change of at most
+            max(abs_tolerance, tolerance * |value|) counts as no change
+        signed, missing: as for ScanDecoder
+        """
+        n = len(meas_list)
+        if periods is None:
+            periods = [None] * n
+        if len(periods) != n:
+            raise ValueError("Need one period per measurement")
+        if tick <= 0:
+            raise ValueError("tick must be positive")
+        self.meas_list = meas_list
+        self.tick = tick
+        self.max_gap = max_gap
+        self.max_block = max_block
+        self.signed = signed
+        self.missing = missing
+
+        def ticks(period):
+            return max(1, int(round(period / tick)))
+        self.every = np.array([ticks(default_period if p is None else p)
+                               for p in periods], dtype=np.int64)
+        self.learn = learn
+        self._learned = np.array([learn and p is None for p in periods])
+        self.tolerance = tolerance
+        self.abs_tolerance = abs_tolerance
+        self._max_every = ticks(max_period)
+        self._min_every = self.every.copy()  # declared or default periods
+        self._min_every[self._learned] = 1
+        self.quiet_reads = quiet_reads
+        self._quiet = np.zeros(n, dtype=np.int64)
+
+        self.values = np.full(n, float(missing))
+        self.last_read = np.full(n, -1, dtype=np.int64)  # tick of last read
+        self._plans = {}  # due mask bytes: (plan, decoder)
+
+    def periods(self):
+        """
+        Return the current period of every measurement in seconds.
+        """
+        return self.every * self.tick
+
+    def due(self, tick):
+        """
+        Return the indices of the measurements due on a tick.
+        """
+        return np.flatnonzero(tick % self.every == 0)
+
+    def _compile(self, due):
+        """
+        Return the plan and decoder reading the measurements in due.
+        """
+        key = due.tobytes()
+        compiled = self._plans.get(key)
+        if compiled is None:
+            if len(self._plans) >= MAX_PLANS:
+                self._plans.clear()
+            subset = [self.meas_list[i] for i in due]
+            signed = self.signed
+            if not isinstance(signed, bool):
+                signed = [signed[i] for i in due]
+            local = plan_reads(subset, self.max_gap, self.max_block)
+            # The plan handed out refers to the full list, the decoder
+            # works on the subset
+            plan = [Block(b.start, b.count,
+                          tuple((int(due[i]), off) for i, off in b.members))
+                    for b in local]
+            compiled = (plan, ScanDecoder(subset, local, signed,
+                                          self.missing))
+            self._plans[key] = compiled
+        return compiled
+
+    def scan(self, tick):
+        """
+        Return the ScheduledScan for a tick, or None if nothing is due.
+        """
+        due = self.due(tick)
+        if not len(due):
+            return None
+        return ScheduledScan(tick, self._compile(due)[0], due)
+
+    def update(self, scan, results):
+        """
+        Decode the block read results of a scan (as from read_blocks) into
+        the held values, learn from them if learning is on, and return the
+        values of every measurement.
+        """
+        due = scan.due
+        decoder = self._compile(due)[1]
+        new = decoder.decode_blocks(results)
+        if self.learn:
+            self._adapt(due, new)
+        self.values[due] = new
+        self.last_read[due] = scan.tick
+        return self.values
+
+    def _adapt(self, due, new):
+        """
+        Lengthen the periods of quiet measurements and shorten those of
+        changing ones.
+        """
+        learned = self._learned[due] & (new != self.missing) & \
+            (self.last_read[due] >= 0) & (self.values[due] != self.missing)
+        if not learned.any():
+            return
+        idx = due[learned]
+        old = self.values[idx]
+        changed = np.abs(new[learned] - old) > \
+            np.maximum(self.abs_tolerance, self.tolerance * np.abs(old))
+
+        # Changing: read twice as often, straight away
+        moving = idx[changed]
+        self._quiet[moving] = 0
+        self.every[moving] = np.maximum(self.every[moving] // 2,
+                                        self._min_every[moving])
+
+        # Quiet for long enough: read half as often
+        still = idx[~changed]
+        self._quiet[still] += 1
+        slow = still[self._quiet[still] >= self.quiet_reads]
+        self._quiet[slow] = 0
+        self.every[slow] = np.minimum(self.every[slow] * 2, self._max_every)
+
+    def mean_requests(self, ticks=None):
+        """
+        Return the average number of block reads per tick over ticks ticks,
+        by default the time it takes every current period to come round.
+        """
+        if ticks is None:
+            ticks = 1
+            for e in np.unique(self.every):
+                ticks = ticks * int(e) // _gcd(ticks, int(e))
+            ticks = min(ticks, 10000)
+        total = 0
+        for t in range(ticks):
+            scan = self.scan(t)
+            if scan is not None:
+                total += len(scan.plan)
+        return float(total) / ticks
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
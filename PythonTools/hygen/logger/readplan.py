@@ -0,0 +1,122 @@
+"""
+Plan Modbus register reads for a measurement list.
+
+Reading one measurement per request costs a full round trip per value.
+Measurements whose registers sit close together are instead coalesced into
+block reads, and each value is sliced back out of the returned block.
+"""
+
+from collections import namedtuple
+
+# meas = ["name", "units", addr, len, gain, offset]
+NAME = 0
+UNITS = 1
+ADDR = 2
+LEN = 3
+GAIN = 4
+OFFSET = 5
+
+# Largest number of holding registers one Modbus request may ask for
+MAX_BLOCK = 125
+# Largest run of unused registers we are willing to read to merge two blocks
+DEFAULT_GAP = 4
+
+# Placeholder written for values whose block read failed
+MISSING = -9999.9
+
+# start: first register of the block
+# count: number of registers to read
+# members: tuple of (index into measurement list, offset into block)
+Block = namedtuple('Block', ['start', 'count', 'members'])
+
+
+def plan_reads(meas_list, max_gap=DEFAULT_GAP, max_block=MAX_BLOCK):
+    """
+    Return a list of Blocks covering every measurement in meas_list.
+
+    Measurements are sorted by address and merged into one block as long as
+    the gap of unused registers between them is at most max_gap and the
+    block stays within max_block registers.
+    """
+    if max_block < 1 or max_block > MAX_BLOCK:
+        raise ValueError("max_block must be between 1 and %d" % MAX_BLOCK)
+    if max_gap < 0:
+        raise ValueError("max_gap cannot be negative")
+
+    order = sorted(range(len(meas_list)), key=lambda i: meas_list[i][ADDR])
+    blocks = []
+    start = end = None
+    members = []
+    for i in order:
+        addr = meas_list[i][ADDR]
+        length = meas_list[i][LEN]
+        if length < 1 or length > max_block:
+            raise ValueError("Invalid register count for %s: %d"
+                             % (meas_list[i][NAME], length))
+
+        if (members
+                and addr - end <= max_gap
+                and max(end, addr + length) - start <= max_block):
+            end = max(end, addr + length)
+        else:
+            if members:
+                blocks.append(Block(start, end - start, tuple(members)))
+            start, end, members = addr, addr + length, []
+        members.append((i, addr - start))
+
+    if members:
+        blocks.append(Block(start, end - start, tuple(members)))
+    return blocks
+
+
+def decode_value(regs, offset, length, signed32=False):
+    """
+    Return the raw integer held at regs[offset], combining a pair of
+    registers (high word first) for 32-bit values. If signed32 is set,
+    32-bit values are read as two's complement.
+    """
+    if length == 2:
+        value = regs[offset] * 65536 + regs[offset + 1]
+        if signed32 and value >= 2 ** 31:
+            value -= 2 ** 32
+    else:
+        value = regs[offset]
+    return value
+
+
+def read_blocks(read, plan):
+    """
+    Perform every block read in the plan.
+
+    read: callable taking (start, count) and returning a list of register
+        values, or None on failure (e.g. ModbusClient.read_holding_registers)
+
+    Returns a list holding the registers (or None) for each block.
+    """
+    return [read(block.start, block.count) for block in plan]
+
+
+def scale_blocks(meas_list, plan, results, signed32=False, missing=MISSING):
+    """
+    Slice and scale every measurement out of the block read results.
+
+    Values are returned in measurement list order. Measurements whose block
+    failed or came back short are reported as missing.
+    """
+    values = [missing] * len(meas_list)
+    for block, regs in zip(plan, results):
+        if regs is None or len(regs) < block.count:
+            continue
+        for i, offset in block.members:
+            meas = meas_list[i]
+            raw = decode_value(regs, offset, meas[LEN], signed32)
+            values[i] = float(raw) * meas[GAIN] + meas[OFFSET]
+    return values
+
+
+def read_scan(read, meas_list, plan, signed32=False, missing=MISSING):
+    """
+    Read and scale a complete scan of meas_list using the given plan.
+    """
+    return scale_blocks(meas_list, plan, read_blocks(read, plan),
+                        signed32, missing)
@@ -0,0 +1,275 @@
+"""
+A bounded queue for log lines with a choice of what to do when it is full.
+
+RingQueue can stand in for the Queue.Queue the producers share with the
+FileWriter. It holds at most 'size' items in memory; when it is full a
+put() is handled according to the policy:
+- 'block': wait for room, as Queue.Queue(maxsize) does
+- 'drop_oldest': discard the oldest item to make room
+- 'drop_newest': discard the item being put
+- 'spill': append the item to a file on the on-board storage. Once
+  spilling has started every new item goes to the file until it has all
+  been read back, so items always come out in the order they went in.
+  get() refills memory from the file, at most 'size' items at a time, as
+  the consumer catches up. When the file reaches 'spill_limit' bytes
+  the part already read back is cut off the front of it, and only if
+  the items still waiting in it take 'spill_limit' bytes are new items
+  dropped.
+Memory use is bounded by 'size' whatever the policy.
+"""
+
+from collections import deque
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+
+import metrics
+
+if sys.version_info[0] == 3:
+    import queue
+elif sys.version_info[0] == 2:
+    import Queue as queue
+
+POLICIES = ('block', 'drop_oldest', 'drop_newest', 'spill')
+
+# Defaults for the optional filewriter queue configuration
+QUEUE_SIZE = 10000
+QUEUE_POLICY = 'block'
+SPILL_LIMIT = 100 * 1024 * 1024  # bytes
+
+
+class RingQueue(object):
+
+    def __init__(self, size=QUEUE_SIZE, policy=QUEUE_POLICY, spill_path=None,
+                 spill_limit=SPILL_LIMIT):
+        """
+        size: most items held in memory
+        policy: one of POLICIES, what to do with a put when full
+        spill_path: file to spill to, required by the 'spill' policy. Any
+            items left in it by an earlier run are read back first.
+        spill_limit: largest size of the spill file, in bytes
+        """
+        if size < 1:
+            raise ValueError("Queue size must be at least 1")
+        if policy not in POLICIES:
+            raise ValueError("Invalid queue policy: %s" % policy)
+        if policy == 'spill' and spill_path is None:
+            raise ValueError("The spill policy needs a spill_path")
+        self.size = size
+        self.policy = policy
+        self.spill_path = spill_path
+        self.spill_limit = spill_limit
+
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        # Items discarded and items written to the spill file, in total
+        self.dropped = 0
+        self.spilled = 0
+        self._m_dropped = metrics.counter(
+            'queue_dropped_total', "Items dropped by a full log queue")
+        self._m_spilled = metrics.counter(
+            'queue_spilled_total', "Items spilled to file by a full log queue")
+
+        # Spill file, open for appending and for reading back
+        self._spill_w = None
+        self._spill_r = None
+        if policy == 'spill' and os.path.exists(spill_path) \
+                and os.path.getsize(spill_path) > 0:
+            self._spill_w = open(spill_path, 'ab')
+            self._spill_r = open(spill_path, 'rb')
+
+    ###################################
+    # Producer side
+    ###################################
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Put an item on the queue, applying the policy if it is full. Raises
+        queue.Full only with the 'block' policy, if block is False or the
+        timeout runs out.
+        """
+        with self._not_full:
+            if self._spilling():
+                self._spill(item)
+                return
+            if len(self._items) >= self.size:
+                if self.policy == 'block':
+                    self._wait_for_room(block, timeout)
+                elif self.policy == 'drop_oldest':
+                    self._items.popleft()
+                    self._drop()
+                elif self.policy == 'drop_newest':
+                    self._drop()
+                    return
+                else:
+                    self._spill(item)
+                    return
+            self._items.append(item)
+            self._not_empty.notify()
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def _wait_for_room(self, block, timeout):
+        if not block:
+            raise queue.Full
+        if timeout is None:
+            while len(self._items) >= self.size:
+                self._not_full.wait()
+        else:
+            deadline = time.time() + timeout
+            while len(self._items) >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Full
+                self._not_full.wait(remaining)
+
+    def _drop(self):
+        self.dropped += 1
+        self._m_dropped.inc()
+
+    def _spilling(self):
+        return self._spill_r is not None
+
+    def _spill(self, item):
+        """
+        Append an item to the spill file, or drop it if the file is full
+        or cannot be written.
+        """
+        try:
+            if self._spill_w is None:
+                self._spill_w = open(self.spill_path, 'wb')
+                self._spill_r = open(self.spill_path, 'rb')
+            if self._spill_w.tell() >= self.spill_limit:
+                self._compact()
+                if self._spill_w.tell() >= self.spill_limit:
+                    self._drop()
+                    return
+            pickle.dump(item, self._spill_w, 2)
+            # Keep what has been spilled if the logger dies
+            self._spill_w.flush()
+        except (IOError, OSError):
+            self._drop()
+            return
+        self.spilled += 1
+        self._m_spilled.inc()
+        self._not_empty.notify()
+
+    ###################################
+    # Consumer side
+    ###################################
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return the oldest item. Raises queue.Empty if block is
+        False or the timeout runs out with nothing to get.
+        """
+        with self._not_empty:
+            if not self._items and self._spilling():
+                self._unspill()
+            if not self._items:
+                if not block:
+                    raise queue.Empty
+                if timeout is None:
+                    while not self._items:
+                        self._not_empty.wait()
+                        if self._spilling():
+                            self._unspill()
+                else:
+                    deadline = time.time() + timeout
+                    while not self._items:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise queue.Empty
+                        self._not_empty.wait(remaining)
+                        if self._spilling():
+                            self._unspill()
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def _unspill(self):
+        """
+        Read up to size items back from the spill file into memory. Once
+        the file has all been read it is removed and spilling stops.
+        """
+        while len(self._items) < self.size:
+            try:
+                self._items.append(pickle.load(self._spill_r))
+            except EOFError:
+                self._end_spill()
+                return
+            except (pickle.UnpicklingError, ValueError, IOError, OSError):
+                # A torn write at the end of a file from an earlier run
+                self._end_spill()
+                return
+        if self._spill_r.tell() >= self._spill_w.tell():
+            self._end_spill()  # so empty() is right straight away
+
+    def _compact(self):
+        """
+        Rewrite the spill file without the items already read back.
+        """
+        if self._spill_r.tell() == 0:
+            return
+        tmp = self.spill_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            shutil.copyfileobj(self._spill_r, f)
+        self._spill_w.close()
+        self._spill_r.close()
+        os.rename(tmp, self.spill_path)
+        self._spill_w = open(self.spill_path, 'ab')
+        self._spill_r = open(self.spill_path, 'rb')
+
+    def _end_spill(self):
+        self._spill_w.close()
+        self._spill_r.close()
+        self._spill_w = self._spill_r = None
+        try:
+            os.remove(self.spill_path)
+        except OSError:
+            pass
+
+    def qsize(self):
+        """
+        Return the number of items held in memory.
+        """
+        with self._lock:
+            return len(self._items)
+
+    def empty(self):
+        with self._lock:
+            return not self._items and not self._spilling()
+
+    def full(self):
+        with self._lock:
+            return len(self._items) >= self.size
+
+    def spill_size(self):
+        """
+        Return the size in bytes of the spill file, 0 if not spilling.
+        """
+        with self._lock:
+            if self._spill_w is None:
+                return 0
+            return self._spill_w.tell()
+
+
+def from_config(lconfig):
+    """
+    Build a RingQueue from the optional queue settings of a filewriter
+    config: 'queue_size', 'queue_policy', 'spill_path' and 'spill_limit'.
+    """
+    return RingQueue(lconfig.get('queue_size', QUEUE_SIZE),
+                     lconfig.get('queue_policy', QUEUE_POLICY),
+                     lconfig.get('spill_path'),
+                     lconfig.get('spill_limit', SPILL_LIMIT))
@@ -0,0 +1,122 @@
+"""
+Format rows of values as CSV text with one precompiled format string.
+
+A RowFormatter is built once for a fixed set of columns. Formatting a row
+is then a single '%' operation on the whole row, rather than a format
+call per value, and a batch of rows is formatted with one '%' operation
+on the whole batch. Rows holding missing values (None or NaN) take a
+slower path which writes the missing text in their place.
+"""
+
+
+class RowFormatter(object):
+
+    def __init__(self, columns, precision=3, time_precision=None, width=0,
+                 sep=',', missing='', trailing=False):
+        """
+        columns: the number of value columns, each formatted with precision
+            decimal places, or a list of the decimal places of each column
+        time_precision: if not None, rows start with a timestamp column
+            formatted with this many decimal places
+        width: least width of each value, padded with spaces
+        missing: text written for None or NaN values
+        trailing: end each row with a separator
+        """
+        if isinstance(columns, int):
+            columns = [precision] * columns
+        self.precisions = list(columns)
+        self.time_precision = time_precision
+        self.sep = sep
+        self.missing = missing
+        self.trailing = trailing
+
+        self._formats = ['%%%d.%df' % (width, p) for p in self.precisions]
+        self._missing = ('%%%ds' % width) % missing
+        # '%' characters in the separator must not be taken as formats
+        fsep = sep.replace('%', '%%')
+        fmt = fsep.join(self._formats)
+        if time_precision is not None:
+            fmt = '%%.%df' % time_precision + (fsep + fmt if fmt else '')
+        if trailing:
+            fmt += fsep
+        self._row = fmt
+        self._line = fmt + '\n'
+        self._ncolumns = len(self.precisions)
+
+    def __len__(self):
+        return self._ncolumns
+
+    def _values(self, values, t):
+        if hasattr(values, 'tolist'):  # NumPy array
+            values = values.tolist()
+        if len(values) != self._ncolumns:
+            raise ValueError("Expected %d values, got %d"
+                             % (self._ncolumns, len(values)))
+        if self.time_precision is not None:
+            return (t,) + tuple(values)
+        return tuple(values)
+
+    def format(self, values, t=None):
+        """
+        Return one row of values as text, without a new-line. t is the
+        timestamp, if the formatter has a timestamp column.
+        """
+        row = self._values(values, t)
+        try:
+            text = self._row % row
+        except TypeError:  # None in the row
+            return self._format_missing(row)
+        if 'nan' in text:  # infinities are written as 'inf'
+            return self._format_missing(row)
+        return text
+
+    def _format_missing(self, row):
+        """
+        Format a row field by field, writing missing values as text.
+        """
+        fields = []
+        formats = self._formats
+        if self.time_precision is not None:
+            formats = ['%%.%df' % self.time_precision] + formats
+        for fmt, v in zip(formats, row):
+            # v != v also catches NaN NumPy scalars, which are not floats
+            if v is None or v != v:
+                fields.append(self._missing)
+            else:
+                fields.append(fmt % v)
+        if self.trailing:
+            fields.append('')
+        return self.sep.join(fields)
+
+    def format_rows(self, rows, times=None):
+        """
+        Return a batch of rows as text, each row ending in a new-line.
+        rows is a sequence of rows or a 2D NumPy array; times holds one
+        timestamp per row if the formatter has a timestamp column.
+        """
+        timed = self.time_precision is not None
+        if hasattr(rows, 'ravel'):  # NumPy array: flatten in one step
+            import numpy as np
+            if rows.ndim != 2 or rows.shape[1] != self._ncolumns:
+                raise ValueError("Expected rows of %d values"
+                                 % self._ncolumns)
+            if timed:
+                rows = np.column_stack((times, rows))
+            n = len(rows)
+            flat = rows.ravel().tolist()
+        else:
+            n = len(rows)
+            flat = []
+            for i, values in enumerate(rows):
+                flat.extend(self._values(values,
+                                         times[i] if timed else None))
+        try:
+            text = (self._line * n) % tuple(flat)
+        except TypeError:  # None in the batch
+            text = None
+        if text is None or 'nan' in text:
+            width = self._ncolumns + (1 if timed else 0)
+            return ''.join(
+                self._format_missing(flat[i:i + width]) + '\n'
+                for i in range(0, len(flat), width))
+        return text
@@ -0,0 +1,564 @@
+"""
+Run each enabled subsystem of the logger in its own process.
+
+In the default mode every subsystem is a thread in one process, sharing
+one GIL, so a slow USB write or serial timeout takes time away from ADC
+sampling. In supervisor mode each subsystem named in the config map's
+'enabled' list runs in a worker process of its own:
+- producer workers (e.g. 'analog', 'deepsea') send their CSV header once
+  and then their latest CSV line every report period over a pipe. Other
+  workers, like 'fastcapture', write their own files and only report
+  their CPU use.
+- the supervisor joins the latest lines into one row per period and puts
+  it on the queue of the 'filewriter' worker
+- crashed workers are restarted after a delay which doubles with each
+  crash in a row, up to a maximum
+- workers are pinned round-robin to the CPU cores available, if the
+  platform supports it
+- every worker reports its CPU use and the supervisor logs it along with
+  the latency of the data it receives
+- if the config map has a 'metrics' section, every worker publishes its
+  own metrics, with the worker name added to the file or socket name
+- the filewriter worker moves rows off the pipe from the supervisor onto
+  a ringqueue.RingQueue set up from the filewriter config, so its queue
+  policy bounds the memory used. If that pipe backs up, the supervisor
+  drops rows rather than stall.
+- request_reload() (entry.py calls it on SIGHUP) reads the config map
+  again and only touches the workers whose sections changed: analog and
+  filewriter workers are reconfigured in place (see livereload.py), other
+  changed workers are restarted, workers added to or removed from
+  'enabled' are started or stopped, and the filewriter gets a new header
+  whenever the producers' columns change. Changes to the 'period' of
+  workers and to 'metrics' apply as the workers restart.
+
+Optional settings come from the 'supervisor' section of the config map:
+    'supervisor': {
+        'period': 1.0,  # seconds between rows written
+        'restart_delay': 1.0,  # seconds before the first restart
+        'max_restart_delay': 60.0,
+        'stable_time': 60.0,  # seconds up before the delay resets
+        'pin_cores': True,
+        'stats_period': 60.0,  # seconds between CPU / latency reports
+    }
+
+Needs Python 3 (multiprocessing.connection.wait).
+"""
+
+import importlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+
+from livereload import diff_config
+from metrics import MetricsDumper
+import ringqueue
+
+if sys.version_info[0] == 3:
+    import queue
+elif sys.version_info[0] == 2:
+    import Queue as queue
+
+# Subsystem name: (module, class) of the thread that implements it
+SUBSYSTEMS = {
+    'analog': ('analogclient', 'AnalogClient'),
+    'deepsea': ('deepseaclient', 'DeepSeaClient'),
+    'filewriter': ('logfilewriter', 'FileWriter'),
+    'fastcapture': ('fastcapture', 'FastCapture'),
+}
+
+# Subsystems which run in a worker but add no columns to the rows
+QUIET = ('filewriter', 'fastcapture')
+
+# Subsystems whose threads can be reconfigured in place, with the settings
+# that still need a restart of the worker to change
+LIVE = {
+    'analog': (),
+    'filewriter': ('format', 'dtype', 'queue_size', 'queue_policy',
+                   'spill_path', 'spill_limit'),
+}
+
+DEFAULTS = {
+    'period': 1.0,
+    'restart_delay': 1.0,
+    'max_restart_delay': 60.0,
+    'stable_time': 60.0,
+    'pin_cores': True,
+    'stats_period': 60.0,
+}
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def _make_thread(name, config, handlers, log_queue, header):
+    """
+    Build the thread implementing a subsystem.
+    """
+    module, cls = SUBSYSTEMS[name]
+    thread_class = getattr(importlib.import_module(module), cls)
+    if name == 'filewriter':
+        return thread_class(config[name], handlers, log_queue, header)
+    if name == 'analog':
+        return thread_class(config[name], handlers, {})
+    return thread_class(config[name], handlers)
+
+
+def worker_metrics(mconfig, name):
+    """
+    Return a copy of the metrics config with the worker name put into the
+    file and socket names, e.g. metrics.prom -> metrics.analog.prom.
+    """
+    mconfig = dict(mconfig)
+    for key in ('path', 'socket'):
+        if key in mconfig:
+            root, ext = os.path.splitext(mconfig[key])
+            mconfig[key] = '%s.%s%s' % (root, name, ext)
+    return mconfig
+
+
+def _feed(source, ring):
+    """
+    Move rows from the supervisor's queue onto the filewriter's ring queue.
+    """
+    while True:
+        ring.put(source.get())
+
+
+def worker_main(name, config, handlers, conn, log_queue, header, core,
+                period):
+    """
+    Body of a worker process: run one subsystem thread and report on it
+    over conn until told to stop or the thread dies.
+    """
+    logger = logging.getLogger(__name__)
+    if core is not None:
+        try:
+            os.sched_setaffinity(0, {core})
+        except (AttributeError, OSError):
+            pass
+
+    if 'metrics' in config:
+        MetricsDumper(worker_metrics(config['metrics'], name),
+                      handlers).start()
+
+    if name == 'filewriter':
+        ring = ringqueue.from_config(config['filewriter'])
+        feeder = threading.Thread(target=_feed, args=(log_queue, ring))
+        feeder.daemon = True
+        feeder.start()
+        log_queue = ring
+
+    thread = _make_thread(name, config, handlers, log_queue, header)
+    thread.daemon = True
+    thread.start()
+    producer = name not in QUIET
+    if producer:
+        header = thread.csv_header()
+        conn.send(('header', header))
+
+    next_report = time.time()
+    last_cpu, last_wall = _cpu_time(), time.time()
+    try:
+        while thread.is_alive():
+            if conn.poll(max(0.0, next_report - time.time())):
+                msg = conn.recv()
+                if msg == 'stop':
+                    break
+                try:
+                    if producer:
+                        thread.reconfigure(msg[1])
+                    else:
+                        thread.reconfigure(msg[1], msg[2])
+                except ValueError as e:
+                    logger.error("Invalid %s config, not reloaded: %s"
+                                 % (name, e))
+                continue
+            now = time.time()
+            if producer:
+                # The columns change once a reload has been applied
+                if thread.csv_header() != header:
+                    header = thread.csv_header()
+                    conn.send(('header', header))
+                conn.send(('data', now, thread.csv_line()))
+            cpu = _cpu_time()
+            conn.send(('cpu', (cpu - last_cpu) / (now - last_wall)))
+            last_cpu, last_wall = cpu, now
+            next_report += period
+            if next_report < now:
+                next_report = now + period
+        else:
+            logger.error("%s thread died" % name)
+            sys.exit(1)
+    finally:
+        thread.cancel()
+        thread.join(5.0)
+
+
+class Worker(object):
+    """
+    The supervisor's record of one worker process.
+    """
+
+    def __init__(self, name, core):
+        self.name = name
+        self.core = core
+        self.process = None
+        self.conn = None
+        self.started = None
+        self.restart_at = None
+        self.restarts = 0
+        self.header = None
+        self.line = None
+        self.cpu = 0.0
+        self.latency = []
+
+
+class Supervisor(object):
+
+    def __init__(self, config, handlers, load_config=None):
+        """
+        load_config: called with no arguments to read the config map again
+            on a reload
+        """
+        self.config = config
+        self.handlers = handlers
+        self._load_config = load_config
+        sconfig = dict(DEFAULTS)
+        sconfig.update(config.get('supervisor', {}))
+        self.sconfig = sconfig
+
+        self._logger = logging.getLogger(__name__)
+        for h in handlers:
+            self._logger.addHandler(h)
+
+        self._cancelled = False
+        self._reload = False
+        self.log_queue = self._new_queue()
+        self.dropped_rows = 0
+
+        self._cores = [None]
+        if sconfig['pin_cores'] and hasattr(os, 'sched_getaffinity'):
+            self._cores = sorted(os.sched_getaffinity(0))
+
+        self.workers = []
+        for name in self._enabled():
+            self._add_worker(name)
+        self._writer_header = None  # header the filewriter was last given
+
+    def _enabled(self):
+        """
+        The enabled subsystems which can run in a worker process: those
+        with a thread class whose module can be found. A worker for a
+        missing module would only crash and restart forever.
+        """
+        enabled = []
+        for name in self.config['enabled']:
+            if name not in SUBSYSTEMS \
+                    or importlib.util.find_spec(SUBSYSTEMS[name][0]) is None:
+                self._logger.error("No process implementation for %s"
+                                   % name)
+                continue
+            enabled.append(name)
+        return enabled
+
+    def _add_worker(self, name):
+        core = self._cores[len(self.workers) % len(self._cores)]
+        worker = Worker(name, core)
+        self.workers.append(worker)
+        self._producers = [w for w in self.workers if w.name not in QUIET]
+        self._writer = [w for w in self.workers if w.name == 'filewriter']
+        return worker
+
+    def _remove_worker(self, worker):
+        self._stop(worker)
+        self.workers.remove(worker)
+        self._producers = [w for w in self.workers if w.name not in QUIET]
+        self._writer = [w for w in self.workers if w.name == 'filewriter']
+
+    def _new_queue(self):
+        return multiprocessing.Queue(
+            self.config.get('filewriter', {}).get('queue_size',
+                                                  ringqueue.QUEUE_SIZE))
+
+    def _start(self, worker, header=None):
+        if worker.name == 'filewriter' and worker.process is not None:
+            # A worker that died reading the queue may have left its lock
+            # held, so every new filewriter gets a new queue. Rows still on
+            # the old one are dropped.
+            self.log_queue.cancel_join_thread()
+            self.log_queue.close()
+            self.log_queue = self._new_queue()
+        parent, child = multiprocessing.Pipe()
+        worker.process = multiprocessing.Process(
+            target=worker_main, name=worker.name,
+            args=(worker.name, self.config, self.handlers, child,
+                  self.log_queue, header, worker.core,
+                  self.sconfig['period']))
+        worker.process.daemon = True
+        worker.process.start()
+        child.close()
+        worker.conn = parent
+        worker.started = time.time()
+        worker.restart_at = None
+        if worker.name == 'filewriter':
+            self._writer_header = header
+        self._logger.info("Started %s worker (pid %d, core %s)"
+                          % (worker.name, worker.process.pid, worker.core))
+
+    def _stop(self, worker):
+        """
+        Stop one worker, killing it if it does not stop.
+        """
+        if worker.process is None:
+            return
+        if worker.process.is_alive():
+            try:
+                worker.conn.send('stop')
+            except (EOFError, OSError):
+                pass
+            worker.process.join(5.0)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(1.0)
+        worker.line = None
+
+    def _restart(self, worker):
+        self._stop(worker)
+        header = None
+        if worker.name == 'filewriter':
+            header = self._csv_header()
+        self._start(worker, header)
+
+    def _csv_header(self):
+        return ','.join(['time'] + [w.header or '' for w in self._producers])
+
+    def _send(self, worker, msg):
+        """
+        Send a message to a running worker. Returns False if it is down.
+        """
+        if worker.process is None or worker.restart_at is not None:
+            return False
+        try:
+            worker.conn.send(msg)
+        except (EOFError, OSError):
+            return False
+        return True
+
+    def _check_header(self):
+        """
+        Give the filewriter the new header if the producers' columns have
+        changed since it was started or last reconfigured.
+        """
+        if self._writer_header is None:
+            return  # not started yet, it gets the header when it starts
+        header = self._csv_header()
+        if header == self._writer_header:
+            return
+        for w in self._writer:
+            if self._send(w, ('reconfigure', self.config['filewriter'],
+                              header)):
+                self._writer_header = header
+                self._logger.info("Columns changed, new log file started")
+
+    def _start_all(self):
+        for w in self._producers:
+            self._start(w)
+        # The file writer needs every producer's header before it starts
+        deadline = time.time() + 10.0
+        while time.time() < deadline and \
+                any(w.header is None for w in self._producers):
+            self._receive(0.1)
+        for w in self._writer:
+            self._start(w, self._csv_header())
+
+    def _receive(self, timeout):
+        """
+        Handle messages from the workers for up to timeout seconds.
+        """
+        conns = {w.conn: w for w in self.workers
+                 if w.conn is not None and w.restart_at is None}
+        for conn in wait(list(conns), timeout):
+            w = conns[conn]
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                continue
+            if msg[0] == 'header':
+                w.header = msg[1]
+                self._check_header()
+            elif msg[0] == 'data':
+                w.line = msg[2]
+                w.latency.append(time.time() - msg[1])
+            elif msg[0] == 'cpu':
+                w.cpu = msg[1]
+
+    def _check_workers(self):
+        """
+        Schedule restarts for dead workers and restart those that are due.
+        """
+        now = time.time()
+        for w in self.workers:
+            if w.restart_at is None and not w.process.is_alive():
+                if now - w.started >= self.sconfig['stable_time']:
+                    w.restarts = 0
+                delay = min(self.sconfig['restart_delay'] * 2 ** w.restarts,
+                            self.sconfig['max_restart_delay'])
+                w.restarts += 1
+                w.restart_at = now + delay
+                w.line = None
+                self._logger.error(
+                    "%s worker exited with code %s, restarting in %.1f s"
+                    % (w.name, w.process.exitcode, delay))
+            elif w.restart_at is not None and now >= w.restart_at:
+                self._restart(w)
+
+    def _write_row(self):
+        """
+        Queue one row made of the latest line from every producer.
+        """
+        fields = ['%.3f' % time.time()]
+        for w in self._producers:
+            if w.line is not None:
+                fields.append(w.line)
+            else:
+                # Keep the columns lined up while a producer is down
+                fields.append(',' * (w.header or '').count(','))
+        try:
+            self.log_queue.put_nowait(','.join(fields))
+        except queue.Full:
+            self.dropped_rows += 1
+
+    def _log_stats(self):
+        for w in self.workers:
+            lat = sorted(w.latency)
+            if lat:
+                self._logger.info(
+                    "%s: cpu %.1f%%, latency median %.1f ms max %.1f ms, "
+                    "%d restarts"
+                    % (w.name, 100 * w.cpu, 1000 * lat[len(lat) // 2],
+                       1000 * lat[-1], w.restarts))
+            else:
+                self._logger.info("%s: cpu %.1f%%, %d restarts"
+                                  % (w.name, 100 * w.cpu, w.restarts))
+            w.latency = []
+        if self.dropped_rows:
+            self._logger.error("%d rows dropped, filewriter not keeping up"
+                               % self.dropped_rows)
+            self.dropped_rows = 0
+
+    def request_reload(self):
+        """
+        Reload the config map on the next pass of the run loop. Safe to
+        call from a signal handler.
+        """
+        self._reload = True
+
+    def reload(self):
+        """
+        Read the config map again and apply the sections that changed.
+        """
+        try:
+            config = self._load_config()
+        except Exception as e:
+            self._logger.error("Could not read the config map, not "
+                               "reloaded: %s" % e)
+            return
+        changed = diff_config(self.config, config)
+        if not changed:
+            self._logger.info("Config map unchanged")
+            return
+        self._logger.info("Reloading config: %s changed"
+                          % ', '.join(changed))
+        old, self.config = self.config, config
+        self.sconfig = dict(DEFAULTS)
+        self.sconfig.update(config.get('supervisor', {}))
+
+        started = set()
+        if 'enabled' in changed:
+            enabled = self._enabled()
+            for w in list(self.workers):
+                if w.name not in enabled:
+                    self._logger.info("Stopping %s worker" % w.name)
+                    self._remove_worker(w)
+            for name in enabled:
+                if name not in [w.name for w in self.workers]:
+                    w = self._add_worker(name)
+                    header = None
+                    if name == 'filewriter':
+                        header = self._csv_header()
+                    self._start(w, header)
+                    started.add(name)
+
+        for w in self.workers:
+            if w.name not in changed or w.name in started \
+                    or w.process is None or w.restart_at is not None:
+                # Down workers pick up the new config when they restart
+                continue
+            old_section = old.get(w.name, {})
+            section = config[w.name]
+            if w.name in LIVE and all(old_section.get(k) == section.get(k)
+                                      for k in LIVE[w.name]):
+                header = None
+                if w.name == 'filewriter':
+                    header = self._csv_header()
+                    self._writer_header = header
+                self._send(w, ('reconfigure', section, header))
+            else:
+                self._logger.info("Restarting %s worker for its new config"
+                                  % w.name)
+                self._restart(w)
+        self._check_header()
+
+    def run(self):
+        """
+        Start the workers and supervise them until cancel() is called.
+        """
+        self._start_all()
+        next_row = time.time() + self.sconfig['period']
+        next_stats = time.time() + self.sconfig['stats_period']
+        try:
+            while not self._cancelled:
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                self._receive(max(0.0, next_row - time.time()))
+                now = time.time()
+                if now >= next_row:
+                    self._write_row()
+                    period = self.sconfig['period']
+                    next_row += period
+                    if next_row < now:
+                        next_row = now + period
+                if now >= next_stats:
+                    self._log_stats()
+                    next_stats = now + self.sconfig['stats_period']
+                self._check_workers()
+        finally:
+            self.stop_workers()
+
+    def cancel(self):
+        self._logger.info("Stopping " + str(self))
+        self._cancelled = True
+
+    def stop_workers(self):
+        """
+        Ask every worker to stop, and kill those that do not.
+        """
+        for w in self.workers:
+            if w.process is not None and w.process.is_alive():
+                try:
+                    w.conn.send('stop')
+                except (EOFError, OSError):
+                    pass
+        for w in self.workers:
+            if w.process is not None:
+                w.process.join(5.0)
+                if w.process.is_alive():
+                    w.process.terminate()
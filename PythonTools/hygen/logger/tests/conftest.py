@@ -0,0 +1,34 @@
+import os
+import sys
+
+# The logger modules import each other by bare name, and the benchmark
+# script lives two levels up in PythonTools
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(HERE, os.pardir, os.pardir, os.pardir))
+
+# asynciothread, the base class of the logger threads, is not in this tree.
+# Stand in for it with a plain thread offering what the workers use.
+try:
+    import asynciothread  # noqa: F401
+except ImportError:
+    import logging
+    import threading
+    import types
+
+    class AsyncIOThread(threading.Thread):
+
+        def __init__(self, handlers):
+            super(AsyncIOThread, self).__init__()
+            self.daemon = True
+            self._cancelled = False
+            self._logger = logging.getLogger(self.__class__.__name__)
+            for h in handlers:
+                self._logger.addHandler(h)
+
+        def cancel(self):
+            self._cancelled = True
+
+    asynciothread = types.ModuleType('asynciothread')
+    asynciothread.AsyncIOThread = AsyncIOThread
+    sys.modules['asynciothread'] = asynciothread
@@ -0,0 +1,27 @@
+"""
+Simulated ADC backends.
+"""
+
+import numpy as np
+import pandas as pd
+
+from adcbackend import SimulatedADC
+
+
+def test_from_log_keeps_channels_aligned(tmpdir):
+    path = str(tmpdir.join('run.csv'))
+    pd.DataFrame({'linuxtime': [0.0, 1.0, 2.0, 3.0],
+                  'volt': [1.0, np.nan, 3.0, 4.0],
+                  'cur': [np.nan, 20.0, 30.0, 40.0]}).to_csv(path,
+                                                            index=False)
+    adc = SimulatedADC.from_log(path, {'P9_39': ('volt', 1.0, 0.0),
+                                       'P9_40': ('cur', 10.0, 0.0)},
+                                speed=None)
+    rows = []
+    for _ in range(4):
+        rows.append((adc.read_raw('P9_39'), adc.read_raw('P9_40')))
+        adc.sleep(1.0)
+    # Row 2 of the log on both pins at once
+    assert rows[2] == (3000.0, 3000.0)
+    assert rows == [(1000.0, 2000.0), (1000.0, 2000.0),
+                    (3000.0, 3000.0), (4000.0, 4000.0)]
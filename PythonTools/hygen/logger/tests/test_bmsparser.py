@@ -0,0 +1,69 @@
+"""
+Parsing the archived Beckett BMS stream.
+"""
+
+import os
+
+from bmsparser import BMSParser, ModuleStatus, StringStatus, parse_file
+
+LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                   os.pardir, os.pardir, 'BMS', 'bms2.log')
+SKIP = 9  # "HH:MM:SS," in front of each message
+
+
+def read_log():
+    with open(LOG, 'rb') as f:
+        return f.read()
+
+
+def check(records, parser):
+    assert len(records) == 365
+    assert parser.records == 365
+    assert (parser.checksum_errors, parser.malformed, parser.unknown) \
+        == (0, 0, 0)
+    strings = [r for r in records if isinstance(r, StringStatus)]
+    modules = [r for r in records if isinstance(r, ModuleStatus)]
+    assert (len(strings), len(modules)) == (183, 182)
+
+    s = strings[0]
+    assert (s.message_id, s.state, s.soc, s.temperature) == (2, 'C', 43, 22)
+    assert (s.voltage, s.current, s.alarms) == (288.349, -24.8, 0x80000000)
+    assert (s.master_version, s.slave_version) == (887, 842)
+    assert (s.wh_to_empty, s.wh_to_full) == (4543, 6017)
+    assert (s.min_cell, s.max_cell, s.connector_temp) == (3.735, 3.755, 25)
+
+    m = modules[0]
+    assert (m.message_id, m.module_id, m.state, m.soc) == (733, 10, 'D', 44)
+    assert (m.min_temp, m.avg_temp, m.max_temp) == (19, 20, 21)
+    assert (m.voltage, m.min_cell, m.avg_cell, m.max_cell) \
+        == (25.386, 3.624, 3.626, 3.629)
+    assert (m.serial, m.master_version, m.slave_version,
+            m.connector_temp) == ('1312050002900', 501, 496, 21)
+
+
+def test_byte_by_byte():
+    data = read_log()
+    parser = BMSParser(SKIP)
+    records = []
+    for i in range(len(data)):
+        records += parser.feed(data[i:i + 1])
+    check(records, parser)
+
+
+def test_chunks():
+    data = read_log()
+    parser = BMSParser(SKIP)
+    records = []
+    for i in range(0, len(data), 1000):
+        records += parser.feed(data[i:i + 1000])
+    check(records, parser)
+    assert list(parse_file(LOG, SKIP, chunk_size=777)) == records
+
+
+def test_corrupt_line_is_counted_and_skipped():
+    lines = read_log().split(b'\n')
+    lines[0] = lines[0].replace(b',C,043,', b',C,044,')
+    parser = BMSParser(SKIP)
+    records = parser.feed(b'\n'.join(lines))
+    assert parser.checksum_errors == 1
+    assert len(records) == 364
@@ -0,0 +1,51 @@
+"""
+Compressed logs written one frame per flush.
+"""
+
+import os
+
+import pytest
+
+import compress
+from compress import METHODS, open_log, open_reader, read_all
+
+BATCHES = [''.join('%d,%d.5\n' % (i, j) for j in range(50))
+           for i in range(3)]
+
+
+def write_log(tmpdir, method):
+    try:
+        compress.compressor(method)
+    except ValueError:
+        pytest.skip("%s is not installed" % method)
+    path = str(tmpdir.join('run0.csv' + METHODS[method]))
+    f = open_log(path, 'w', method)
+    sizes = []
+    for batch in BATCHES:
+        f.write(batch)
+        f.flush()
+        sizes.append(os.path.getsize(path))
+    f.close()
+    return path, sizes
+
+
+@pytest.mark.parametrize('method', sorted(METHODS))
+def test_round_trip(tmpdir, method):
+    path, sizes = write_log(tmpdir, method)
+    # Each flush appends a frame; closing adds nothing more
+    assert sizes[0] < sizes[1] < sizes[2] == os.path.getsize(path)
+    assert read_all(path) == ''.join(BATCHES).encode('utf-8')
+    with open_reader(path) as f:
+        assert f.read() == ''.join(BATCHES).encode('utf-8')
+
+
+@pytest.mark.parametrize('method', sorted(METHODS))
+def test_truncated_file_keeps_whole_frames(tmpdir, method):
+    path, sizes = write_log(tmpdir, method)
+    # Power lost halfway through writing the last frame
+    with open(path, 'r+b') as f:
+        f.truncate((sizes[1] + sizes[2]) // 2)
+    assert read_all(path) == ''.join(BATCHES[:2]).encode('utf-8')
+    with open(path, 'r+b') as f:
+        f.truncate(sizes[0] - 1)
+    assert read_all(path) == b''
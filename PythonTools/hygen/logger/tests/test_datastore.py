@@ -0,0 +1,59 @@
+"""
+DataStore snapshots.
+"""
+
+import math
+
+import pytest
+
+import datastore
+from datastore import DataStore
+
+
+def test_read_after_update():
+    store = DataStore(['a', 'b'])
+    store.update({'a': 1.5, 'b': None})
+    assert store.read(['b', 'a']) == [None, 1.5]
+    assert store.sequence == 2
+
+
+def test_snapshot_gives_up_on_a_dead_writer(monkeypatch):
+    monkeypatch.setattr(datastore, 'SNAPSHOT_TIMEOUT', 0.05)
+    store = DataStore(['a'])
+    store.update({'a': 2.0})
+    store.snapshot()
+    store._seq[0] += 1  # the writer died mid-write
+    seq, values = store.snapshot()
+    assert (seq, list(values)) == (2, [2.0])
+
+    # Later reads of the same stuck write do not wait again
+    monkeypatch.setattr(datastore, 'SNAPSHOT_TIMEOUT', 60.0)
+    assert store.snapshot()[0] == 2
+
+
+def test_opening_a_stuck_store_takes_it_over(monkeypatch):
+    monkeypatch.setattr(datastore, 'SNAPSHOT_TIMEOUT', 0.05)
+    store = DataStore(['a'])
+    store.update({'a': 2.0})
+    store._seq[0] += 1  # the writer died mid-write
+    other = DataStore(['a'], store._buf)
+    assert store.sequence == 4
+    assert other.snapshot()[0] == 4
+    other.update({'a': 3.0})
+    assert store.read(['a']) == [3.0]
+
+
+def test_failed_update_leaves_the_store_readable(monkeypatch):
+    monkeypatch.setattr(datastore, 'SNAPSHOT_TIMEOUT', 60.0)
+    store = DataStore(['a', 'b'])
+    with pytest.raises(KeyError):
+        store.update({'zz': 2})
+    with pytest.raises(ValueError):
+        store.update({'a': 1.0, 'b': 'high'})
+    with pytest.raises(ValueError):
+        store.write_all([1.0])
+    assert store.sequence == 0
+    store.update({'a': 5})
+    seq, values = store.snapshot()
+    assert seq == 2
+    assert values[0] == 5 and math.isnan(values[1])
@@ -0,0 +1,37 @@
+"""
+Sparse, deadband-filtered rows and reading them back.
+"""
+
+import math
+
+from deadband import SparseRows, read_sparse
+
+
+def test_round_trip_forward_fills():
+    rows = SparseRows('time,a,b', {'default': {'abs': 0.5},
+                                   'b': {'pct': 10}}, heartbeat=5.0)
+    dense = ['1000.0,0.0,100', '1001.0,0.2,105', '1002.0,0.6,120',
+             '1003.0,0.6,120', '1008.0,0.6,120']
+    sparse = rows.convert(dense)
+    assert sparse == ['1000.0,0:0.0,1:100', '1002.0,0:0.6,1:120',
+                      '1008.0,0:0.6,1:120']
+
+    names, times, values = read_sparse(rows.header().split('\n') + sparse)
+    assert names == ['time', 'a', 'b']
+    assert list(times) == [1000.0, 1002.0, 1008.0]
+    assert values.tolist() == [[0.0, 100.0], [0.6, 120.0], [0.6, 120.0]]
+
+
+def test_missing_values_are_written_and_carried():
+    rows = SparseRows('time,a,b')
+    sparse = rows.convert(['1,1,2', '2,,2', '3,,2', '4,1,2'])
+    assert sparse == ['1,0:1,1:2', '2,0:', '4,0:1']
+    names, times, values = read_sparse(rows.header().split('\n') + sparse)
+    assert math.isnan(values[1, 0]) and values[1, 1] == 2.0
+
+
+def test_reset_writes_every_value():
+    rows = SparseRows('time,a')
+    rows.convert(['1,5'])
+    rows.reset()
+    assert rows.convert(['2,5']) == ['2,0:5']
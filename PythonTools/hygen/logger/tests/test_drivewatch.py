@@ -0,0 +1,27 @@
+"""
+Run numbers and quotas in the log directory.
+"""
+
+import os
+
+from drivewatch import next_run
+
+
+def touch(directory, *names):
+    for name in names:
+        with open(os.path.join(directory, name), 'w'):
+            pass
+
+
+def test_next_run_counts_every_extension(tmpdir):
+    d = str(tmpdir)
+    assert next_run(d, '2016-07-05_10') == 0
+    touch(d, '2016-07-05_10_run0.csv', '2016-07-05_10_run1.bin',
+          '2016-07-05_10_run3.csv.gz', '2016-07-05_10_run2.bin.zst',
+          '2016-07-05_10_run9.lz4.tmp')
+    # Other hours and other files do not count
+    touch(d, '2016-07-05_11_run20.csv', '2016-07-05_1_run30.csv',
+          '2016-07-05_10_run40', 'notes_2016-07-05_10_run50.csv')
+    assert next_run(d, '2016-07-05_10') == 10
+    assert next_run(d, '2016-07-05_11') == 21
+    assert next_run(d, '2016-07-05_12') == 0
@@ -0,0 +1,29 @@
+"""
+entry.py runs under Python 2, where supervisor.py cannot be imported.
+"""
+
+import ast
+import os
+
+ENTRY = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'entry.py')
+
+
+def _imports_supervisor(node):
+    if isinstance(node, ast.ImportFrom):
+        return node.module == 'supervisor'
+    if isinstance(node, ast.Import):
+        return any(a.name == 'supervisor' for a in node.names)
+    return False
+
+
+def test_supervisor_only_imported_when_supervising():
+    with open(ENTRY) as f:
+        tree = ast.parse(f.read())
+    imports = [n for n in ast.walk(tree) if _imports_supervisor(n)]
+    assert imports
+    # Each one nested in the 'if args.supervise:' branch
+    branches = [n for n in ast.walk(tree) if isinstance(n, ast.If)
+                and ast.dump(n.test).find("'supervise'") >= 0]
+    for node in imports:
+        assert any(node in list(ast.walk(b)) for b in branches)
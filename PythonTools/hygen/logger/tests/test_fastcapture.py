@@ -0,0 +1,117 @@
+"""
+Triggered snapshots of simulated inputs.
+"""
+
+import os
+
+import numpy as np
+
+import binlog
+import fastcapture
+from adcbackend import SimulatedADC, constant
+from fastcapture import FastCapture
+
+PERIOD = 0.001
+EPOCH = 1.5e9  # UNIX time at the start of the simulation
+
+
+class StoppingADC(SimulatedADC):
+    """
+    A virtual time ADC which stops the capture after a number of samples.
+    """
+
+    def __init__(self, signal, samples):
+        super(StoppingADC, self).__init__({'P9_40': signal}, speed=None)
+        self.samples = samples
+        self.capture = None
+
+    def read_raw(self, pin):
+        if self.reads + 1 >= self.samples:
+            self.capture.cancel()
+        return super(StoppingADC, self).read_raw(pin)
+
+
+class VirtualTime(object):
+    """
+    Stands in for the time module, keeping UNIX time on the ADC's clock.
+    """
+
+    def __init__(self, adc):
+        self.adc = adc
+
+    def time(self):
+        return EPOCH + self.adc.monotonic()
+
+
+def capture(monkeypatch, tmpdir, signal, trigger, samples, manual=False,
+            **fconfig):
+    config = {'measurements': [['cur', 'A', 'P9_40', 1000.0, 0.0]],
+              'period': PERIOD, 'pre_samples': 10, 'post_samples': 5,
+              'trigger': dict(trigger, name='cur'), 'holdoff': 0.0,
+              'sdir': str(tmpdir), 'dtype': 'float64'}
+    config.update(fconfig)
+    adc = StoppingADC(signal, samples)
+    monkeypatch.setattr(fastcapture, 'time', VirtualTime(adc))
+    fc = FastCapture(config, [], adc)
+    adc.capture = fc
+    if manual:
+        fc.trigger()
+    fc.run()
+    return [binlog.read_binlog(os.path.join(str(tmpdir), name))
+            for name in sorted(os.listdir(str(tmpdir)))]
+
+
+def step(at, low=0.0, high=10.0):
+    return lambda t: high if t >= at else low
+
+
+def test_level_trigger_keeps_pre_and_post_samples(monkeypatch, tmpdir):
+    snapshots = capture(monkeypatch, tmpdir, step(0.0505), {'level': 5.0},
+                        100)
+    assert len(snapshots) == 1
+    header, records = snapshots[0]
+    assert header['trigger']['reason'] == 'level'
+    # 10 readings before the trigger, the trigger and 5 after it
+    assert list(records['cur']) == [0.0] * 10 + [10.0] * 6
+    assert np.all(np.diff(records['time']) > 0)
+    assert records['time'][10] == header['trigger']['time']
+
+
+def test_falling_edge_ignores_a_rise(monkeypatch, tmpdir):
+    assert capture(monkeypatch, tmpdir, step(0.0505),
+                   {'level': 5.0, 'edge': 'falling'}, 100) == []
+    snapshots = capture(monkeypatch, tmpdir, step(0.0505, 10.0, 0.0),
+                        {'level': 5.0, 'edge': 'falling'}, 100)
+    assert len(snapshots) == 1
+
+
+def test_rate_trigger(monkeypatch, tmpdir):
+    def ramp(t):
+        return 0.0 if t < 0.0505 else (t - 0.0505) * 2000.0
+    snapshots = capture(monkeypatch, tmpdir, ramp,
+                        {'rate': 1000.0, 'rate_span': 4}, 100, holdoff=1.0)
+    assert len(snapshots) == 1
+    header, records = snapshots[0]
+    assert header['trigger']['reason'] == 'rate'
+    assert len(records) == 16
+
+
+def test_manual_trigger_waits_for_pre_samples(monkeypatch, tmpdir):
+    snapshots = capture(monkeypatch, tmpdir, constant(3.0), {'level': 5.0},
+                        100, manual=True)
+    assert len(snapshots) == 1
+    header, records = snapshots[0]
+    assert header['trigger']['reason'] == 'manual'
+    assert list(records['cur']) == [3.0] * 16
+
+
+def test_holdoff_delays_rearming(monkeypatch, tmpdir):
+    def square(t):
+        return 10.0 if t % 0.04 >= 0.02 else 0.0
+    snapshots = capture(monkeypatch, tmpdir, square, {'level': 5.0}, 500,
+                        holdoff=0.1)
+    times = [header['trigger']['time'] - EPOCH
+             for header, records in snapshots]
+    # Rising edges come every 40 ms; each snapshot is written 5 ms after
+    # its trigger and capture re-arms 100 ms later
+    assert np.allclose(times, [0.02, 0.14, 0.26, 0.38], atol=0.0015)
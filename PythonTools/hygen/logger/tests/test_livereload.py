@@ -0,0 +1,56 @@
+"""
+Reloading the analog and filewriter configuration while running.
+"""
+
+import queue
+
+from adcbackend import SimulatedADC, constant
+from analogclient import AnalogClient
+from datastore import DataStore
+from logfilewriter import FileWriter
+
+
+def analog_config(*measurements):
+    return {'measurements': list(measurements), 'frequency': 1.0,
+            'averages': 4}
+
+
+def test_analog_reload_keeps_values_of_kept_pins():
+    store = DataStore(['P9_39', 'P9_40'])
+    backend = SimulatedADC({'P9_39': constant(1000.0),
+                            'P9_40': constant(500.0)}, speed=None)
+    client = AnalogClient(analog_config(['volt', 'V', 'P9_39', 1.0, 0.0]),
+                          [], store, backend)
+    for _ in range(4):
+        client._read_tick()
+    client._end_window()
+    assert store['P9_39'] == 1.0
+
+    # Applied by the run loop between windows
+    client._configure(analog_config(['volt', 'V', 'P9_39', 1.0, 0.0],
+                                    ['cur', 'A', 'P9_40', 40.0, -0.2]))
+    assert store['P9_39'] == 1.0
+    assert store['P9_40'] is None
+    assert client.csv_line() == '1.000,'
+
+
+def test_filewriter_leaves_subclass_pending_alone():
+    # The benchmark's FileWriter subclass keeps its own _pending list
+    from logger_benchmark import _bench_filewriter_class
+    TimedFileWriter = _bench_filewriter_class()
+    writer = TimedFileWriter({'ldir': 'logs'}, [], queue.Queue(),
+                             'time,a', '/tmp')
+    assert writer._pending == []
+    assert writer._pending_config is None
+
+
+def test_filewriter_rejects_format_change():
+    writer = FileWriter({'ldir': 'logs'}, [], queue.Queue(), 'time,a')
+    try:
+        writer.reconfigure({'ldir': 'logs', 'format': 'binary'})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("format change accepted")
+    writer.reconfigure({'ldir': 'other'})
+    assert writer._pending_config == ({'ldir': 'other'}, None)
@@ -0,0 +1,42 @@
+"""
+FileWriter batches.
+"""
+
+import io
+import queue
+
+import binlog
+from logfilewriter import FileWriter
+
+
+def test_bad_binary_record_only_loses_itself():
+    columns = [('a', 'V', 1.0, 0.0), ('b', 'A', 1.0, 0.0)]
+    writer = FileWriter({'ldir': 'logs', 'format': 'binary',
+                         'dtype': 'float64'}, [], queue.Queue(), 'time,a,b',
+                        columns)
+    writer._f = io.BytesIO()
+    writer._write_records([(1.0, 1.0, 2.0), (2.0, 'oops', 2.0),
+                           (3.0, None, 4.0)])
+    rec = binlog.record_struct(2, 'float64')
+    data = writer._f.getvalue()
+    assert len(data) == 2 * rec.size
+    assert rec.unpack(data[:rec.size]) == (1.0, 1.0, 2.0)
+    assert rec.unpack(data[rec.size:])[0] == 3.0
+
+
+def test_binary_file_reads_back(tmpdir):
+    columns = [('a', 'V', 1.0, 0.0), ('b', 'A', 40.0, -0.2)]
+    writer = FileWriter({'ldir': 'logs', 'format': 'binary'}, [],
+                        queue.Queue(), 'time,a,b', columns)
+    writer._f = io.BytesIO()
+    writer._write_header()
+    writer._write_records([(1.0, 1.5, 2.5), (2.0, None, 3.5)])
+    path = str(tmpdir.join('run.bin'))
+    with open(path, 'wb') as f:
+        f.write(writer._f.getvalue())
+
+    header, records = binlog.read_binlog(path)
+    assert [c['name'] for c in header['columns']] == ['a', 'b']
+    assert list(records['time']) == [1.0, 2.0]
+    assert records['a'][0] == 1.5 and records['a'][1] != records['a'][1]
+    assert list(records['b']) == [2.5, 3.5]
@@ -0,0 +1,82 @@
+"""
+Metric registries and their dumps.
+"""
+
+import json
+import logging
+import os
+
+import pytest
+
+from metrics import MetricsDumper, Registry
+
+
+def registry():
+    r = Registry()
+    r.counter('scans_total', "Scans done", {'endpoint': 'gen'}).inc(3)
+    r.gauge('queue_depth', "Rows queued").set(7)
+    h = r.histogram('read_seconds', "Read time", buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.observe(v)
+    return r
+
+
+def test_prometheus_text():
+    lines = registry().prometheus_text().splitlines()
+    assert '# TYPE queue_depth gauge' in lines
+    assert 'queue_depth 7' in lines
+    assert '# HELP scans_total Scans done' in lines
+    assert 'scans_total{endpoint="gen"} 3' in lines
+    assert lines[lines.index('# TYPE read_seconds histogram') + 1:][:5] == [
+        'read_seconds_bucket{le="0.1"} 1',
+        'read_seconds_bucket{le="1.0"} 2',
+        'read_seconds_bucket{le="+Inf"} 3',
+        'read_seconds_sum 5.55',
+        'read_seconds_count 3']
+
+
+def test_json_text():
+    metrics = {m['name']: m
+               for m in json.loads(registry().json_text())['metrics']}
+    assert metrics['scans_total']['value'] == 3
+    assert metrics['scans_total']['labels'] == {'endpoint': 'gen'}
+    assert metrics['queue_depth']['type'] == 'gauge'
+    assert metrics['read_seconds']['counts'] == [1, 1, 1]
+    assert metrics['read_seconds']['buckets'] == [0.1, 1.0]
+
+
+def test_same_name_and_labels_is_one_metric():
+    r = Registry()
+    assert r.counter('n', labels={'a': 1}) is r.counter('n', labels={'a': 1})
+    assert r.counter('n', labels={'a': 2}) is not r.counter('n',
+                                                            labels={'a': 1})
+    with pytest.raises(ValueError):
+        r.gauge('n', labels={'a': 1})
+
+
+def test_dump_replaces_the_file(tmpdir):
+    path = str(tmpdir.join('metrics.json'))
+    dumper = MetricsDumper({'path': path, 'format': 'json'}, [], registry())
+    dumper.dump()
+    dumper.registry.gauge('queue_depth').set(8)
+    dumper.dump()
+    with open(path) as f:
+        metrics = json.load(f)['metrics']
+    assert [m['value'] for m in metrics if m['name'] == 'queue_depth'] \
+        == [8]
+    assert os.listdir(str(tmpdir)) == ['metrics.json']
+
+
+def test_unusable_socket_is_logged(tmpdir, caplog):
+    path = str(tmpdir.join('missing', 'metrics.sock'))
+    dumper = MetricsDumper({'socket': path}, [], registry())
+    with caplog.at_level(logging.ERROR, 'metrics'):
+        dumper.run()
+    assert 'Could not serve metrics' in caplog.text
+
+
+def test_config_needs_a_destination():
+    with pytest.raises(ValueError):
+        MetricsDumper.check_config({'format': 'json'})
+    with pytest.raises(ValueError):
+        MetricsDumper.check_config({'path': 'm', 'format': 'xml'})
@@ -0,0 +1,36 @@
+"""
+Compiling measurement description files.
+"""
+
+import os
+
+import mlist
+from mlist import compile_mdf
+
+MDF = """Measurement description
+name,units,address,registers,gain,offset,period
+volt,V,100,1,0.1,0,
+hours,h,200,2,1,0,60
+"""
+
+
+def test_compiled_list_is_cached_out_of_the_source_tree(monkeypatch,
+                                                        tmpdir):
+    monkeypatch.setattr(mlist, '_compiled', {})
+    cache = tmpdir.join('cache')
+    monkeypatch.setattr(mlist, 'CACHE_DIR', str(cache))
+    source = tmpdir.mkdir('config')
+    path = str(source.join('gen.mdf'))
+    with open(path, 'w') as f:
+        f.write(MDF)
+
+    compiled = compile_mdf(path)
+    assert [m[0] for m in compiled.meas_list] == ['volt', 'hours']
+    assert compiled.periods == [None, 60.0]
+    assert os.listdir(str(source)) == ['gen.mdf']
+    assert len(os.listdir(str(cache))) == 1
+
+    # A new process reads the pickle instead of parsing the file
+    monkeypatch.setattr(mlist, '_compiled', {})
+    monkeypatch.setattr(mlist, 'parse_mdf', None)
+    assert compile_mdf(path).meas_list == compiled.meas_list
@@ -0,0 +1,122 @@
+"""
+The asyncio Modbus TCP poller against a local stand-in device.
+"""
+
+import asyncio
+import struct
+
+import pytest
+
+from modbus_standin import TCPStandIn
+from modbuspoller import ModbusEndpoint, ModbusError, ModbusPoller
+from pollsched import PollScheduler
+from readplan import MISSING
+
+MEAS = [['fast', 'A', 100, 1, 1.0, 0.0],
+        ['slow', 'C', 101, 1, 0.5, 1.0],
+        ['far', 'h', 200, 2, 1.0, 0.0]]
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_scan_reads_every_block():
+    with TCPStandIn() as device:
+        async def scan():
+            e = ModbusEndpoint('plain', device.host, device.port, MEAS)
+            await e.connect()
+            record = await ModbusPoller([e], []).scan(e)
+            e.close()
+            return record
+        record = run(scan())
+    assert record.values == [100.0, 101 * 0.5 + 1.0, 200 * 65536 + 201.0]
+    assert device.requests == 2
+
+
+def test_scan_reads_only_scheduled_blocks():
+    sched = PollScheduler(MEAS, [0.1, 0.5, None], tick=0.1,
+                          default_period=1.0)
+    with TCPStandIn() as device:
+        async def scans():
+            e = ModbusEndpoint('sched', device.host, device.port, MEAS,
+                               schedule=sched)
+            await e.connect()
+            poller = ModbusPoller([e], [], period=0.1)
+            records = [await poller.scan(e, n) for n in range(3)]
+            e.close()
+            return records
+        records = run(scans())
+    # Tick 0 reads both blocks, ticks 1 and 2 only the fast register
+    assert device.requests == 4
+    assert records[2].values == [100.0, 51.5, 200 * 65536 + 201.0]
+
+
+def test_timeout_drops_the_connection():
+    with TCPStandIn(latency=0.3) as device:
+        async def scan():
+            e = ModbusEndpoint('slow', device.host, device.port, MEAS)
+            await e.connect()
+            record = await ModbusPoller([e], [], timeout=0.05).scan(e)
+            return e, record
+        e, record = run(scan())
+    assert record.values == [MISSING] * 3
+    assert not e.connected.is_set()
+
+
+def test_poller_reconnects_after_timeouts():
+    records = []
+    with TCPStandIn(latency=0.3) as device:
+        async def poll():
+            e = ModbusEndpoint('flaky', device.host, device.port, MEAS[:1])
+            poller = ModbusPoller([e], [], period=0.05, timeout=0.05,
+                                  reconnect_delay=0.05, sink=records.append)
+            task = asyncio.ensure_future(poller.run())
+            await asyncio.sleep(0.5)
+            device.latency = 0.0
+            await asyncio.sleep(1.0)
+            poller.cancel()
+            await task
+            return poller
+        poller = run(poll())
+    values = [r.values[0] for r in records]
+    assert MISSING in values
+    assert values[-1] == 100.0
+    assert poller._m['flaky']['link_errors'].value >= 1
+
+
+@pytest.mark.parametrize('answer', [
+    struct.pack('>HHHB', 1, 0, 0, 1),  # length 0
+    struct.pack('>HHHBB', 1, 0, 2, 1, 0x03),  # one byte PDU
+    struct.pack('>HHHBB', 1, 0, 2, 1, 0x83),  # exception without its code
+    struct.pack('>HHHBBBH', 1, 0, 5, 1, 0x03, 4, 7),  # short data
+    struct.pack('>HHHBBBH', 1, 0, 5, 1, 0x04, 2, 7),  # wrong function
+])
+def test_malformed_answers_raise_modbus_error(answer):
+    async def read():
+        async def serve(reader, writer):
+            await reader.readexactly(12)
+            writer.write(answer)
+            await writer.drain()
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        e = ModbusEndpoint('bad', '127.0.0.1', port, MEAS)
+        await e.connect()
+        try:
+            await e.read_holding_registers(100, 2)
+        finally:
+            e.close()
+            server.close()
+    with pytest.raises(ModbusError):
+        run(read())
+
+
+def test_schedule_must_decode_like_the_endpoint():
+    sched = PollScheduler(MEAS, tick=0.1)
+    with pytest.raises(ValueError):
+        ModbusEndpoint('signed', '127.0.0.1', 502, MEAS, signed32=True,
+                       schedule=sched)
+    signed = PollScheduler(MEAS, tick=0.1, signed=True)
+    e = ModbusEndpoint('signed', '127.0.0.1', 502, MEAS, signed32=True,
+                       schedule=signed)
+    assert e.schedule is signed
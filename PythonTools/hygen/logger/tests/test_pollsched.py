@@ -0,0 +1,42 @@
+"""
+Per-measurement poll periods.
+"""
+
+import numpy as np
+
+from pollsched import PollScheduler
+
+MEAS = [['fast', 'A', 100, 1, 1.0, 0.0],
+        ['slow', 'C', 101, 1, 1.0, 0.0],
+        ['far', 'h', 200, 2, 1.0, 0.0]]
+
+
+def test_due_and_plans_follow_the_periods():
+    sched = PollScheduler(MEAS, [0.1, 0.5, None], tick=0.1,
+                          default_period=1.0)
+    assert list(sched.every) == [1, 5, 10]
+    assert list(sched.due(1)) == [0]
+    assert list(sched.due(5)) == [0, 1]
+    assert list(sched.due(10)) == [0, 1, 2]
+    # The two neighbouring registers share one block read
+    assert [(b.start, b.count) for b in sched.scan(5).plan] == [(100, 2)]
+
+
+def test_update_keeps_values_not_read():
+    sched = PollScheduler(MEAS, [0.1, 0.5, None], tick=0.1,
+                          default_period=1.0)
+    scan = sched.scan(0)
+    results = [[11, 22] if b.start == 100 else [0, 33] for b in scan.plan]
+    assert list(sched.update(scan, results)) == [11.0, 22.0, 33.0]
+    scan = sched.scan(1)
+    assert list(sched.update(scan, [[12]])) == [12.0, 22.0, 33.0]
+
+
+def test_learning_slows_quiet_values():
+    sched = PollScheduler(MEAS[:1], tick=0.1, default_period=0.1,
+                          learn=True, quiet_reads=2, max_period=0.4)
+    for tick in range(40):
+        scan = sched.scan(tick)
+        if scan is not None:
+            sched.update(scan, [[5]])
+    assert np.allclose(sched.periods(), [0.4])
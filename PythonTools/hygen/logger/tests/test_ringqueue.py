@@ -0,0 +1,41 @@
+"""
+RingQueue policies, and the spill file's limit.
+"""
+
+import os
+
+from ringqueue import RingQueue
+
+
+def test_spill_limit_counts_only_unread_items(tmpdir):
+    path = str(tmpdir.join('spill.dat'))
+    q = RingQueue(2, 'spill', path, spill_limit=4096)
+    # A backlog of 20 items, kept steady while far more than the limit
+    # passes through the file
+    for i in range(20):
+        q.put('line %06d' % i)
+    out = []
+    for i in range(20, 2000):
+        q.put('line %06d' % i)
+        out.append(q.get(False))
+        assert os.path.getsize(path) <= 4096 + 64
+    assert q.dropped == 0
+    while not q.empty():
+        out.append(q.get(False))
+    assert out == ['line %06d' % i for i in range(2000)]
+
+
+def test_spill_drops_when_unread_items_fill_the_limit(tmpdir):
+    q = RingQueue(1, 'spill', str(tmpdir.join('spill.dat')), spill_limit=256)
+    for i in range(100):
+        q.put('line %06d' % i)
+    assert q.dropped > 0
+    assert q.spilled + 1 + q.dropped == 100
+
+
+def test_drop_oldest():
+    q = RingQueue(2, 'drop_oldest')
+    for item in 'abc':
+        q.put(item)
+    assert [q.get(False), q.get(False)] == ['b', 'c']
+    assert q.dropped == 1
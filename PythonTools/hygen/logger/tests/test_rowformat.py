@@ -0,0 +1,39 @@
+"""
+CSV rows with missing and infinite values.
+"""
+
+import numpy as np
+
+from rowformat import RowFormatter
+
+NAN = float('nan')
+INF = float('inf')
+
+
+def test_missing_values_are_empty_and_infinities_are_kept():
+    r = RowFormatter(3)
+    assert r.format([1.0, 2.5, 3.0]) == '1.000,2.500,3.000'
+    assert r.format([NAN, None, INF]) == ',,inf'
+    assert r.format([1.0, -INF, 2.0]) == '1.000,-inf,2.000'
+    assert r.format(np.array([NAN, INF, 1.0])) == ',inf,1.000'
+    # NumPy scalars are not floats
+    assert r.format([np.float32(NAN), np.float64(INF), 1]) == ',inf,1.000'
+
+
+def test_missing_text_time_and_trailing_separator():
+    r = RowFormatter([1, 2], time_precision=1, sep=';', missing='NA',
+                     trailing=True)
+    assert r.format([INF, None], t=5.0) == '5.0;inf;NA;'
+    assert r.format([1, 2], t=5.0) == '5.0;1.0;2.00;'
+
+
+def test_batches_match_single_rows():
+    r = RowFormatter(2, time_precision=0)
+    rows = np.array([[1.0, INF], [NAN, 2.0], [3.0, 4.0]])
+    times = [10, 11, 12]
+    expected = ''.join(r.format(row, t) + '\n'
+                       for row, t in zip(rows, times))
+    assert expected == '10,1.000,inf\n11,,2.000\n12,3.000,4.000\n'
+    assert r.format_rows(rows, times) == expected
+    assert r.format_rows(rows.tolist(), times) == expected
+    assert r.format_rows(rows[[0, 2]], times[:2]).count('inf') == 1
@@ -0,0 +1,66 @@
+"""
+Modbus RTU framing and transactions against a scripted serial port.
+"""
+
+import struct
+
+from readplan import Block
+from rtu import RTUMaster, crc16, request_frame, silent_interval
+
+
+class FakeSerial(object):
+    """
+    Answers each request with the next canned reply.
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.written = []
+        self._pending = b''
+
+    def write(self, frame):
+        self.written.append(bytes(frame))
+        self._pending = self.replies.pop(0)
+
+    def readinto(self, view):
+        n = min(len(view), len(self._pending))
+        view[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def reset_input_buffer(self):
+        self._pending = b''
+
+    def close(self):
+        pass
+
+
+def answer(unit, registers):
+    body = struct.pack('>BBB%dH' % len(registers), unit, 3,
+                       2 * len(registers), *registers)
+    return body + struct.pack('<H', crc16(body))
+
+
+def test_request_frame():
+    assert request_frame(1, 0, 10) == bytes(bytearray(
+        [0x01, 0x03, 0x00, 0x00, 0x00, 0x0A, 0xC5, 0xCD]))
+
+
+def test_silent_interval():
+    assert silent_interval(115200) == 0.00175
+    assert abs(silent_interval(9600) - 3.5 * 10 / 9600.) < 1e-12
+
+
+def test_scan_reads_blocks_and_survives_bad_answers():
+    exception = struct.pack('>BBB', 10, 0x83, 2)
+    exception += struct.pack('<H', crc16(exception))
+    garbled = bytearray(answer(10, [1, 2]))
+    garbled[-1] ^= 0xFF
+    serial = FakeSerial([answer(10, [7, 8, 9]), exception, bytes(garbled),
+                         b''])
+    master = RTUMaster('/dev/null', 115200, 10, serial_port=serial)
+    master.t35 = 0.0
+    plan = [Block(0, 3, ()), Block(100, 2, ()), Block(200, 2, ()),
+            Block(300, 2, ())]
+    assert master.scan(plan) == [[7, 8, 9], None, None, None]
+    assert serial.written[1] == request_frame(10, 100, 2)
@@ -0,0 +1,13 @@
+"""
+Supervisor workers.
+"""
+
+import supervisor
+from supervisor import Supervisor
+
+
+def test_subsystems_without_a_module_get_no_worker(monkeypatch):
+    monkeypatch.setitem(supervisor.SUBSYSTEMS, 'deepsea',
+                        ('no_such_client', 'DeepSeaClient'))
+    sup = Supervisor({'enabled': ['analog', 'deepsea', 'display']}, [])
+    assert [w.name for w in sup.workers] == ['analog']
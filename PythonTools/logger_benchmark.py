@@ -0,0 +1,452 @@
+"""
+Benchmark the logging pipeline against local stand-ins.
+
+Measures, without any hardware attached:
+- Modbus scan latency percentiles for each read planning strategy, over
+  TCP (asyncio poller) and RTU (pymodbus serial client, and the rtu.py
+  engine, on a pseudo-terminal pair)
+- AnalogClient sampling jitter and missed deadlines, on a simulated ADC
+- FileWriter queue-to-write and queue-to-flush latency
+- end-to-end samples per second from Modbus scan to log file
+
+Results are written as JSON so runs can be compared when channel counts or
+poll rates change:
+    python logger_benchmark.py --channels 40 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'hygen', 'logger'))
+from readplan import Block, plan_reads, read_blocks, ADDR, LEN
+from modbuspoller import ModbusEndpoint, ModbusPoller
+from modbus_standin import TCPStandIn, RTUStandIn
+from rtu import RTUMaster
+
+if sys.version_info[0] == 3:
+    import queue
+elif sys.version_info[0] == 2:
+    import Queue as queue
+
+# The DeepSea values logged by ModbusLogger.py
+# meas = ["name", "units", addr, len, gain, offset]
+DEEPSEA_MLIST = [["Oil P", "psi", 1024, 1, 1.0, 0.0],
+                 ["Eng T", "degC", 1025, 1, 1.0, 0.0],
+                 ["E-Bat", "V", 1029, 1, 0.1, 0.0],
+                 ["Run T", "min", 1798, 2, 0.016667, 0.0],
+                 ["Starts", "", 1808, 2, 1.0, 0.0],
+                 ["SOC", "%", 43809, 1, 1.0, 0.0],
+                 ["+/-Bat", "A", 43811, 1, 0.5, 50],
+                 ["EGT", "degC", 43978, 1, 1.0, 0.0],
+                 ["Bat T", "degC", 43981, 1, 1.0, 0.0]]
+
+
+def synthetic_mlist(channels):
+    """
+    Return a measurement list of the given size laid out like the DeepSea
+    one: clusters of nearby registers on a few pages, some of them 32-bit.
+    """
+    mlist = []
+    addr = 1024
+    for i in range(channels):
+        length = 2 if i % 5 == 3 else 1
+        mlist.append(["ch%d" % i, "", addr, length, 1.0, 0.0])
+        addr += length + (3 if i % 4 == 2 else 0)
+        if i % 16 == 15:
+            addr += 256  # next page
+    return mlist
+
+
+def strategies(mlist):
+    """
+    Return the read plans to compare: one request per measurement, and
+    block reads allowing different gaps of unused registers.
+    """
+    return {
+        'single': [Block(m[ADDR], m[LEN], ((i, 0),))
+                   for i, m in enumerate(mlist)],
+        'coalesced': plan_reads(mlist, max_gap=0),
+        'gap4': plan_reads(mlist, max_gap=4),
+        'gap16': plan_reads(mlist, max_gap=16),
+    }
+
+
+def percentiles(samples, scale=1000.0):
+    """
+    Summarize samples (seconds) in milliseconds.
+    """
+    if not samples:
+        return {'count': 0}
+    s = sorted(samples)
+
+    def pick(p):
+        return s[min(len(s) - 1, int(p * len(s)))] * scale
+
+    return {
+        'count': len(s),
+        'mean': sum(s) / len(s) * scale,
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'max': s[-1] * scale,
+    }
+
+
+def bench_tcp_scan(mlist, scans, latency):
+    """
+    Scan latency over Modbus TCP with the asyncio poller, per strategy.
+    """
+    results = {}
+    loop = asyncio.new_event_loop()
+    with TCPStandIn(latency=latency) as server:
+        for name, plan in sorted(strategies(mlist).items()):
+            endpoint = ModbusEndpoint('bench', server.host, server.port, mlist)
+            endpoint.plan = plan
+            poller = ModbusPoller([endpoint], [], timeout=1.0)
+
+            async def run():
+                await endpoint.connect()
+                times = []
+                for _ in range(scans):
+                    record = await poller.scan(endpoint)
+                    times.append(record.end - record.start)
+                endpoint.close()
+                return times
+
+            results[name] = percentiles(loop.run_until_complete(run()))
+            results[name]['requests'] = len(plan)
+    loop.close()
+    return results
+
+
+def _rtu_client(port, baudrate, unit):
+    """
+    Return a pymodbus serial client and a read(start, count) function
+    using it over RTU. Handles both the 2.x and 3.x client APIs.
+    """
+    try:
+        from pymodbus.client.sync import ModbusSerialClient
+        client = ModbusSerialClient(method='rtu', port=port,
+                                    baudrate=baudrate, timeout=1)
+        unit_kw = 'unit'
+    except ImportError:
+        import inspect
+        from pymodbus.client import ModbusSerialClient
+        client = ModbusSerialClient(port, baudrate=baudrate, timeout=1)
+        params = inspect.signature(client.read_holding_registers).parameters
+        unit_kw = 'device_id' if 'device_id' in params else 'slave'
+    client.connect()
+
+    def read(start, count):
+        r = client.read_holding_registers(start, count=count,
+                                          **{unit_kw: unit})
+        if r is None or r.isError():
+            return None
+        return r.registers
+    return client, read
+
+
+def bench_rtu_scan(mlist, scans, latency, baudrate):
+    """
+    Scan latency over Modbus RTU on a pseudo-terminal pair, per strategy.
+    """
+    unit = 10
+    results = {}
+    with RTUStandIn(latency=latency, unit=unit) as server:
+        try:
+            client, read = _rtu_client(server.port, baudrate, unit)
+        except ImportError as e:
+            return {'skipped': str(e)}
+        for name, plan in sorted(strategies(mlist).items()):
+            times = []
+            for _ in range(scans):
+                start = time.time()
+                read_blocks(read, plan)
+                times.append(time.time() - start)
+            results[name] = percentiles(times)
+            results[name]['requests'] = len(plan)
+        client.close()
+    return results
+
+
+def bench_rtu_engine(mlist, scans, latency, baudrate):
+    """
+    Scan latency with the rtu.py engine on a pseudo-terminal pair, per
+    strategy, along with the wire time each scan would take at baudrate.
+    A pseudo-terminal moves bytes instantly, so the wire time is what a
+    real line adds on top.
+    """
+    unit = 10
+    results = {}
+    with RTUStandIn(latency=latency, unit=unit) as server:
+        try:
+            master = RTUMaster(server.port, baudrate, unit, timeout=1.0)
+            master.open()
+        except ImportError as e:
+            return {'skipped': str(e)}
+        for name, plan in sorted(strategies(mlist).items()):
+            master.prepare(plan)
+            times = []
+            for _ in range(scans):
+                start = time.time()
+                master.scan(plan)
+                times.append(time.time() - start)
+            results[name] = percentiles(times)
+            results[name]['requests'] = len(plan)
+            results[name]['wire_ms'] = 1000.0 * master.wire_time(plan)
+        master.close()
+    return results
+
+
+def bench_analog(duration, frequency, averages, channels):
+    """
+    AnalogClient sampling jitter against a real-time simulated ADC.
+    """
+    try:
+        from analogclient import AnalogClient
+        from adcbackend import SimulatedADC, sine
+    except ImportError as e:
+        return {'skipped': str(e)}
+
+    class TimedADC(SimulatedADC):
+        """
+        Record when the first input is read on every tick.
+        """
+        def __init__(self, *args, **kwargs):
+            super(TimedADC, self).__init__(*args, **kwargs)
+            self.tick_times = []
+
+        def read_raw(self, pin):
+            if pin == 'P9_33':
+                self.tick_times.append(self.monotonic())
+            return super(TimedADC, self).read_raw(pin)
+
+    pins = ['P9_33', 'P9_35', 'P9_36', 'P9_37', 'P9_38', 'P9_39', 'P9_40']
+    pins = pins[:channels]
+    adc = TimedADC({p: sine(100.0, 50.0, 900.0) for p in pins})
+    aconfig = {
+        'measurements': [[p, 'V', p, 1.0, 0.0] for p in pins],
+        'frequency': frequency,
+        'averages': averages,
+    }
+    client = AnalogClient(aconfig, [], {}, backend=adc)
+    client.start()
+    time.sleep(duration)
+    client.cancel()
+    client.join()
+
+    period = float(frequency) / averages
+    ticks = adc.tick_times
+    jitter = [abs((b - a) - period) for a, b in zip(ticks, ticks[1:])]
+    result = percentiles(jitter)
+    result.update({
+        'tick_period_ms': period * 1000.0,
+        'ticks': len(ticks),
+        'expected_ticks': int(duration / period),
+        'missed_deadlines': client.missed_deadlines,
+        'last_window_samples': client.achieved_samples,
+    })
+    return result
+
+
+def _bench_filewriter_class():
+    """
+    Return a FileWriter subclass writing to a temporary directory and
+    timing each line from the moment it was queued. Lines start with the
+    time.time() at which they were queued.
+    """
+    from logfilewriter import FileWriter
+
+    class TimedFileWriter(FileWriter):
+
+        def __init__(self, lconfig, handlers, log_queue, csv_header, path):
+            self._bench_path = path
+            self.write_latency = []
+            self.flush_latency = []
+            self.lines_written = 0
+            self._pending = []
+            super(TimedFileWriter, self).__init__(lconfig, handlers,
+                                                  log_queue, csv_header)
+
+        def get_directory(self):
+            return self._bench_path
+
+        def _write_lines(self, lines):
+            super(TimedFileWriter, self)._write_lines(lines)
+            now = time.time()
+            queued = [float(l.split(',', 1)[0]) for l in lines]
+            self.write_latency.extend(now - t for t in queued)
+            self._pending.extend(queued)
+            self.lines_written += len(lines)
+
+        def _flush(self, sync=False):
+            super(TimedFileWriter, self)._flush(sync)
+            now = time.time()
+            self.flush_latency.extend(now - t for t in self._pending)
+            self._pending = []
+
+    return TimedFileWriter
+
+
+def bench_filewriter(duration, rate, lconfig):
+    """
+    Queue-to-disk latency of FileWriter at a steady line rate.
+    """
+    try:
+        TimedFileWriter = _bench_filewriter_class()
+    except ImportError as e:
+        return {'skipped': str(e)}
+
+    path = tempfile.mkdtemp()
+    log_queue = queue.Queue()
+    writer = TimedFileWriter(lconfig, [], log_queue, 'time,a,b,c', path)
+    writer.start()
+    interval = 1.0 / rate
+    t0 = time.time()
+    n = 0
+    while time.time() < t0 + duration:
+        now = time.time()
+        log_queue.put("%f,1.000,2.000,3.000" % now)
+        n += 1
+        delay = t0 + n * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(lconfig.get('batch_time', 0.1) * 2)
+    writer.cancel()
+    writer.join()
+    shutil.rmtree(path, ignore_errors=True)
+
+    return {
+        'lines_queued': n,
+        'lines_written': writer.lines_written,
+        'queue_to_write': percentiles(writer.write_latency),
+        'queue_to_flush': percentiles(writer.flush_latency),
+    }
+
+
+def bench_end_to_end(mlist, duration, lconfig):
+    """
+    Samples per second from Modbus TCP scans through FileWriter to disk,
+    scanning as fast as the stand-in answers.
+    """
+    try:
+        TimedFileWriter = _bench_filewriter_class()
+    except ImportError as e:
+        return {'skipped': str(e)}
+
+    path = tempfile.mkdtemp()
+    log_queue = queue.Queue()
+    header = 'time,' + ','.join(m[0] for m in mlist)
+    writer = TimedFileWriter(lconfig, [], log_queue, header, path)
+    writer.start()
+    loop = asyncio.new_event_loop()
+    with TCPStandIn() as server:
+        endpoint = ModbusEndpoint('bench', server.host, server.port, mlist)
+        poller = ModbusPoller([endpoint], [], timeout=1.0)
+        row_format = '%f' + ',%.3f' * len(mlist)
+
+        async def run():
+            await endpoint.connect()
+            scans = 0
+            t_end = time.time() + duration
+            while time.time() < t_end:
+                record = await poller.scan(endpoint)
+                log_queue.put(row_format % ((record.start,)
+                                            + tuple(record.values)))
+                scans += 1
+            endpoint.close()
+            return scans
+
+        t0 = time.time()
+        scans = loop.run_until_complete(run())
+        while not log_queue.empty():
+            time.sleep(0.01)
+        writer.cancel()
+        writer.join()
+        elapsed = time.time() - t0
+    loop.close()
+    shutil.rmtree(path, ignore_errors=True)
+
+    return {
+        'scans': scans,
+        'rows_written': writer.lines_written,
+        'scans_per_second': scans / elapsed,
+        'samples_per_second': writer.lines_written * len(mlist) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the logging pipeline against local stand-ins")
+    parser.add_argument('--channels', type=int, default=0,
+                        help='synthetic Modbus channel count '
+                        '(default: the DeepSea measurement list)')
+    parser.add_argument('--scans', type=int, default=200,
+                        help='scans per planning strategy')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='stand-in latency per request, seconds')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds for each timed section')
+    parser.add_argument('--frequency', type=float, default=1.0,
+                        help='AnalogClient reporting period, seconds')
+    parser.add_argument('--averages', type=int, default=64)
+    parser.add_argument('--analog-channels', type=int, default=2)
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help='FileWriter lines per second')
+    parser.add_argument('--skip', action='append', default=[],
+                        choices=['tcp', 'rtu', 'rtu_engine', 'analog',
+                                 'filewriter', 'end_to_end'])
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    mlist = synthetic_mlist(args.channels) if args.channels \
+        else DEEPSEA_MLIST
+    lconfig = {'ldir': 'bench'}
+
+    results = {
+        'meta': {
+            'time': time.time(),
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'channels': len(mlist),
+            'args': vars(args),
+        },
+    }
+    sections = [
+        ('tcp', lambda: bench_tcp_scan(mlist, args.scans, args.latency)),
+        ('rtu', lambda: bench_rtu_scan(mlist, args.scans, args.latency,
+                                       args.baudrate)),
+        ('rtu_engine', lambda: bench_rtu_engine(mlist, args.scans,
+                                                args.latency, args.baudrate)),
+        ('analog', lambda: bench_analog(args.duration, args.frequency,
+                                        args.averages,
+                                        args.analog_channels)),
+        ('filewriter', lambda: bench_filewriter(args.duration, args.rate,
+                                                lconfig)),
+        ('end_to_end', lambda: bench_end_to_end(mlist, args.duration,
+                                                lconfig)),
+    ]
+    for name, bench in sections:
+        if name in args.skip:
+            continue
+        print("Running %s..." % name)
+        results[name] = bench()
+        print(json.dumps(results[name], indent=2, sort_keys=True))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Local stand-ins for the Modbus devices the loggers talk to.
+
+TCPStandIn serves holding registers over Modbus TCP on localhost, and
+RTUStandIn serves them over Modbus RTU on one end of a pseudo-terminal
+pair, so clients can open its 'port' like a real serial device. Both can
+add a fixed latency to every answer to model a slow device or link.
+
+Register values come from a callable taking the register address, by
+default returning the low 16 bits of the address itself.
+"""
+
+import os
+import pty
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import tty
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'hygen', 'logger'))
+from rtu import crc16
+
+READ_HOLDING_REGISTERS = 0x03
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+
+
+def address_values(addr):
+    return addr & 0xFFFF
+
+
+def _answer(pdu, values, valid):
+    """
+    Return the response PDU for a request PDU.
+    """
+    function = pdu[0]
+    if function != READ_HOLDING_REGISTERS or len(pdu) < 5:
+        return struct.pack('>BB', function | 0x80, ILLEGAL_FUNCTION)
+    start, count = struct.unpack('>HH', pdu[1:5])
+    if count < 1 or count > 125 or not valid(start, count):
+        return struct.pack('>BB', function | 0x80, ILLEGAL_DATA_ADDRESS)
+    regs = [values(a) for a in range(start, start + count)]
+    return struct.pack('>BB%dH' % count, function, 2 * count, *regs)
+
+
+class _StandIn(object):
+
+    def __init__(self, values=address_values, latency=0.0, valid=None):
+        """
+        values: callable giving the value of a register address
+        latency: seconds to wait before every answer
+        valid: callable taking (start, count) returning False for reads
+            that should get an illegal data address exception
+        """
+        self.values = values
+        self.latency = latency
+        self.valid = valid if valid is not None else (lambda s, c: True)
+        self.requests = 0
+        self._cancelled = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._cancelled = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def answer(self, pdu):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return _answer(bytearray(pdu), self.values, self.valid)
+
+
+class TCPStandIn(_StandIn):
+
+    def __init__(self, values=address_values, latency=0.0, valid=None,
+                 host='127.0.0.1', port=0):
+        super(TCPStandIn, self).__init__(values, latency, valid)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(8)
+        self.host, self.port = self._sock.getsockname()
+
+    def _serve(self):
+        self._sock.settimeout(0.1)
+        while not self._cancelled:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            t = threading.Thread(target=self._serve_client, args=(conn,))
+            t.daemon = True
+            t.start()
+        self._sock.close()
+
+    def _recv(self, conn, n):
+        data = b''
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _serve_client(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while not self._cancelled:
+                tid, proto, length, unit = struct.unpack(
+                    '>HHHB', self._recv(conn, 7))
+                pdu = self.answer(self._recv(conn, length - 1))
+                conn.sendall(struct.pack('>HHHB', tid, proto, len(pdu) + 1,
+                                         unit) + pdu)
+        except (EOFError, socket.error):
+            pass
+        finally:
+            conn.close()
+
+
+class RTUStandIn(_StandIn):
+
+    def __init__(self, values=address_values, latency=0.0, valid=None,
+                 unit=10):
+        super(RTUStandIn, self).__init__(values, latency, valid)
+        self.unit = unit
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        # Device name for the client to open
+        self.port = os.ttyname(self._slave)
+
+    def _serve(self):
+        buf = b''
+        while not self._cancelled:
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            buf += os.read(self._master, 256)
+            # Read requests are always 8 bytes: unit, function, start,
+            # count, CRC
+            while len(buf) >= 8:
+                frame, buf = buf[:8], buf[8:]
+                if crc16(frame[:6]) != struct.unpack('<H', frame[6:])[0]:
+                    buf = b''  # lost sync; drop everything
+                    break
+                if bytearray(frame)[0] != self.unit:
+                    continue
+                reply = frame[:1] + self.answer(frame[1:6])
+                os.write(self._master, reply + struct.pack('<H',
+                                                           crc16(reply)))
+        os.close(self._master)
+        os.close(self._slave)
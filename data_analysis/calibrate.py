@@ -0,0 +1,401 @@
+"""
+Fit AnalogClient gains and offsets to a reference, streaming the logs.
+
+The notebooks calibrate an analog input by loading every log into pandas
+and calling np.polyfit(an_300v_volt, ds_300v_volt, 1). Here the logs are
+streamed through cleaning.clean_runs instead, which puts each analog input
+and its DeepSea reference onto a common time grid. A LinearFit keeps only
+the least-squares sufficient statistics of each pair (count, means and
+centred sums of squares and products), so months of logs take one pass
+in constant memory. Merging the statistics of one chunk at a time keeps
+them accurate however many points are added.
+
+Outliers, e.g. the DeepSea reading 0 V while the engine starts, are left
+out by a RobustFit. It holds back the first 'warmup' points and seeds the
+fit with a Theil-Sen line through them (the median of the slopes between
+pairs of points), which holds as long as fewer than about a quarter of
+them are bad. The least-squares fit of the points within 'reject' robust
+standard deviations of that line is refined until no more points drop
+out. From then on each new point whose residual from the fit so far is
+more than 'reject' standard deviations is left out. With passes > 1 the
+logs are read again, judging every point against the previous pass's fit,
+until a pass leaves out no more points than the one before.
+
+The logged value is x = gain * v + offset, so a fit y = a * x + b gives the
+new entry [name, units, pin, a * gain, a * offset + b], printed ready for
+the 'analog' measurements of hygen_logger.py:
+    python calibrate.py test_logs --pair an_300v_volt=ds_300v_volt \\
+        --config ../PythonTools/hygen/logger/hygen_logger.py
+"""
+
+import argparse
+import ast
+import math
+
+import numpy as np
+
+from cleaning import clean_runs, PERIOD, MAX_GAP
+
+REJECT = 4.0  # standard deviations beyond which a point is an outlier
+WARMUP = 1000  # points held back to seed the fit
+MAX_PAIRS = 200000  # point pairs the Theil-Sen slope is taken over
+REFINE = 10  # most refits of the seed before giving up on it settling
+LEVEL = 0.95  # confidence level of the intervals
+
+# Analog measurement entries: ['name', 'units', 'pin', gain, offset]
+A_NAME, A_UNITS, A_PIN, A_GAIN, A_OFFSET = range(5)
+
+
+def _quantile(level, dof):
+    """
+    Return the two-sided Student t quantile for a confidence level, or
+    the normal one if scipy is not installed.
+    """
+    p = 0.5 + level / 2.
+    try:
+        from scipy.stats import t
+        return float(t.ppf(p, dof))
+    except ImportError:
+        from statistics import NormalDist
+        return NormalDist().inv_cdf(p)
+
+
+class LinearFit(object):
+    """
+    Least-squares fit of y = slope * x + intercept, from running sums.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.sxx = 0.0  # sum of (x - mean_x)**2
+        self.syy = 0.0
+        self.sxy = 0.0
+        self.rejected = 0  # points left out as outliers
+
+    def add(self, x, y):
+        """
+        Add arrays of points. Pairs with a NaN in either are skipped.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        ok = ~(np.isnan(x) | np.isnan(y))
+        x = x[ok]
+        y = y[ok]
+        if not len(x):
+            return
+        other = LinearFit()
+        other.n = len(x)
+        other.mean_x = x.mean()
+        other.mean_y = y.mean()
+        dx = x - other.mean_x
+        dy = y - other.mean_y
+        other.sxx = np.dot(dx, dx)
+        other.syy = np.dot(dy, dy)
+        other.sxy = np.dot(dx, dy)
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Add the points of another LinearFit (Chan et al.'s pairwise update).
+        """
+        n = self.n + other.n
+        if not other.n:
+            return
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        w = float(self.n) * other.n / n
+        self.sxx += other.sxx + dx * dx * w
+        self.syy += other.syy + dy * dy * w
+        self.sxy += other.sxy + dx * dy * w
+        self.mean_x += dx * other.n / n
+        self.mean_y += dy * other.n / n
+        self.n = n
+        self.rejected += other.rejected
+
+    @property
+    def slope(self):
+        if self.n < 2 or self.sxx <= 0:
+            raise ValueError("Need at least two distinct x values to fit")
+        return self.sxy / self.sxx
+
+    @property
+    def intercept(self):
+        return self.mean_y - self.slope * self.mean_x
+
+    def predict(self, x):
+        return self.slope * np.asarray(x, dtype=np.float64) + self.intercept
+
+    def residual_sd(self):
+        """
+        Return the standard deviation of the residuals.
+        """
+        if self.n < 3:
+            return float('nan')
+        sse = max(self.syy - self.slope * self.sxy, 0.0)
+        return math.sqrt(sse / (self.n - 2))
+
+    def r_squared(self):
+        if self.syy <= 0:
+            return 1.0
+        return self.sxy * self.sxy / (self.sxx * self.syy)
+
+    def covariance(self):
+        """
+        Return the covariance matrix of (slope, intercept).
+        """
+        s2 = self.residual_sd() ** 2
+        var_a = s2 / self.sxx
+        cov = -self.mean_x * var_a
+        var_b = s2 / self.n + self.mean_x ** 2 * var_a
+        return np.array([[var_a, cov], [cov, var_b]])
+
+    def interval(self, coefficients=(1.0, 0.0), constant=0.0, level=LEVEL):
+        """
+        Return the confidence interval (low, high) at level of
+        c0 * slope + c1 * intercept + constant.
+        """
+        c = np.asarray(coefficients, dtype=np.float64)
+        value = c[0] * self.slope + c[1] * self.intercept + constant
+        half = _quantile(level, self.n - 2) * \
+            math.sqrt(max(np.dot(c, np.dot(self.covariance(), c)), 0.0))
+        return value - half, value + half
+
+    def keep(self, x, y, reject=REJECT, reference=None):
+        """
+        Return a mask of the points which are not outliers: those within
+        reject residual standard deviations of the reference fit, by
+        default this one. Everything is kept while the reference has no
+        spread yet.
+        """
+        reference = reference or self
+        keep = np.ones(len(x), dtype=bool)
+        if reject is None or reference.n < 3 or reference.sxx <= 0:
+            return keep
+        sd = reference.residual_sd()
+        if not sd > 0:
+            return keep
+        with np.errstate(invalid='ignore'):
+            keep = np.abs(y - reference.predict(x)) <= reject * sd
+        return keep | np.isnan(x) | np.isnan(y)  # NaNs are skipped anyway
+
+
+def robust_fit(x, y, reject=REJECT):
+    """
+    Fit y = a * x + b robustly to arrays of points without NaNs. Returns
+    (fit, keep): the LinearFit of the points kept and a mask of them.
+    """
+    n = len(x)
+    i, j = np.triu_indices(n, 1)
+    if len(i) > MAX_PAIRS:
+        pick = np.random.RandomState(0).choice(len(i), MAX_PAIRS, False)
+        i, j = i[pick], j[pick]
+    dx = x[j] - x[i]
+    ok = dx != 0
+    keep = np.ones(n, dtype=bool)
+    if ok.any():
+        a = np.median((y[j] - y[i])[ok] / dx[ok])
+        residual = y - a * x
+        residual -= np.median(residual)
+        # Median absolute deviation, scaled to a normal standard deviation
+        sd = 1.4826 * np.median(np.abs(residual))
+        if sd > 0:
+            keep = np.abs(residual) <= reject * sd
+    fit = LinearFit()
+    fit.add(x[keep], y[keep])
+    for _ in range(REFINE):
+        again = fit.keep(x, y, reject)
+        if (again == keep).all():
+            break
+        keep = again
+        fit = LinearFit()
+        fit.add(x[keep], y[keep])
+    fit.rejected = n - int(keep.sum())
+    return fit, keep
+
+
+class RobustFit(object):
+    """
+    Fit points added a chunk at a time, leaving out outliers (see the
+    module docstring).
+    """
+
+    def __init__(self, reject=REJECT, warmup=WARMUP, reference=None):
+        """
+        reject: outlier threshold in residual standard deviations, None to
+            keep every point
+        warmup: points held back to seed the fit
+        reference: a LinearFit to judge every point against instead,
+            e.g. that of a previous pass
+        """
+        self.reject = reject
+        self.warmup = warmup
+        self.reference = reference
+        self.fit = LinearFit()
+        self._held = []  # (x, y) arrays waiting for the seed
+        self._seeded = reject is None or reference is not None
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        ok = ~(np.isnan(x) | np.isnan(y))
+        x = x[ok]
+        y = y[ok]
+        if not self._seeded:
+            need = self.warmup - sum(len(h[0]) for h in self._held)
+            self._held.append((x[:need], y[:need]))
+            x = x[need:]
+            y = y[need:]
+            if len(self._held[-1][0]) == need:
+                self._seed()
+        if not len(x):
+            return
+        if self.reject is not None:
+            keep = self.fit.keep(x, y, self.reject, self.reference)
+            self.fit.rejected += int((~keep).sum())
+            x = x[keep]
+            y = y[keep]
+        self.fit.add(x, y)
+
+    def _seed(self):
+        x = np.concatenate([h[0] for h in self._held])
+        y = np.concatenate([h[1] for h in self._held])
+        self._held = []
+        self._seeded = True
+        if len(x) >= 3:
+            self.fit = robust_fit(x, y, self.reject)[0]
+        else:
+            self.fit.add(x, y)
+
+    def finish(self):
+        """
+        Seed the fit with whatever was held back, if it never got warmup
+        points, and return it.
+        """
+        if not self._seeded:
+            self._seed()
+        return self.fit
+
+
+def calibrate_runs(directory, pairs, date=None, limits=None, period=PERIOD,
+                   max_gap=MAX_GAP, reject=REJECT, warmup=WARMUP, passes=1,
+                   reference=None):
+    """
+    Fit each logged analog value to its reference over every run log in
+    directory (see cleaning.clean_runs).
+
+    pairs: {analog column: reference column}, e.g.
+        {'an_300v_volt': 'ds_300v_volt'}
+    reject, warmup: see RobustFit
+    passes: most passes over the logs. Each pass after the first judges
+        the points against the fit of the one before, and the passes stop
+        once one leaves out no more points than the pass before it.
+    reference: {analog column: LinearFit} to judge the first pass
+        against, e.g. a previous calibration
+
+    Returns {analog column: LinearFit}.
+    """
+    reference = dict(reference or {})
+    fits = {}
+    for _ in range(passes):
+        robust = dict((x, RobustFit(reject, warmup, reference.get(x)))
+                      for x in pairs)
+        for frame in clean_runs(directory, date, limits, period,
+                                max_gap=max_gap):
+            for x_col, y_col in pairs.items():
+                if x_col in frame and y_col in frame:
+                    robust[x_col].add(frame[x_col].to_numpy(np.float64),
+                                      frame[y_col].to_numpy(np.float64))
+        new = dict((x, r.finish()) for x, r in robust.items())
+        settled = fits and all(new[x].rejected <= fits[x].rejected
+                               for x in pairs)
+        fits = reference = new
+        if settled or reject is None:
+            break
+    return fits
+
+
+def update_entry(entry, fit):
+    """
+    Return an analog measurement entry, ['name', 'units', 'pin', gain,
+    offset], with the fit applied to its gain and offset.
+    """
+    a, b = fit.slope, fit.intercept
+    new = list(entry)
+    new[A_GAIN] = a * entry[A_GAIN]
+    new[A_OFFSET] = a * entry[A_OFFSET] + b
+    return new
+
+
+def entry_intervals(entry, fit, level=LEVEL):
+    """
+    Return the confidence intervals of the new gain and offset of an
+    entry as ((low, high), (low, high)).
+    """
+    gain = fit.interval((entry[A_GAIN], 0.0), level=level)
+    offset = fit.interval((entry[A_OFFSET], 1.0), level=level)
+    return tuple(sorted(gain)), offset
+
+
+def format_entry(entry, digits=6):
+    """
+    Format an entry the way hygen_logger.py lists them.
+    """
+    return "[%r, %r, %r, %s, %s]" % (
+        entry[A_NAME], entry[A_UNITS], entry[A_PIN],
+        repr(float('%.*g' % (digits, entry[A_GAIN]))),
+        repr(float('%.*g' % (digits, entry[A_OFFSET]))))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit analog gains and offsets to reference readings")
+    parser.add_argument('directory', help='directory of run logs')
+    parser.add_argument('--pair', action='append', required=True,
+                        metavar='ANALOG=REFERENCE',
+                        help='analog column and the column it should read, '
+                        'e.g. an_300v_volt=ds_300v_volt')
+    parser.add_argument('--config',
+                        help='logger configuration map holding the current '
+                        'analog entries')
+    parser.add_argument('--date', help='only runs from this date, YYYY-MM-DD')
+    parser.add_argument('--period', type=float, default=PERIOD,
+                        help='seconds between aligned points')
+    parser.add_argument('--reject', type=float, default=REJECT,
+                        help='outlier threshold, standard deviations')
+    parser.add_argument('--passes', type=int, default=1,
+                        help='most passes over the logs, see calibrate_runs')
+    parser.add_argument('--level', type=float, default=LEVEL,
+                        help='confidence level of the intervals')
+    args = parser.parse_args()
+
+    pairs = dict(p.split('=', 1) for p in args.pair)
+    entries = {}
+    if args.config:
+        with open(args.config) as f:
+            config = ast.literal_eval(f.read())
+        entries = dict((m[A_NAME], m)
+                       for m in config['analog']['measurements'])
+
+    fits = calibrate_runs(args.directory, pairs, args.date,
+                          period=args.period, reject=args.reject,
+                          passes=args.passes)
+    for name, fit in sorted(fits.items()):
+        if fit.n < 3:
+            print("%s: not enough points" % name)
+            continue
+        lo, hi = fit.interval(level=args.level)
+        print("%s -> %s: y = %.6g x + %.6g, %d points (%d rejected), "
+              "r^2 = %.5f, residual sd %.4g, slope in [%.6g, %.6g]"
+              % (name, pairs[name], fit.slope, fit.intercept, fit.n,
+                 fit.rejected, fit.r_squared(), fit.residual_sd(), lo, hi))
+        entry = entries.get(name, [name, '', '', 1.0, 0.0])
+        gain, offset = entry_intervals(entry, fit, args.level)
+        print("    %s,  # gain in [%.6g, %.6g], offset in [%.6g, %.6g]"
+              % (format_entry(update_entry(entry, fit)), gain[0], gain[1],
+                 offset[0], offset[1]))
+
+
+if __name__ == '__main__':
+    main()
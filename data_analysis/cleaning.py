@@ -0,0 +1,284 @@
+"""
+Clean run logs and align their channels onto one time grid.
+
+The notebooks' massage_data masks bad values with a Python lambda per
+element and converts timestamps one at a time with
+datetime.fromtimestamp. It then fits raw points, which the DeepSea (ds_*)
+and analog (an_*) channels report at different, irregular times. This
+module does the same work on whole NumPy arrays:
+- apply_limits masks values outside declarative {column: (low, high)}
+  ranges
+- to_datetime converts UNIX timestamps in one call
+- Aligner resamples every channel onto a regular grid of 'period'
+  seconds. DeepSea registers hold their value until the next read, so
+  ds_* channels take the previous reading. Analog averages are
+  interpolated linearly. A grid point more than 'max_gap' seconds from
+  its readings is NaN, and grid rows with no readings at all, such as
+  those between runs, are left out.
+
+Aligner is fed one chunk of rows at a time and keeps only the readings it
+still needs between chunks, so clean_runs can stream logs of several days
+in bounded memory.
+
+Usage from a notebook:
+    from cleaning import clean_runs, DEFAULT_LIMITS
+    run = pd.concat(clean_runs("test_logs", date="2016-07-05",
+                               limits=DEFAULT_LIMITS, period=1.0))
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# The ranges the notebooks' massage_data kept
+DEFAULT_LIMITS = {
+    'rpm': (0, 10000),
+    'ds_volt': (100, 400),
+    'ds_cur_300v': (None, 1e8),
+}
+
+# Resampling method by column name prefix, 'linear' for the rest
+METHODS = {'ds_': 'previous', 'an_': 'linear'}
+
+PERIOD = 1.0  # seconds between grid points
+MAX_GAP = 5.0  # seconds from the nearest reading before a point is NaN
+CHUNK_ROWS = 100000  # rows read at a time from CSV logs
+
+
+def apply_limits(df, limits):
+    """
+    Replace values outside their limits with NaN, in place.
+
+    limits: {column: (low, high)}, either bound may be None. Values are
+        kept when low <= value <= high.
+    """
+    for col, (low, high) in limits.items():
+        if col not in df:
+            continue
+        values = df[col].to_numpy(dtype=np.float64, copy=True)
+        bad = np.zeros(len(values), dtype=bool)
+        if low is not None:
+            bad |= values < low
+        if high is not None:
+            bad |= values > high
+        values[bad] = np.nan
+        df[col] = values
+    return df
+
+
+def to_datetime(seconds, tz=None):
+    """
+    Convert an array of UNIX timestamps to a DatetimeIndex: naive UTC, or
+    in time zone tz (e.g. 'US/Pacific') if one is given.
+    """
+    index = pd.to_datetime(np.asarray(seconds, dtype=np.float64), unit='s')
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return index
+
+
+def column_method(name, methods=None):
+    """
+    Return the resampling method of a column, by its name prefix.
+    """
+    for prefix, method in (methods or METHODS).items():
+        if name.startswith(prefix):
+            return method
+    return 'linear'
+
+
+def resample(times, values, grid, method='linear', max_gap=MAX_GAP):
+    """
+    Return the values of one channel at the grid times.
+
+    times, values: the channel's readings in time order, without NaNs
+    method: 'previous' holds each reading until the next one. 'linear'
+        interpolates between the readings either side of a grid time.
+    max_gap: a grid time is NaN if the reading it takes is more than
+        max_gap seconds before it ('previous'), or if the readings either
+        side are more than max_gap seconds apart ('linear'). None for no
+        limit.
+    """
+    out = np.full(len(grid), np.nan)
+    if not len(times):
+        return out
+    prev = np.searchsorted(times, grid, side='right') - 1
+    if method == 'previous':
+        ok = prev >= 0
+        if max_gap is not None:
+            ok &= grid - times[np.maximum(prev, 0)] <= max_gap
+        out[ok] = values[prev[ok]]
+    elif method == 'linear':
+        nxt = np.minimum(prev + 1, len(times) - 1)
+        exact = (prev >= 0) & (times[np.maximum(prev, 0)] == grid)
+        ok = (prev >= 0) & (prev + 1 < len(times))
+        if max_gap is not None:
+            ok &= times[nxt] - times[np.maximum(prev, 0)] <= max_gap
+        out[ok] = np.interp(grid[ok], times, values)
+        out[exact] = values[prev[exact]]
+    else:
+        raise ValueError("Unknown resampling method: %s" % method)
+    return out
+
+
+class Aligner(object):
+    """
+    Resample chunks of a time ordered log onto a common grid.
+
+    feed() each chunk in turn, then finish(). Both return the grid rows
+    that are settled so far, as a DataFrame indexed by grid time: those
+    no later reading can change.
+    """
+
+    def __init__(self, period=PERIOD, methods=None, max_gap=MAX_GAP,
+                 time_column='linuxtime', columns=None, tz=None):
+        """
+        period: seconds between grid points, which fall on whole
+            multiples of period
+        methods: {column name prefix: 'previous' or 'linear'}, METHODS by
+            default
+        columns: the columns to align, every numeric column but the time
+            column by default
+        tz: time zone of the index, see to_datetime
+        """
+        if period <= 0:
+            raise ValueError("period must be positive")
+        self.period = period
+        self.methods = methods
+        self.max_gap = max_gap
+        self.time_column = time_column
+        self.columns = columns
+        self.tz = tz
+        self._readings = None  # column: (times, values) still needed
+        self._next = None  # next grid time to emit
+        self._end = None  # time of the last row fed
+
+    def _start(self, df):
+        if self.columns is None:
+            self.columns = [c for c in df.columns if c != self.time_column
+                            and pd.api.types.is_numeric_dtype(df[c])]
+        self._method = [column_method(c, self.methods) for c in self.columns]
+        self._readings = [(np.empty(0), np.empty(0)) for c in self.columns]
+
+    def feed(self, df):
+        """
+        Add a chunk of rows, later than any fed before.
+        """
+        if self._readings is None:
+            self._start(df)
+        times = df[self.time_column].to_numpy(dtype=np.float64)
+        if not len(times):
+            return self._emit(self._next)
+        if self._next is None:
+            self._next = np.ceil(times[0] / self.period) * self.period
+        for i, col in enumerate(self.columns):
+            values = df[col].to_numpy(dtype=np.float64) if col in df \
+                else np.full(len(times), np.nan)
+            ok = ~np.isnan(values)
+            t, v = self._readings[i]
+            self._readings[i] = (np.concatenate((t, times[ok])),
+                                 np.concatenate((v, values[ok])))
+        self._end = times[-1]
+        return self._emit(self._ready())
+
+    def finish(self):
+        """
+        Return the rows left once every chunk has been fed.
+        """
+        if self._end is None:
+            return self._emit(None)
+        return self._emit(self._end + self.period / 2.)
+
+    def _ready(self):
+        """
+        Return the grid time up to which every channel is settled.
+        """
+        ready = self._end
+        for (t, v), method in zip(self._readings, self._method):
+            if method != 'linear' or not len(t):
+                continue
+            # Later readings can still change points after the last one,
+            # unless they are already too far from it
+            if self.max_gap is None or t[-1] + self.max_gap >= self._end:
+                ready = min(ready, t[-1])
+        return ready
+
+    def _emit(self, ready):
+        """
+        Resample and return the grid points before ready, and forget the
+        readings no later point needs.
+        """
+        if ready is None or self._next is None or ready <= self._next:
+            return None
+        n = int(np.ceil((ready - self._next) / self.period))
+        grid = self._next + self.period * np.arange(n)
+        self._next = grid[-1] + self.period
+        data = {}
+        for i, col in enumerate(self.columns):
+            t, v = self._readings[i]
+            data[col] = resample(t, v, grid, self._method[i], self.max_gap)
+            # Keep the last reading before the next grid time, and those
+            # after it
+            keep = max(np.searchsorted(t, self._next, side='right') - 1, 0)
+            self._readings[i] = (t[keep:], v[keep:])
+        frame = pd.DataFrame(data, index=to_datetime(grid, self.tz),
+                             columns=self.columns)
+        # Leave out the gaps between runs
+        return frame.dropna(how='all')
+
+
+def align(df, period=PERIOD, methods=None, max_gap=MAX_GAP,
+          time_column='linuxtime', tz=None):
+    """
+    Resample a whole log held in memory onto a grid, see Aligner.
+    """
+    aligner = Aligner(period, methods, max_gap, time_column, tz=tz)
+    frames = [f for f in (aligner.feed(df), aligner.finish())
+              if f is not None]
+    if not frames:
+        return None
+    return pd.concat(frames)
+
+
+def iter_chunks(paths, chunk_rows=CHUNK_ROWS):
+    """
+    Yield the rows of run logs as DataFrames of at most chunk_rows rows.
+    Plain CSV logs are read chunk by chunk; binary, sparse and compressed
+    logs, which are at most an hour each, are read a file at a time.
+    """
+    from runloader import read_run
+    for path in paths:
+        if path.endswith('.csv'):
+            with open(path, 'rb') as f:
+                sparse = f.read(1) == b'#'
+            if not sparse:
+                for chunk in pd.read_csv(path, chunksize=chunk_rows):
+                    yield chunk
+                continue
+        df = read_run(path)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+
+def clean_runs(directory, date=None, limits=None, period=PERIOD,
+               methods=None, max_gap=MAX_GAP, time_column='linuxtime',
+               tz=None, chunk_rows=CHUNK_ROWS):
+    """
+    Stream every run log in directory (see runloader.find_runs) through
+    apply_limits and an Aligner. Yields DataFrames on a common grid of
+    period seconds, in time order; pd.concat them or reduce each one.
+    """
+    from runloader import find_runs
+    paths = find_runs(directory, date) if os.path.isdir(directory) \
+        else [directory]
+    aligner = Aligner(period, methods, max_gap, time_column, tz=tz)
+    for chunk in iter_chunks(paths, chunk_rows):
+        if limits:
+            chunk = apply_limits(chunk.copy(), limits)
+        frame = aligner.feed(chunk)
+        if frame is not None:
+            yield frame
+    frame = aligner.finish()
+    if frame is not None:
+        yield frame
@@ -0,0 +1,203 @@
+"""
+Load every run of a test day into one DataFrame.
+
+Log files are named <YYYY-MM-DD>_run<N>.csv by controller_test.py and
+<YYYY-MM-DD_HH>_run<N>.csv (or .bin, either possibly compressed as .gz,
+.zst or .lz4) by the hygen logger's FileWriter. Sparse logs, which only
+hold the values that changed (see deadband.py), are filled back in to one
+row per record, each value carried forward until it next changed.
+load_runs finds all of them in a directory, reads them in parallel, masks
+out-of-range values, concatenates them once and caches the result as one
+memory-mapped .npy file per column. The cache is keyed by the names, sizes
+and modification times of the source files, so it is rebuilt only when a
+log changes.
+
+Usage from a notebook:
+    from runloader import load_runs
+    run = load_runs("test_logs", date="2016-07-05",
+                    limits={'rpm': (0, 10000), 'ds_volt': (100, 400)})
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cleaning import apply_limits, to_datetime
+
+# Reading .bin and compressed logs uses the logger's own readers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'PythonTools', 'hygen', 'logger'))
+
+RUN_PATTERN = re.compile(
+    r'^(?P<date>\d{4}-\d{2}-\d{2})(?:_(?P<hour>\d{2}))?'
+    r'_run(?P<run>\d+)\.(?P<ext>csv|bin)(?:\.(?:gz|zst|lz4))?$')
+
+CACHE_DIR = '.runcache'
+CACHE_VERSION = 2  # bump when the cache layout changes
+
+
+def find_runs(directory, date=None):
+    """
+    Return the paths of all run logs in directory, optionally only those
+    for one date ("YYYY-MM-DD"), in date, hour and run order.
+    """
+    runs = []
+    for name in os.listdir(directory):
+        m = RUN_PATTERN.match(name)
+        if m is None or (date is not None and m.group('date') != date):
+            continue
+        key = (m.group('date'), int(m.group('hour') or -1),
+               int(m.group('run')))
+        runs.append((key, os.path.join(directory, name)))
+    return [path for key, path in sorted(runs)]
+
+
+def read_run(path):
+    """
+    Read one run log (CSV, sparse or binary, possibly compressed) into a
+    DataFrame.
+    """
+    from compress import read_all, uncompressed_name
+    from deadband import SPARSE_MARK
+    if uncompressed_name(path).endswith('.bin'):
+        from binlog import read_binlog
+        header, records = read_binlog(path)
+        df = pd.DataFrame.from_records(np.array(records))
+        return df.rename(columns={'time': 'linuxtime'})
+    if uncompressed_name(path) != path:
+        # Read what survives of a file cut short by a power loss
+        data = read_all(path)
+        if data.startswith(SPARSE_MARK.encode('ascii')):
+            return read_sparse_run(data)
+        return pd.read_csv(io.BytesIO(data))
+    with open(path, 'rb') as f:
+        if f.read(len(SPARSE_MARK)) == SPARSE_MARK.encode('ascii'):
+            f.seek(0)
+            return read_sparse_run(f.read())
+    return pd.read_csv(path)
+
+
+def read_sparse_run(data):
+    """
+    Read the bytes of a sparse log into a dense, forward-filled DataFrame.
+    """
+    from deadband import read_sparse
+    lines = data.decode('ascii', 'replace').splitlines()
+    if not data.endswith(b'\n'):
+        lines = lines[:-1]  # last row cut short
+    names, times, values = read_sparse(lines)
+    df = pd.DataFrame(values, columns=names[1:])
+    df.insert(0, 'linuxtime', times)
+    return df
+
+
+def _source_key(paths, limits):
+    """
+    Return a hash identifying this set of source files and limits.
+    """
+    sources = []
+    for p in paths:
+        st = os.stat(p)
+        sources.append([os.path.basename(p), st.st_size, st.st_mtime_ns])
+    text = json.dumps([CACHE_VERSION, sources,
+                       sorted((k, list(v)) for k, v in limits.items())])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_cache(path, df):
+    """
+    Save each column of df as an .npy file under path. Object columns,
+    e.g. text with missing values, are pickled so that they read back
+    unchanged, and cannot be memory-mapped.
+    """
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = []
+    objects = []
+    for i, col in enumerate(df.columns):
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            objects.append(i)
+        np.save(os.path.join(tmp, '%d.npy' % i), values,
+                allow_pickle=values.dtype == object)
+        columns.append(str(col))
+    with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+        json.dump({'columns': columns, 'objects': objects}, f)
+    os.rename(tmp, path)
+
+
+def _read_cache(path):
+    """
+    Memory-map a cache written by _write_cache into a DataFrame.
+    """
+    with open(os.path.join(path, 'columns.json')) as f:
+        layout = json.load(f)
+    columns = layout['columns']
+    objects = set(layout['objects'])
+    data = {}
+    for i, col in enumerate(columns):
+        name = os.path.join(path, '%d.npy' % i)
+        if i in objects:
+            data[col] = np.load(name, allow_pickle=True)
+        else:
+            data[col] = np.load(name, mmap_mode='r')
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def load_runs(directory, date=None, limits=None, time_column='linuxtime',
+              workers=4, cache=True):
+    """
+    Load, filter and concatenate every run log in directory.
+
+    date: only load runs from this date ("YYYY-MM-DD")
+    limits: {column: (low, high)} range filters, see cleaning.apply_limits
+    time_column: column of UNIX timestamps to use as a DatetimeIndex, or
+        None to keep the default index
+    workers: number of files read in parallel
+    cache: reuse or save a memory-mapped copy of the result in
+        <directory>/.runcache
+
+    Returns a DataFrame, or None if there are no runs.
+    """
+    limits = limits or {}
+    paths = find_runs(directory, date)
+    if not paths:
+        return None
+
+    df = None
+    if cache:
+        prefix = (date or 'all') + '_'
+        cache_root = os.path.join(directory, CACHE_DIR)
+        cache_path = os.path.join(cache_root, prefix
+                                  + _source_key(paths, limits))
+        if os.path.isdir(cache_path):
+            df = _read_cache(cache_path)
+
+    if df is None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(read_run, paths))
+        df = pd.concat(frames, ignore_index=True)
+        apply_limits(df, limits)
+        if cache:
+            # Drop caches of older versions of the same runs
+            if os.path.isdir(cache_root):
+                for name in os.listdir(cache_root):
+                    if name.startswith(prefix):
+                        shutil.rmtree(os.path.join(cache_root, name),
+                                      ignore_errors=True)
+            _write_cache(cache_path, df)
+            df = _read_cache(cache_path)
+
+    if time_column is not None and time_column in df:
+        df.index = to_datetime(df[time_column])
+        df = df.drop(columns=[time_column])
+    return df
@@ -0,0 +1,64 @@
+"""
+Streaming calibration fits.
+"""
+
+import numpy as np
+import pandas as pd
+
+from calibrate import LinearFit, RobustFit, calibrate_runs, update_entry
+
+
+def startup_log(directory, n=3000, bad=200):
+    """
+    Write a log where ds = 1.02 * an + 0.5, except for 'bad' start-up rows
+    at the start where the DeepSea still reads 0 V.
+    """
+    rng = np.random.RandomState(1)
+    an = rng.uniform(100, 300, n)
+    ds = 1.02 * an + 0.5 + rng.normal(0, 0.5, n)
+    ds[:bad] = 0.0
+    pd.DataFrame({'linuxtime': 1468600000 + np.arange(n, dtype=float),
+                  'an_300v_volt': an, 'ds_300v_volt': ds}).to_csv(
+        str(directory.join('2016-07-15_run0.csv')), index=False)
+
+
+def test_merge_matches_polyfit():
+    rng = np.random.RandomState(0)
+    x = rng.normal(1e6, 1.0, 1000)
+    y = 2 * x + 1 + rng.normal(0, 0.01, 1000)
+    fit = LinearFit()
+    for i in range(0, 1000, 7):
+        fit.add(x[i:i + 7], y[i:i + 7])
+    a, b = np.polyfit(x, y, 1)
+    assert abs(fit.slope - a) < 1e-6
+    assert abs(fit.predict(1e6) - (a * 1e6 + b)) < 1e-6
+
+
+def test_warmup_applies_within_a_chunk():
+    rng = np.random.RandomState(2)
+    x = rng.uniform(0, 10, 5000)
+    y = 3 * x - 1 + rng.normal(0, 0.1, 5000)
+    y[2000:2100] = 500.0  # one chunk holding both good and bad points
+    robust = RobustFit(warmup=100)
+    robust.add(x, y)
+    fit = robust.finish()
+    assert fit.rejected == 100
+    assert abs(fit.slope - 3) < 0.01
+
+
+def test_startup_outliers(tmpdir):
+    startup_log(tmpdir)
+    for passes in (1, 2):
+        fit = calibrate_runs(str(tmpdir), {'an_300v_volt': 'ds_300v_volt'},
+                             passes=passes)['an_300v_volt']
+        assert fit.rejected == 200
+        assert abs(fit.slope - 1.02) < 0.002
+        assert abs(fit.intercept - 0.5) < 0.5
+        assert fit.r_squared() > 0.999
+
+
+def test_update_entry():
+    fit = LinearFit()
+    fit.add([1.0, 2.0, 3.0], [3.0, 5.0, 7.0])  # y = 2x + 1
+    assert update_entry(['an_300v_cur', 'A', 'P9_40', 40.0, -0.2], fit) \
+        == ['an_300v_cur', 'A', 'P9_40', 80.0, 0.6]
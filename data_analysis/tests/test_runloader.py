@@ -0,0 +1,44 @@
+"""
+Loading and caching the runs of a test day.
+"""
+
+import os
+
+import numpy as np
+
+from runloader import CACHE_DIR, find_runs, load_runs
+
+
+def write_runs(directory):
+    with open(os.path.join(directory, '2016-07-05_run1.csv'), 'w') as f:
+        f.write('linuxtime,rpm,state\n'
+                '1467700000,1800,run\n'
+                '1467700001,20000,\n')
+    with open(os.path.join(directory, '2016-07-05_run0.csv'), 'w') as f:
+        f.write('linuxtime,rpm,state\n'
+                '1467699000,0,idle\n')
+    with open(os.path.join(directory, '2016-07-06_run0.csv'), 'w') as f:
+        f.write('linuxtime,rpm,state\n'
+                '1467790000,0,idle\n')
+
+
+def test_find_runs_in_order(tmpdir):
+    write_runs(str(tmpdir))
+    names = [os.path.basename(p)
+             for p in find_runs(str(tmpdir), '2016-07-05')]
+    assert names == ['2016-07-05_run0.csv', '2016-07-05_run1.csv']
+
+
+def test_cached_runs_read_back_unchanged(tmpdir):
+    write_runs(str(tmpdir))
+    first = load_runs(str(tmpdir), '2016-07-05',
+                      limits={'rpm': (0, 10000)})
+    assert os.path.isdir(str(tmpdir.join(CACHE_DIR)))
+    cached = load_runs(str(tmpdir), '2016-07-05',
+                       limits={'rpm': (0, 10000)})
+    for df in (first, cached):
+        assert df.rpm.tolist()[:2] == [0.0, 1800.0]
+        assert np.isnan(df.rpm.iloc[2])
+        # A missing text value stays missing rather than becoming 'nan'
+        assert df.state.tolist()[:2] == ['idle', 'run']
+        assert df.state.isnull().tolist() == [False, False, True]